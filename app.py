@@ -1,20 +1,94 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
-from game import UltimateTicTacToe
-from peer import PeerNetwork
+from flask import Flask, Response, g, make_response, render_template, request, jsonify, session, redirect, url_for
+from assets import Assets
+from game import CELL_KEYS, TARGET_KEYS
+from host import GameHost
+from peer import JobsClosed
+from ratings import Ratings
+from records import GameStore
+from spectate import KEEPALIVE_FRAME
+import gzip
 import threading
 import random
+import os
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'  # Required for session
 
-game_instances = {}
-peer_instances = {}
+# Content-hashed copies of static/ written by `python assets.py build`
+assets = Assets()
+app.jinja_env.globals['asset_url'] = assets.url
+
+# Set PEER_TRANSPORT=selector to run every peer on one shared event loop
+# thread instead of a set of threads per user, and PEER_LOOPBACK=1 to keep
+# discovery and peer connections on 127.0.0.1 (load testing on one machine)
+# Finished games and ratings are saved to GAME_DB; set it to an empty string
+# to keep ratings in memory and not save games
+game_db = os.environ.get('GAME_DB', os.path.join('tmp', 'result', 'games.db'))
+host = GameHost(use_transport=os.environ.get('PEER_TRANSPORT') == 'selector',
+                loopback=os.environ.get('PEER_LOOPBACK') == '1',
+                store=GameStore(game_db) if game_db else None,
+                ratings=Ratings(game_db or None))
+game_instances = host.games
+peer_instances = host.peers
+
+# Opening book for /hints, built offline with `python openings.py build`
+opening_book_path = os.environ.get('OPENING_BOOK', os.path.join('tmp', 'result', 'openings.book'))
+opening_book = None
+
+# Polled endpoints are tagged with the peer's version; this keeps tags from
+# an earlier run of the server from matching
+etag_prefix = os.urandom(4).hex()
+
+def unchanged(*version):
+    """304 response if the client already has this version, else None."""
+    g.poll_etag = etag_prefix + '-' + '.'.join(map(str, version))
+    if not request.if_none_match.contains_weak(g.poll_etag):
+        return None
+    return tagged(Response(status=304))
+
+def tagged(response):
+    """Attach the tag computed by unchanged() so the next poll can be a 304."""
+    response.set_etag(g.poll_etag)
+    response.cache_control.no_cache = True  # Browsers must revalidate, never reuse silently
+    return response
+
+# Bodies smaller than this are sent as they are; compressing them costs more than it saves
+GZIP_MIN_SIZE = 1024
+
+@app.after_request
+def compress(response):
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in ('application/json', 'text/html')
+            or request.accept_encodings.quality('gzip') <= 0):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)  # Same content, different bytes
+    return response
+
+def render_page(template, **context):
+    """Render a page with an ETag; an unchanged page is answered with 304."""
+    response = make_response(render_template(template, **context))
+    response.cache_control.no_cache = True  # Always revalidate; it names the current assets
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    return assets.send(filename, request)
 
 @app.route('/')
 def index():
     # Clear any existing session
     session.clear()
-    return render_template('index.html')
+    return render_page('index.html')
 
 @app.route('/create_game', methods=['POST'])
 def create_game():
@@ -25,22 +99,8 @@ def create_game():
     # Store username in session
     session['username'] = username
 
-    # Create game instance
-    game = UltimateTicTacToe(username)
-    
-    # Create peer network instance
-    peer = PeerNetwork(username, game)
-    peer.initialize_udp_socket()
-    peer.initialize_tcp_socket()
-    
-    # Start UDP listener thread
-    udp_listener_thread = threading.Thread(target=peer.listen_for_udp, daemon=True)
-    udp_listener_thread.start()
-    
-    
-    # Store instances
-    game_instances[username] = game
-    peer_instances[username] = peer
+    # Create game and peer network instances
+    host.create_player(username)
     
     return jsonify({'success': True})
 
@@ -48,27 +108,33 @@ def create_game():
 def game():
     if 'username' not in session:
         return redirect(url_for('index'))
-    return render_template('game.html')
+    return render_page('game.html')
 
 @app.route('/lobby')
 def lobby():
     # Check if user is logged in
     if 'username' not in session:
         return redirect(url_for('index'))
-    return render_template('lobby.html')
+    return render_page('lobby.html')
+
+# Endpoints that touch the network hand the work to the host's bounded pool
+# and return a job id at once; the result arrives later via /events as an
+# event with the same id, so request threads never wait on the LAN
+def job_response(job):
+    return jsonify({'success': True, 'pending': True, 'job': job})
+
+@app.errorhandler(JobsClosed)
+def jobs_closed(error):
+    # Raised by PeerNetwork.submit_job once the worker pool has shut down
+    return jsonify({'success': False, 'error': 'Server is shutting down'}), 503
 
 @app.route('/broadcast_request', methods=['POST'])
 def broadcast_request():
     username = session.get('username')
     peer = peer_instances.get(username)
     if peer:
-        success = peer.broadcast_connect_request()
-        if success:
-            return jsonify({'success': True})
-        return jsonify({
-            'success': False, 
-            'error': 'Failed to initialize connection'
-        }), 500
+        # Opens the sockets and starts searching; BROADCAST_RESULT says how it went
+        return job_response(peer.broadcast_connect_request_async())
     return jsonify({'success': False, 'error': 'Peer not found'}), 404
 
 @app.route('/cancel_search', methods=['POST'])
@@ -85,7 +151,11 @@ def get_requests():
     peer = peer_instances.get(username)
     if not peer:
         return jsonify([])
-    return jsonify(peer.get_pending_requests())
+    # An idle lobby polls the same list over and over
+    not_modified = unchanged(peer.expire_requests())
+    if not_modified:
+        return not_modified
+    return tagged(jsonify(peer.get_pending_requests()))
 
 @app.route('/handle_request', methods=['POST'])
 def handle_request():
@@ -94,10 +164,10 @@ def handle_request():
     data = request.json
     
     if peer and data.get('accept'):
-        success = peer.accept_connection(data['username'])
-        if success:
+        opponent_username = data['username']
+
+        def on_connected():
             # Get opponent's game instance
-            opponent_username = data['username']
             opponent_game = game_instances.get(opponent_username)
             my_game = game_instances.get(username)
             
@@ -109,15 +179,69 @@ def handle_request():
                 peer.send_message({
                     'type': 'GAME_START',
                     'first_player': False,  # Broadcasting player goes second
-                    'opponent': username
+                    'opponent': username,
+                    'game_id': my_game.game_id
                 })
-            
-            return jsonify({'success': True})
+
+        # Connect off the request thread, CONNECT_RESULT arrives via /events
+        job = peer.accept_connection_async(opponent_username, on_connected)
+        if job is None:
+            return jsonify({'success': False, 'error': 'Already connecting'})
+        return job_response(job)
     elif peer:
         peer.reject_connection(data['username'])
         return jsonify({'success': True})
     return jsonify({'success': False})
 
+@app.route('/matchmaking/join', methods=['POST'])
+def matchmaking_join():
+    """Queue for a rated opponent; the game starts by itself once one is found."""
+    username = session.get('username')
+    peer = peer_instances.get(username)
+    if not peer:
+        return jsonify({'success': False, 'error': 'Peer not found'}), 404
+    if peer.is_connected:
+        return jsonify({'success': False, 'error': 'Already in a game'})
+    opponent = host.join_queue(username)
+    return jsonify({'success': True, 'matched': opponent is not None,
+                    'status': host.matchmaker.status(username)})
+
+@app.route('/matchmaking/leave', methods=['POST'])
+def matchmaking_leave():
+    return jsonify({'success': host.matchmaker.leave(session.get('username'))})
+
+@app.route('/matchmaking/status')
+def matchmaking_status():
+    """Rating, seconds waited and current rating window, or null once matched.
+
+    ``failed`` is true if a match was found but the game could not be set up.
+    """
+    username = session.get('username')
+    return jsonify({'status': host.matchmaker.status(username),
+                    'failed': host.match_failed(username)})
+
+@app.route('/leaderboard')
+def leaderboard():
+    """The best players (?limit=, default 100) and the logged-in player's rank."""
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    username = session.get('username')
+    not_modified = unchanged(host.ratings.version, limit, username or '')
+    if not_modified:
+        return not_modified
+    me = host.ratings.player(username) if username else None
+    return tagged(jsonify({
+        'players': [dict(player._asdict(), rank=rank) for rank, player in host.ratings.top(limit)],
+        'me': dict(me._asdict(), rank=host.ratings.rank(username)) if me else None
+    }))
+
+@app.route('/events')
+def events():
+    username = session.get('username')
+    peer = peer_instances.get(username)
+    if not peer:
+        return jsonify([])
+    return jsonify(peer.get_events())
+
 @app.route('/check_connection', methods=['GET'])
 def check_connection():
     username = session.get('username')
@@ -126,33 +250,33 @@ def check_connection():
     
     if not peer:
         return jsonify({'connected': False, 'status': 'No peer connection'})
+
+    # One immutable snapshot, no locks. my_turn is read after it: the game
+    # changes before the peer publishes the status, so it is at least as new
+    state = peer.state
+    my_turn = game.my_turn if game else False
+    not_modified = unchanged(state.version, my_turn)
+    if not_modified:
+        return not_modified
     
-    if peer.is_connected:
-        game_status = peer.get_game_status()
-        return jsonify({
+    if state.connected:
+        peer.clear_game_status(state.game_status)
+        return tagged(jsonify({
             'connected': True,
-            'game_status': game_status,
-            'opponent': peer.opponent_username,
-            'my_turn': game.my_turn if game else False
-        })
+            'game_status': state.game_status,
+            'opponent': state.opponent,
+            'my_turn': my_turn
+        }))
     
-    return jsonify({'connected': False, 'status': 'Waiting for connection'})
+    return tagged(jsonify({'connected': False, 'status': 'Waiting for connection'}))
 
 @app.route('/disconnect', methods=['POST'])
 def disconnect():
     username = session.get('username')
     peer = peer_instances.get(username)
     if peer:
-        # Send disconnect message to opponent before closing
-        if peer.is_connected:
-            try:
-                peer.send_message({
-                    'type': 'DISCONNECT',
-                    'message': 'Opponent left the game'
-                })
-            except:
-                pass
-        peer.handle_disconnect("You left the game")
+        # Tells the opponent and closes the connection; DISCONNECT_RESULT follows
+        return job_response(peer.leave_async())
     return jsonify({'success': True})
 
 @app.route('/player_ready', methods=['POST'])
@@ -205,6 +329,13 @@ def start_game():
     if not game or not peer:
         return jsonify({'success': False}), 404
         
+    if game.game_started:
+        # A page refresh; the opponent already knows the game is on
+        return jsonify({
+            'success': True,
+            'first_player': game.symbol == 'X'
+        })
+
     # The player who accepted the connection goes first
     is_first = peer.accepted_connection
     game.start_game(is_first)
@@ -213,7 +344,8 @@ def start_game():
     if peer.is_connected:
         peer.send_message({
             'type': 'GAME_START',
-            'first_player': not is_first  # Opposite for opponent
+            'first_player': not is_first,  # Opposite for opponent
+            'game_id': game.game_id
         })
     
     return jsonify({
@@ -221,9 +353,21 @@ def start_game():
         'first_player': is_first
     })
 
+@app.route('/state')
+def state():
+    """Full game state, or only the moves after ?since=<seq>."""
+    username = session.get('username')
+    game = game_instances.get(username)
+    peer = peer_instances.get(username)
+    if not game:
+        return jsonify({'success': False, 'message': 'Game not found'}), 404
+    state = game.get_state(request.args.get('since', type=int))
+    state['opponent'] = peer.opponent_username if peer else None
+    return jsonify(state)
+
 @app.route('/make_move', methods=['POST'])
 def make_move():
-    data = request.json
+    data = request.get_json(silent=True) or {}
     username = session.get('username')
     game = game_instances.get(username)
     peer = peer_instances.get(username)
@@ -232,33 +376,100 @@ def make_move():
         return jsonify({'valid': False, 'message': 'Game not found'}), 404
     
     if not game.my_turn:
-        return jsonify({'valid': False, 'message': 'Not your turn'})
+        # The browser played ahead of us; send our board to reconcile with
+        return jsonify({'valid': False, 'message': 'Not your turn', 'state': game.get_state()})
     
+    # make_move checks the coordinates, so a malformed body is just an invalid move
     result = game.make_move(
-        data['main_row'],
-        data['main_col'],
-        data['sub_row'],
-        data['sub_col']
+        data.get('main_row'),
+        data.get('main_col'),
+        data.get('sub_row'),
+        data.get('sub_col')
     )
+    if not result['valid']:
+        return jsonify(dict(result, state=game.get_state()))
     
-    # Send move and results to opponent if valid
-    if result['valid'] and peer and peer.is_connected:
+    # Send the move to the opponent if valid; they work out the results
+    # themselves and check their board against our hash
+    if peer and peer.is_connected:
+        # Update turn first, the reply may arrive before send_message returns
+        game.my_turn = False
         peer.send_message({
             'type': 'MOVE',
             'main_row': data['main_row'],
             'main_col': data['main_col'],
             'sub_row': data['sub_row'],
             'sub_col': data['sub_col'],
-            'sub_board_result': result.get('sub_board_result'),
-            'game_over': result.get('game_over'),
-            'winner': result.get('winner'),
-            'is_draw': result.get('is_draw')
+            'seq': result['seq'],
+            'hash': result['hash']
         })
-        # Update turn
-        game.my_turn = False
     
     return jsonify(result)
 
+@app.route('/zobrist')
+def zobrist():
+    """Position hash keys, so the browser can check its board against each move's hash."""
+    response = jsonify({
+        'cells': {symbol: [format(key, '016x') for key in keys] for symbol, keys in CELL_KEYS.items()},
+        'targets': [format(key, '016x') for key in TARGET_KEYS]
+    })
+    # Fixed by the seed in game.py
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
+
+@app.route('/hints')
+def hints():
+    global opening_book
+    username = session.get('username')
+    game = game_instances.get(username)
+    if not game:
+        return jsonify({'success': False, 'message': 'Game not found'}), 404
+    if opening_book is None:
+        if not os.path.exists(opening_book_path):
+            return jsonify({'success': True, 'moves': []})
+        from openings import OpeningBook  # Only loaded once hints are asked for
+        opening_book = OpeningBook(opening_book_path)
+    return jsonify({
+        'success': True,
+        'moves': [{
+            'main_row': entry.move[0],
+            'main_col': entry.move[1],
+            'sub_row': entry.move[2],
+            'sub_col': entry.move[3],
+            'games': entry.games,
+            'score': entry.score
+        } for entry in opening_book.lookup_game(game)[:5]]
+    })
+
+@app.route('/spectate/<username>')
+def spectate(username):
+    return render_page('spectate.html', username=username)
+
+@app.route('/spectate/<username>/stream')
+def spectate_stream(username):
+    channel = host.channels.get(username)
+    if not channel:
+        return jsonify({'success': False, 'message': 'Game not found'}), 404
+    subscriber = channel.subscribe()
+    if subscriber is None:
+        return jsonify({'success': False, 'message': 'Too many spectators'}), 503
+
+    def stream():
+        try:
+            while True:
+                frame = subscriber.next_frame(timeout=15)
+                if frame is None:
+                    if subscriber.closed:
+                        return
+                    frame = KEEPALIVE_FRAME  # Keeps proxies from closing an idle stream
+                yield frame
+        finally:
+            channel.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/get_username')
 def get_username():
     username = session.get('username')
@@ -271,13 +482,7 @@ def logout():
     username = session.get('username')
     if username:
         # Clean up instances
-        if username in game_instances:
-            del game_instances[username]
-        if username in peer_instances:
-            peer = peer_instances[username]
-            if peer:
-                peer.disconnect()
-            del peer_instances[username]
+        host.remove_player(username)
     session.clear()
     return redirect(url_for('index'))
 
@@ -291,12 +496,14 @@ def receive_move():
         return jsonify({'success': False, 'message': 'Game not found'}), 404
     
     # Update the game state with opponent's move
-    game.receive_move(
+    result = game.receive_move(
         data['main_row'],
         data['main_col'],
         data['sub_row'],
         data['sub_col']
     )
+    if not result['valid']:
+        return jsonify({'success': False, 'valid': False, 'message': result['message']})
     
     # Update game status for the receiving player
     game.my_turn = True  # It's now this player's turn
@@ -308,4 +515,5 @@ def receive_move():
     })
 
 if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+    # Development server; see serve.py for production
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1') 
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""Fingerprinted, minified and precompressed static assets.
+
+Build them whenever static/css or static/js changes, and before deploying:
+
+    python assets.py build
+
+Each stylesheet and script is minified and written to static/dist as
+name.<hash>.ext, with a gzip copy (and a brotli copy when the brotli
+module is installed) next to it, and static/dist/manifest.json maps the
+source names to the built ones. Templates link assets through
+asset_url(); a built name changes whenever its content does, so it is
+served with a one-year immutable cache and a returning browser only asks
+for the page itself. Without a build, asset_url() falls back to the plain
+files under /static.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+SOURCE_DIRS = ('css', 'js')
+MANIFEST = 'manifest.json'
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Served in this order of preference when the browser accepts them
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def minify_css(text):
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    text = re.sub(r':\s+', ':', text)
+    return text.replace(';}', '}').strip() + '\n'
+
+
+# A trailing // comment with no quote or slash before it, so it cannot be
+# inside a string, template literal or regex
+_JS_TRAILING_COMMENT = re.compile(r"^([^'\"`/]*?)\s*//.*$")
+
+
+def minify_js(text):
+    """Drop indentation, blank lines and // comments.
+
+    Line breaks are kept, so automatic semicolon insertion still sees the
+    statements the way the source was written.
+    """
+    lines = []
+    for line in text.splitlines():
+        line = _JS_TRAILING_COMMENT.sub(r'\1', line.strip())
+        if line and not line.startswith('//'):
+            lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """Write every asset to dist_dir under its content hash and return the manifest."""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        print('brotli is not installed, writing gzip copies only (pip install brotli)')
+
+    manifest = {}
+    for directory in SOURCE_DIRS:
+        os.makedirs(os.path.join(dist_dir, directory), exist_ok=True)
+        for name in sorted(os.listdir(os.path.join(static_dir, directory))):
+            stem, ext = os.path.splitext(name)
+            if ext not in MINIFIERS:
+                continue
+            with open(os.path.join(static_dir, directory, name), encoding='utf-8') as f:
+                data = MINIFIERS[ext](f.read()).encode('utf-8')
+            built = f'{directory}/{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+            path = os.path.join(dist_dir, built)
+            with open(path, 'wb') as f:
+                f.write(data)
+            with open(path + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli:
+                with open(path + '.br', 'wb') as f:
+                    f.write(brotli.compress(data, quality=11))
+            manifest[f'{directory}/{name}'] = built
+            print(f"{directory}/{name} -> {built} ({len(data)} bytes)")
+
+    # Files from earlier builds are no longer linked from any page
+    keep = {os.path.normpath(built + suffix) for built in manifest.values()
+            for suffix in ('', '.gz', '.br')}
+    for directory in SOURCE_DIRS:
+        for name in os.listdir(os.path.join(dist_dir, directory)):
+            if os.path.normpath(f'{directory}/{name}') not in keep:
+                os.remove(os.path.join(dist_dir, directory, name))
+
+    with open(os.path.join(dist_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class Assets:
+    """Resolves asset names through the build manifest and serves built files."""
+
+    def __init__(self, dist_dir=DIST_DIR, url_prefix='/assets/'):
+        self.dist_dir = dist_dir
+        self.url_prefix = url_prefix
+        self._manifest = None
+
+    @property
+    def manifest(self):
+        # Read on first use; restart the server after a build
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.dist_dir, MANIFEST)) as f:
+                    self._manifest = json.load(f)
+            except FileNotFoundError:
+                self._manifest = {}
+        return self._manifest
+
+    def url(self, path):
+        """URL for a file under static/, e.g. url('js/game.js')."""
+        built = self.manifest.get(path)
+        if built is None:
+            return '/static/' + path
+        return self.url_prefix + built
+
+    def send(self, filename, request):
+        """Response for a built file, precompressed if the request accepts it."""
+        from flask import abort, send_from_directory
+
+        if filename not in self.manifest.values():
+            abort(404)
+        sent = filename
+        encoding = None
+        for name, suffix in ENCODINGS:
+            if (request.accept_encodings.quality(name) > 0
+                    and os.path.exists(os.path.join(self.dist_dir, filename + suffix))):
+                sent, encoding = filename + suffix, name
+                break
+        response = send_from_directory(self.dist_dir, sent, max_age=IMMUTABLE_MAX_AGE,
+                                       mimetype=_mimetype(filename))
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+def _mimetype(filename):
+    return {'.css': 'text/css', '.js': 'text/javascript'}[os.path.splitext(filename)[1]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the static assets.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build')
+    parser.parse_args()
+    build()
+
+
+if __name__ == '__main__':
+    main()
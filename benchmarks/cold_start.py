@@ -0,0 +1,79 @@
+"""Time from launching serve.py to its first served requests.
+
+Run from the repository root:
+
+    python -m benchmarks.cold_start [--runs 5] [--budget 1.0]
+
+Each run starts a fresh `serve.py` in loopback mode, then polls `/` until
+it answers and immediately creates a player with `/create_game` followed
+by `/get_requests` (which opens the player's sockets). Reports the median
+and worst time for each step, and exits with status 1 if the median time
+to the first `/create_game` response is over ``--budget`` seconds.
+"""
+import argparse
+import http.cookiejar
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+
+
+def cold_start(port, backend):
+    """Start one server and return seconds to the first /, /create_game and /get_requests."""
+    env = dict(os.environ, PEER_LOOPBACK='1', GAME_DB=os.path.join(tempfile.gettempdir(), 'cold_start.db'))
+    base_url = f'http://127.0.0.1:{port}'
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, 'serve.py', '--backend', backend, '--host', '127.0.0.1',
+         '--port', str(port), '--drain-timeout', '1'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError('Server exited during startup')
+            try:
+                opener.open(base_url + '/', timeout=1).read()
+                break
+            except OSError:
+                time.sleep(0.005)
+        first_page = time.perf_counter() - start
+        opener.open(base_url + '/create_game',
+                    urllib.parse.urlencode({'username': f'cold{port}'}).encode(), timeout=5).read()
+        first_player = time.perf_counter() - start
+        opener.open(base_url + '/get_requests', timeout=5).read()
+        first_poll = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    return first_page, first_player, first_poll
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--port', type=int, default=5060)
+    parser.add_argument('--backend', default='threaded')
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help='seconds allowed from launch to the first /create_game response')
+    args = parser.parse_args()
+
+    samples = [cold_start(args.port + i, args.backend) for i in range(args.runs)]
+    print(f"{'step':<16}{'median ms':>12}{'max ms':>10}")
+    for name, values in zip(('/', '/create_game', '/get_requests'), zip(*samples)):
+        print(f"{name:<16}{statistics.median(values) * 1000:>12.0f}{max(values) * 1000:>10.0f}")
+
+    median = statistics.median(sample[1] for sample in samples)
+    if median > args.budget:
+        print(f"\nOver budget: {median:.2f} s > {args.budget:.2f} s")
+        sys.exit(1)
+    print(f"\nWithin budget: {median:.2f} s <= {args.budget:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
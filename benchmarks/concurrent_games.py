@@ -0,0 +1,141 @@
+"""Many concurrent games in one process on the shared selector transport.
+
+Run from the repository root:
+
+    python -m benchmarks.concurrent_games [--games 1000] [--move-interval 2] [--duration 20] [--seed 1]
+
+Creates 2 x N players in one GameHost, connects each pair over loopback
+TCP, then plays random legal moves in every game at once, one move per
+game every ``--move-interval`` seconds (players think; a game does not
+run flat out). After a few seconds' warm-up it measures CPU time over
+``--duration`` seconds of this steady state and reports the share of a
+core each game costs, and so how many such games one core could hold;
+the target is at least 1,000 per core. Only the game and peer layers
+are measured, not the web requests that drive them in a real server.
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+import threading
+import time
+
+from host import GameHost
+
+
+def connect_pairs(host, games):
+    """Create the players and connect each pair, returning the matches."""
+    matches = []
+    for i in range(games):
+        first_game, first = host.create_player(f'p{i}a')
+        second_game, second = host.create_player(f'p{i}b')
+        second.ensure_sockets()  # Listen before first connects
+        # Stand in for discovery so only the TCP side is measured
+        first.pending_requests = [{
+            'username': second.username, 'ip': '127.0.0.1', 'addresses': ['127.0.0.1'],
+            'tcp_port': second.tcp_port, 'timestamp': time.time(), 'strength': 1
+        }]
+        first.accept_connection_async(second.username)
+        matches.append(((first_game, first), (second_game, second)))
+    deadline = time.time() + 60
+    while not all(a[1].is_connected and b[1].is_connected for a, b in matches):
+        if time.time() > deadline:
+            raise RuntimeError('Timed out connecting players')
+        time.sleep(0.01)
+    for (first_game, _), (second_game, _) in matches:
+        first_game.start_game(True)
+        second_game.start_game(False, first_game.game_id)
+    return matches
+
+
+def play(matches, rng, move_interval, warmup, duration):
+    """Play one random legal move per game every ``move_interval`` seconds.
+
+    Returns (moves, wall seconds, CPU seconds, games playing at the start
+    of the window, at its end) for the ``duration`` seconds after ``warmup``.
+    """
+    start = time.perf_counter()
+    window_start, window_end = start + warmup, start + warmup + duration
+    # Games start spread over one interval, as players would arrive
+    due = [(start + rng.uniform(0, move_interval), i) for i in range(len(matches))]
+    heapq.heapify(due)
+    playing = len(matches)
+    moves = 0
+    window = None  # (moves, wall, cpu, playing) when the window opened
+    while due:
+        now = time.perf_counter()
+        if window is None and now >= window_start:
+            window = (moves, now, time.process_time(), playing)
+        if now >= window_end:
+            break
+        at, i = due[0]
+        if at > now:
+            time.sleep(min(at, window_end) - now)
+            continue
+        heapq.heappop(due)
+        mover = next(((game, peer) for game, peer in matches[i] if game.my_turn), None)
+        if mover is None:
+            heapq.heappush(due, (now + 0.001, i))  # The last move is still on its way
+            continue
+        game, peer = mover
+        legal = game.get_legal_moves()
+        if legal:
+            main_row, main_col, sub_row, sub_col = rng.choice(legal)
+            result = game.make_move(main_row, main_col, sub_row, sub_col)
+            game.my_turn = False
+            peer.send_message({
+                'type': 'MOVE', 'main_row': main_row, 'main_col': main_col,
+                'sub_row': sub_row, 'sub_col': sub_col, 'seq': result['seq'],
+                'hash': result['hash']
+            })
+            moves += 1
+        if not legal or result['game_over']:
+            playing -= 1
+        else:
+            heapq.heappush(due, (at + move_interval, i))
+    wall, cpu = time.perf_counter(), time.process_time()
+    if window is None:
+        raise RuntimeError('Every game finished during the warm-up')
+    return moves - window[0], wall - window[1], cpu - window[2], window[3], playing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--move-interval', type=float, default=2.0,
+                        help='seconds between moves in each game')
+    parser.add_argument('--warmup', type=float, default=5.0)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds measured')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    # The game and peer layers print every move, from the transport thread
+    # too; silence them for the whole run and report on the real stdout
+    out = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+
+    host = GameHost(use_transport=True)
+    start_wall = time.perf_counter()
+    matches = connect_pairs(host, args.games)
+    connect_time = time.perf_counter() - start_wall
+    threads = threading.active_count()
+    moves, wall, cpu, first, last = play(matches, rng, args.move_interval,
+                                         args.warmup, args.duration)
+    playing = (first + last) / 2  # Games only finish, so about the average
+    per_game = cpu / wall / max(playing, 1)  # Share of a core
+
+    print(f"games            {args.games}, {last}-{first} playing while measured", file=out)
+    print(f"threads          {threads}", file=out)
+    print(f"connect time     {connect_time:.2f} s", file=out)
+    print(f"measured         {wall:.1f} s   cpu {cpu:.2f} s   ({cpu / wall:.2f} cores)", file=out)
+    print(f"moves            {moves}   ({moves / wall:.0f} moves/s, "
+          f"{cpu / max(moves, 1) * 1e6:.0f} us cpu each)", file=out)
+    print(f"cpu per game     {per_game * 100:.3f}% of a core at one move "
+          f"every {args.move_interval:g} s", file=out)
+    print(f"games per core   {1 / max(per_game, 1e-12):.0f}", file=out)
+
+
+if __name__ == '__main__':
+    main()
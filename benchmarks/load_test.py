@@ -0,0 +1,283 @@
+"""Load generator for the full HTTP + P2P stack.
+
+Run from the repository root, either against a running server started with
+PEER_LOOPBACK=1 (so discovery and peer sockets stay on 127.0.0.1):
+
+    PEER_LOOPBACK=1 python app.py
+    python -m benchmarks.load_test --url http://127.0.0.1:5000 --players 20
+
+or let the tool start its own server:
+
+    python -m benchmarks.load_test --spawn --players 20 --seed 1
+
+Players are paired up: the even player of each pair broadcasts, the odd one
+polls /get_requests and accepts it. Both then call /start_game and play
+random legal moves (mirrored on a local UltimateTicTacToe) with random think
+times, polling /check_connection for the opponent's moves. Think times,
+moves and pairing are all drawn from the seed.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+from game import UltimateTicTacToe
+
+
+class Stats:
+    """Latency samples and failures per endpoint, shared by all players."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.failures = defaultdict(int)
+
+    def record(self, endpoint, seconds, ok):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.failures[endpoint] += 1
+
+    def report(self, wall):
+        total = sum(len(samples) for samples in self.latencies.values())
+        print(f"{'endpoint':<20}{'requests':>10}{'p50 ms':>10}{'p99 ms':>10}{'fail %':>9}")
+        for endpoint in sorted(self.latencies):
+            samples = sorted(self.latencies[endpoint])
+            p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+            fail_rate = 100 * self.failures[endpoint] / len(samples)
+            print(f"{endpoint:<20}{len(samples):>10}{statistics.median(samples) * 1000:>10.2f}"
+                  f"{p99 * 1000:>10.2f}{fail_rate:>9.2f}")
+        print(f"\n{total} requests in {wall:.1f} s ({total / wall:.1f} req/s)")
+
+
+class Player:
+    """One simulated browser with its own cookie jar."""
+
+    def __init__(self, base_url, username, stats, rng, think_min, think_max, poll_interval):
+        self.base_url = base_url
+        self.username = username
+        self.stats = stats
+        self.rng = rng
+        self.think_min = think_min
+        self.think_max = think_max
+        self.poll_interval = poll_interval
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.game = UltimateTicTacToe(username)  # Local mirror for legal moves
+        self.opponent_moves = []  # MOVE statuses not yet applied to the mirror
+        self.cached = {}  # GET endpoint -> (ETag, body), revalidated like a browser would
+        self.result = None
+
+    def call(self, endpoint, json_body=None, form=None, method=None):
+        """Make one request, recording latency; returns the decoded JSON or None."""
+        data, headers = None, {}
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode()
+        method = method or ('POST' if data is not None else 'GET')
+        if method == 'GET' and endpoint in self.cached:
+            headers['If-None-Match'] = self.cached[endpoint][0]
+        request = urllib.request.Request(self.base_url + endpoint, data=data, headers=headers,
+                                         method=method)
+        start = time.perf_counter()
+        body, ok = None, False
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                content = response.read()
+                ok = True
+            if response.headers.get_content_type() == 'application/json':
+                body = json.loads(content)
+                if method == 'GET' and response.headers.get('ETag'):
+                    self.cached[endpoint] = (response.headers['ETag'], body)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                body, ok = self.cached[endpoint][1], True
+        except (urllib.error.URLError, OSError, ValueError):
+            pass
+        self.stats.record(endpoint, time.perf_counter() - start, ok)
+        return body
+
+    def check_connection(self):
+        """Poll /check_connection, keeping any opponent move for play()."""
+        status = self.call('/check_connection') or {}
+        game_status = status.get('game_status') or {}
+        if isinstance(game_status, dict) and game_status.get('type') == 'MOVE':
+            self.opponent_moves.append(game_status)
+        return status
+
+    def think(self):
+        time.sleep(self.rng.uniform(self.think_min, self.think_max))
+
+    def wait_for(self, check, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            result = check()
+            if result:
+                return result
+            time.sleep(self.poll_interval)
+        return None
+
+    def host(self):
+        """Broadcast and wait for the partner to connect."""
+        self.call('/broadcast_request', method='POST')
+
+        def started():
+            return self.check_connection().get('connected')
+        return self.wait_for(started)
+
+    def join(self, partner):
+        """Wait for the partner's broadcast, then accept it."""
+        def visible():
+            requests = self.call('/get_requests') or []
+            return any(r['username'] == partner for r in requests)
+        if not self.wait_for(visible):
+            return False
+        accepted = self.call('/handle_request', json_body={'username': partner, 'accept': True}) or {}
+        if not accepted.get('success'):
+            return False
+
+        def connected():
+            events = self.call('/events') or []
+            return next((e for e in events if e.get('job') == accepted['job']), None)
+        result = self.wait_for(connected)
+        return bool(result and result['success'])
+
+    def play(self):
+        """Play random legal moves until the game ends."""
+        start = self.call('/start_game', method='POST') or {}
+        if not start.get('success'):
+            return 'failed'
+        self.game.start_game(start['first_player'])
+        while True:
+            if self.game.my_turn:
+                self.think()
+                move = self.rng.choice(self.game.get_legal_moves())
+                result = self.call('/make_move', json_body=dict(zip(
+                    ('main_row', 'main_col', 'sub_row', 'sub_col'), move))) or {}
+                if not result.get('valid'):
+                    return 'failed'
+                self.game.make_move(*move)
+                self.game.my_turn = False
+                if result['game_over']:
+                    return 'finished'
+                continue
+
+            if self.opponent_moves:
+                move = self.opponent_moves.pop(0)
+                result = self.game.receive_move(move['main_row'], move['main_col'],
+                                                move['sub_row'], move['sub_col'])
+                if result['game_over']:
+                    return 'finished'
+                continue
+
+            if not self.check_connection().get('connected'):
+                return 'disconnected'
+            if not self.opponent_moves:
+                time.sleep(self.poll_interval)
+
+    def run(self, partner, hosting, done):
+        if not (self.call('/create_game', form={'username': self.username}) or {}).get('success'):
+            self.result = 'failed'
+            return
+        connected = self.host() if hosting else self.join(partner)
+        self.result = self.play() if connected else 'not connected'
+        # Disconnecting first would hide the last move from the partner
+        try:
+            done.wait(timeout=30)
+        except threading.BrokenBarrierError:
+            pass
+        self.call('/disconnect', method='POST')
+        self.call('/logout')
+
+
+def spawn_server(port):
+    """Start app.py in loopback mode and wait for it to answer."""
+    env = dict(os.environ, PEER_LOOPBACK='1')
+    server = subprocess.Popen(
+        [sys.executable, '-c', f'import app; app.app.run(port={port}, threaded=True)'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/get_username', timeout=1)
+        except urllib.error.HTTPError:
+            return server, base_url  # 401 means the server is up
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError('Server did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--spawn', action='store_true', help='start app.py in loopback mode')
+    parser.add_argument('--port', type=int, default=5050, help='port for --spawn')
+    parser.add_argument('--players', type=int, default=10, help='rounded up to an even number')
+    parser.add_argument('--think-min', type=float, default=0.05, help='seconds')
+    parser.add_argument('--think-max', type=float, default=0.2, help='seconds')
+    parser.add_argument('--poll-interval', type=float, default=0.1, help='seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url.rstrip('/')
+    if args.spawn:
+        server, base_url = spawn_server(args.port)
+
+    rng = random.Random(args.seed)
+    stats = Stats()
+    players = []
+    # Keeps usernames unique across runs on one server; not from the seeded
+    # generator, which repeats with the same --seed
+    run_id = os.urandom(4).hex()
+    for i in range((args.players + 1) // 2 * 2):
+        players.append(Player(base_url, f'load-{run_id}-{i}', stats,
+                              random.Random(rng.randrange(1 << 32)),
+                              args.think_min, args.think_max, args.poll_interval))
+
+    threads = []
+    for i, player in enumerate(players):
+        if i % 2 == 0:
+            done = threading.Barrier(2)
+        partner = players[i ^ 1].username
+        threads.append(threading.Thread(target=player.run, args=(partner, i % 2 == 0, done),
+                                        daemon=True))
+    # The local mirror games print every move; report on the real stdout
+    out = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    wall = time.perf_counter() - start
+    sys.stdout = out
+
+    stats.report(wall)
+    outcomes = defaultdict(int)
+    for player in players:
+        outcomes[player.result] += 1
+    print('outcomes: ' + ', '.join(f'{k}={v}' for k, v in sorted(outcomes.items(), key=str)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Matchmaking queue cost and match quality with many players.
+
+Run from the repository root:
+
+    python -m benchmarks.matchmaking [--players 100000] [--rate 200] [--backlog 5000]
+        [--spread 350] [--seed 1]
+
+Simulates ``--backlog`` players queueing at once (a server coming back
+up, or a tournament round ending), then players arriving at ``--rate``
+per second, all with normally distributed ratings, on a simulated clock
+(no sleeping, no sockets). The matcher is ticked every half second.
+Reports the time per join and per tick, the slowest tick, how long the
+backlog took to clear, how long players waited and how far apart matched
+ratings were. Ratings have a standard deviation of ``--spread``; with
+the default most of a burst pairs off as it joins, while a spread of
+1000000 leaves players too far apart to match and keeps thousands queued.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from matchmaking import Matchmaker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=100000)
+    parser.add_argument('--rate', type=float, default=200, help='arrivals per second')
+    parser.add_argument('--backlog', type=int, default=5000,
+                        help='players already queued when the arrivals start')
+    parser.add_argument('--spread', type=float, default=350, help='rating standard deviation')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    ratings, joined, waits, gaps = {}, {}, [], []
+    backlog = set()
+    now = 0.0
+    cleared_at = None
+
+    def matched(first, second):
+        nonlocal cleared_at
+        waits.extend(now - joined[name] for name in (first, second))
+        gaps.append(abs(ratings[first] - ratings[second]))
+        backlog.difference_update((first, second))
+        if cleared_at is None and not backlog:
+            cleared_at = now
+
+    # Ticked by hand below, on the simulated clock
+    matchmaker = Matchmaker(matched, start_thread=False)
+    join_time = tick_time = slowest_tick = 0.0
+    ticks = 0
+    next_tick = 0.5
+    peak = 0
+
+    def join(name):
+        nonlocal join_time, peak
+        ratings[name] = rng.gauss(1500, args.spread)
+        joined[name] = now
+        start = time.perf_counter()
+        matchmaker.join(name, ratings[name], now)
+        join_time += time.perf_counter() - start
+        peak = max(peak, len(matchmaker.tickets))
+
+    start = time.perf_counter()
+    for i in range(args.backlog):
+        backlog.add(f'b{i}')
+        join(f'b{i}')
+    burst_time = time.perf_counter() - start
+    burst_queued = len(matchmaker.tickets)
+    backlog &= matchmaker.tickets.keys()  # Those matched on joining are served already
+    if not backlog:
+        cleared_at = 0.0
+
+    for i in range(args.players):
+        now += rng.expovariate(args.rate)
+        while next_tick <= now:
+            now, arrival = next_tick, now
+            start = time.perf_counter()
+            matchmaker.tick(now)
+            elapsed = time.perf_counter() - start
+            tick_time += elapsed
+            slowest_tick = max(slowest_tick, elapsed)
+            ticks += 1
+            next_tick += 0.5
+            now = arrival
+        join(f'p{i}')
+
+    waits.sort()
+    total = args.backlog + args.players
+    print(f"players       {args.players} over {now:.0f} s after a backlog of {args.backlog}, "
+          f"peak queue {peak}")
+    print(f"join          {join_time / max(total, 1) * 1e6:.1f} us each")
+    print(f"tick          {tick_time / max(ticks, 1) * 1e3:.2f} ms each, slowest "
+          f"{slowest_tick * 1e3:.2f} ms ({ticks} ticks)")
+    if args.backlog:
+        cleared = f"{cleared_at:.1f} s" if cleared_at is not None else f"no, {len(backlog)} left"
+        print(f"backlog       joined in {burst_time * 1e3:.0f} ms, {burst_queued} "
+              f"queued after it, cleared {cleared}")
+    print(f"matched       {len(gaps)} pairs, {matchmaker.stats()['queued']} still queued")
+    print(f"wait          p50 {waits[len(waits) // 2]:.1f} s   p99 {waits[int(len(waits) * 0.99)]:.1f} s")
+    print(f"rating gap    mean {statistics.mean(gaps):.0f}   max {max(gaps):.0f}")
+
+
+if __name__ == '__main__':
+    main()
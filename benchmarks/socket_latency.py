@@ -0,0 +1,88 @@
+"""Round-trip latency of peer MOVE messages with and without socket tuning.
+
+Run from the repository root:
+
+    python -m benchmarks.socket_latency [--rounds 200]
+
+Each round the client writes a MOVE message in two small writes (the way a
+message and its follow-up hit the wire back-to-back) and waits for a reply.
+With Nagle enabled the second write waits for the first to be ACKed, which
+shows up as a large p50/p99 on most stacks.
+"""
+import argparse
+import pickle
+import socket
+import statistics
+import threading
+import time
+
+from sockopts import DEFAULT_OPTIONS, SYSTEM_DEFAULT_OPTIONS
+
+MOVE = pickle.dumps({
+    'type': 'MOVE', 'main_row': 1, 'main_col': 1, 'sub_row': 1, 'sub_col': 2,
+    'sub_board_result': None, 'game_over': False, 'winner': None, 'is_draw': False
+})
+
+
+def recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Peer closed')
+        data += chunk
+    return data
+
+
+def serve(listener, options, rounds):
+    conn, _ = listener.accept()
+    options.apply(conn)
+    with conn:
+        for _ in range(rounds):
+            recv_exactly(conn, len(MOVE))
+            conn.sendall(b'k')
+
+
+def run(options, rounds):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    options.apply_buffers(listener)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    server = threading.Thread(target=serve, args=(listener, options, rounds), daemon=True)
+    server.start()
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    options.apply(client)
+    client.connect(listener.getsockname())
+    half = len(MOVE) // 2
+    samples = []
+    with client:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            client.send(MOVE[:half])
+            client.send(MOVE[half:])
+            recv_exactly(client, 1)
+            samples.append((time.perf_counter() - start) * 1000)
+    server.join()
+    listener.close()
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{name:<16} p50 {statistics.median(samples):8.3f} ms   "
+          f"p99 {p99:8.3f} ms   max {samples[-1]:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    report('system default', run(SYSTEM_DEFAULT_OPTIONS, args.rounds))
+    report('tuned profile', run(DEFAULT_OPTIONS, args.rounds))
+
+
+if __name__ == '__main__':
+    main()
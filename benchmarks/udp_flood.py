@@ -0,0 +1,152 @@
+"""Discovery keeps working while the UDP port is flooded.
+
+Run from the repository root:
+
+    python -m benchmarks.udp_flood [--seconds 5] [--senders 2] [--rate 50000] [--min-delivered 0.95]
+
+Starts two players on the shared selector transport, then blasts port
+5005 from 127.0.0.2 with junk, oversized and well-formed datagrams at
+``--rate`` per second, from sender processes. Meanwhile a well-behaved client on 127.0.0.3
+broadcasts a connection request every 100 ms. Reports how many of those
+reached the players' pending requests and how fast, the event loop's lag,
+and the drop counters, and exits with status 1 if fewer than
+``--min-delivered`` of them arrived within 100 ms.
+"""
+import argparse
+import multiprocessing
+import os
+import pickle
+import socket
+import sys
+import threading
+import time
+
+from host import GameHost
+
+PORT = 5005
+
+
+def flood(stop, counter, rate):
+    """Send a rotating mix of bad and rate-limited datagrams until stopped.
+
+    Runs in its own process, as a flood from another machine would, so
+    the senders do not take the receiving loop's share of the GIL.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.2', 0))
+    payloads = [
+        os.urandom(64),  # Not a pickle
+        b'\x80\x04' + os.urandom(4000),  # Oversized
+        pickle.dumps({'type': 'PING'}),  # Unknown type
+        pickle.dumps({'type': 'CONNECT_REQUEST', 'username': 'flooder', 'local_ip': '127.0.0.2',
+                      'tcp_port': 1, 'addresses': []}),  # Valid, but far too often
+    ]
+    sent = 0
+    start = time.perf_counter()
+    while not stop.is_set():
+        if rate:
+            # Sleep off any lead over the target rate
+            ahead = sent / rate - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+        # Valid, and a new name every time, to fill the lobby
+        fresh = pickle.dumps({'type': 'CONNECT_REQUEST', 'username': f'flooder{sent}',
+                              'local_ip': '127.0.0.2', 'tcp_port': 1, 'addresses': []})
+        for payload in payloads + [fresh]:
+            try:
+                sock.sendto(payload, ('127.0.0.1', PORT))
+                sent += 1
+            except OSError:
+                pass  # Socket buffer full; keep going
+    with counter.get_lock():
+        counter.value += sent
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--senders', type=int, default=2)
+    parser.add_argument('--rate', type=float, default=50000,
+                        help='flood datagrams per second from all senders, 0 for as fast as possible')
+    parser.add_argument('--min-delivered', type=float, default=0.95,
+                        help='share of legitimate requests that must arrive')
+    args = parser.parse_args()
+
+    out = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+
+    host = GameHost(use_transport=True)
+    _, alice = host.create_player('alice')
+    _, bob = host.create_player('bob')
+    alice.ensure_sockets()
+    bob.ensure_sockets()
+    time.sleep(0.2)
+
+    stop = multiprocessing.Event()
+    flooded = multiprocessing.Value('q', 0)
+    senders = [multiprocessing.Process(target=flood, args=(stop, flooded, args.rate / args.senders),
+                                       daemon=True)
+               for _ in range(args.senders)]
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    for sender in senders:
+        sender.start()
+
+    # A legitimate player searching from another address
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.bind(('127.0.0.3', 0))
+    latencies, loop_lags = [], []
+    sent_requests = 0
+    deadline = time.perf_counter() + args.seconds
+    while time.perf_counter() < deadline:
+        name = f'carol{sent_requests}'
+        client.sendto(pickle.dumps({'type': 'CONNECT_REQUEST', 'username': name,
+                                    'local_ip': '127.0.0.3', 'tcp_port': 1, 'addresses': []}),
+                      ('127.0.0.1', PORT))
+        sent_at = time.perf_counter()
+        sent_requests += 1
+
+        scheduled = time.perf_counter()
+        ran = threading.Event()
+        host.transport.call_soon(lambda: (loop_lags.append(time.perf_counter() - scheduled), ran.set()))
+        ran.wait(1)
+
+        while time.perf_counter() < sent_at + 0.1:
+            if any(r['username'] == name for r in bob.pending_requests):
+                latencies.append(time.perf_counter() - sent_at)
+                break
+            time.sleep(0.001)
+        time.sleep(max(0, sent_at + 0.1 - time.perf_counter()))
+
+    stop.set()
+    for sender in senders:
+        sender.join()
+    wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+    # Checked once for every player on the transport, then per player
+    drops = dict(bob.discovery_filter.drops.snapshot(), **bob.drops.snapshot())
+    pending = len(bob.pending_requests)
+    host.remove_player('alice')
+    host.remove_player('bob')
+
+    print(f"flood datagrams sent  {flooded.value} ({flooded.value / wall:.0f}/s)", file=out)
+    print(f"legit requests seen   {len(latencies)}/{sent_requests} within 100 ms", file=out)
+    print(f"discovery latency     p50 {percentile(latencies, 0.5) * 1000:.2f} ms   "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms", file=out)
+    print(f"event loop lag        p50 {percentile(loop_lags, 0.5) * 1000:.2f} ms   "
+          f"p99 {percentile(loop_lags, 0.99) * 1000:.2f} ms", file=out)
+    print(f"cpu                   {cpu / wall:.2f} cores (receiving process)", file=out)
+    print(f"drops                 {drops}", file=out)
+    print(f"pending requests      {pending} (capped at {bob.MAX_PENDING_REQUESTS})", file=out)
+    delivered = len(latencies) / max(sent_requests, 1)
+    if delivered < args.min_delivered:
+        print(f"FAIL: {delivered:.0%} of legitimate requests delivered, "
+              f"below {args.min_delivered:.0%}", file=out)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
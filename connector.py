@@ -0,0 +1,116 @@
+import errno
+import ipaddress
+import selectors
+import socket
+import time
+from typing import List, Tuple
+
+# Advertised addresses come from the network; a host has only a few
+MAX_ADDRESSES = 8
+
+
+def _ip_version(address):
+    """4 or 6, or None if ``address`` is not an IP address string."""
+    if not isinstance(address, str):
+        return None
+    try:
+        return ipaddress.ip_address(address).version
+    except ValueError:
+        return None
+
+
+def order_addresses(preferred: str, addresses: List[str]) -> List[str]:
+    """Order candidate addresses for racing.
+
+    The address the request was actually received from goes first, then the
+    rest alternate between address families (RFC 8305 section 4) so one
+    broken family cannot hold up every attempt. ``addresses`` is untrusted:
+    anything but a list is ignored, entries that are not IP addresses are
+    skipped and at most MAX_ADDRESSES are kept.
+    """
+    if not isinstance(addresses, (list, tuple)):
+        addresses = []
+    candidates = []
+    for address in [preferred] + list(addresses[:MAX_ADDRESSES]):
+        if address not in candidates and _ip_version(address):
+            candidates.append(address)
+    if not candidates:
+        return []
+    first_version = _ip_version(candidates[0])
+    same = [a for a in candidates[1:] if _ip_version(a) == first_version]
+    other = [a for a in candidates[1:] if _ip_version(a) != first_version]
+    ordered = [candidates[0]]
+    while same or other:
+        if other:
+            ordered.append(other.pop(0))
+        if same:
+            ordered.append(same.pop(0))
+    return ordered
+
+
+def _start_attempt(address, port, socket_options):
+    family, sock_type, proto, _, sockaddr = socket.getaddrinfo(
+        address, port, type=socket.SOCK_STREAM, flags=socket.AI_NUMERICHOST)[0]
+    sock = socket.socket(family, sock_type, proto)
+    if socket_options is not None:
+        socket_options.apply(sock)
+    sock.setblocking(False)
+    err = sock.connect_ex(sockaddr)
+    if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, getattr(errno, 'WSAEWOULDBLOCK', -1)):
+        sock.close()
+        raise OSError(err, f"connect to {address} failed: {errno.errorcode.get(err, err)}")
+    return sock
+
+
+def connect_first(addresses: List[str], port: int, socket_options=None,
+                  stagger=0.25, timeout=5.0) -> Tuple[socket.socket, str]:
+    """Race non-blocking connects to every address, happy-eyeballs style.
+
+    A new attempt starts every ``stagger`` seconds, or immediately when the
+    previous one fails. The first socket to connect wins and the rest are
+    closed. Returns ``(socket, address)`` with the socket in blocking mode,
+    or raises ``OSError`` if no address could be reached within ``timeout``.
+    """
+    selector = selectors.DefaultSelector()
+    remaining = list(addresses)
+    attempts = {}
+    errors = []
+    deadline = time.monotonic() + timeout
+    next_start = time.monotonic()
+    try:
+        while remaining or attempts:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if remaining and (now >= next_start or not attempts):
+                address = remaining.pop(0)
+                try:
+                    sock = _start_attempt(address, port, socket_options)
+                    attempts[sock] = address
+                    selector.register(sock, selectors.EVENT_WRITE, address)
+                    print(f"Connecting to {address}:{port}")
+                except OSError as e:
+                    errors.append(f"{address}: {e}")
+                next_start = time.monotonic() + stagger
+                continue
+
+            wait = deadline - now
+            if remaining:
+                wait = min(wait, max(0, next_start - now))
+            for key, _ in selector.select(wait):
+                sock = key.fileobj
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                selector.unregister(sock)
+                address = attempts.pop(sock)
+                if err == 0:
+                    sock.setblocking(True)
+                    return sock, address
+                errors.append(f"{address}: {errno.errorcode.get(err, err)}")
+                sock.close()
+                # Start the next attempt right away instead of waiting
+                next_start = time.monotonic()
+        raise OSError(f"Could not connect to any of {addresses} on port {port}: {errors or 'timed out'}")
+    finally:
+        for sock in attempts:
+            sock.close()
+        selector.close()
@@ -0,0 +1,204 @@
+"""Computer players for self-play, configured by spec strings.
+
+    random
+    minimax:depth=3,heuristic=lines
+    mcts:playouts=200,c=1.4
+
+``parse_engine`` turns a spec into an engine; ``engine.choose(position, rng)``
+returns the cell index to play in a rules.Position.
+"""
+import math
+from typing import Dict
+
+from rules import DRAW, LINES, O, X, Position
+
+WIN_SCORE = 1000000
+# Sub-board centre, corners and edges, for the positional part of the heuristics
+SQUARE_WEIGHTS = [3, 2, 3, 2, 4, 2, 3, 2, 3]
+# By marks in an otherwise open line; a full line has already decided its board
+LINE_WEIGHTS = (0, 1, 8, 0)
+
+
+class RandomEngine:
+    """Uniformly random legal moves."""
+
+    def choose(self, position, rng):
+        return rng.choice(position.legal_moves())
+
+
+def _line_score(squares, me, them):
+    """Score open lines: two in a line with the third empty counts much more than one."""
+    score = 0
+    for a, b, c in LINES:
+        line = (squares[a], squares[b], squares[c])
+        mine = line.count(me)
+        theirs = line.count(them)
+        if DRAW in line:
+            continue
+        if theirs == 0:
+            score += LINE_WEIGHTS[mine]
+        elif mine == 0:
+            score -= LINE_WEIGHTS[theirs]
+    return score
+
+
+def evaluate_subboards(position, me):
+    """Sub-boards won, weighted by where they sit on the main board."""
+    them = O if me == X else X
+    score = 0
+    for board, result in enumerate(position.sub_results):
+        if result == me:
+            score += 10 * SQUARE_WEIGHTS[board]
+        elif result == them:
+            score -= 10 * SQUARE_WEIGHTS[board]
+    return score
+
+
+def evaluate_lines(position, me):
+    """Open lines on the main board and inside every undecided sub-board."""
+    them = O if me == X else X
+    score = 25 * _line_score(position.sub_results, me, them) + evaluate_subboards(position, me)
+    cells = position.cells
+    for board in range(9):
+        if not position.sub_results[board]:
+            score += SQUARE_WEIGHTS[board] * _line_score(cells[board * 9:board * 9 + 9], me, them)
+    return score
+
+
+HEURISTICS = {'subboards': evaluate_subboards, 'lines': evaluate_lines}
+
+
+class MinimaxEngine:
+    """Fixed-depth negamax with alpha-beta pruning."""
+
+    def __init__(self, depth=3, heuristic='lines'):
+        self.depth = int(depth)
+        if heuristic not in HEURISTICS:
+            raise ValueError(f"Unknown heuristic {heuristic!r}, expected one of {sorted(HEURISTICS)}")
+        self.evaluate = HEURISTICS[heuristic]
+
+    def choose(self, position, rng):
+        moves = position.legal_moves()
+        rng.shuffle(moves)  # Break ties differently from game to game
+        best_move, best_score = moves[0], -math.inf
+        alpha = -math.inf
+        for move in moves:
+            position.play(move)
+            score = -self._negamax(position, self.depth - 1, -math.inf, -alpha)
+            position.undo()
+            if score > best_score:
+                best_move, best_score = move, score
+            alpha = max(alpha, score)
+        return best_move
+
+    def _negamax(self, position, depth, alpha, beta):
+        if position.result:
+            if position.result == DRAW:
+                return 0
+            # The previous move ended the game, so the side to move lost; prefer quick wins
+            return -WIN_SCORE - depth
+        if depth == 0:
+            return self.evaluate(position, position.to_move)
+        best = -math.inf
+        for move in position.legal_moves():
+            position.play(move)
+            score = -self._negamax(position, depth - 1, -beta, -alpha)
+            position.undo()
+            if score > best:
+                best = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best
+
+
+class _Node:
+    __slots__ = ('move', 'parent', 'children', 'untried', 'visits', 'score')
+
+    def __init__(self, move, parent, untried):
+        self.move = move
+        self.parent = parent
+        self.children = []
+        self.untried = untried
+        self.visits = 0
+        self.score = 0.0  # For the player who made ``move``
+
+
+class MCTSEngine:
+    """UCT Monte Carlo tree search with random playouts."""
+
+    def __init__(self, playouts=200, c=1.4):
+        self.playouts = int(playouts)
+        self.c = float(c)
+
+    def choose(self, position, rng):
+        root = _Node(None, None, position.legal_moves())
+        for _ in range(self.playouts):
+            node = root
+            played = 0
+            # Selection
+            while not node.untried and node.children:
+                log_visits = math.log(node.visits)
+                node = max(node.children, key=lambda n: n.score / n.visits
+                           + self.c * math.sqrt(log_visits / n.visits))
+                position.play(node.move)
+                played += 1
+            # Expansion
+            if node.untried:
+                move = node.untried.pop(rng.randrange(len(node.untried)))
+                position.play(move)
+                played += 1
+                child = _Node(move, node, position.legal_moves())
+                node.children.append(child)
+                node = child
+            # Playout
+            depth = 0
+            while not position.result:
+                position.play(rng.choice(position.legal_moves()))
+                depth += 1
+            result = position.result
+            for _ in range(depth + played):
+                position.undo()
+            # Backpropagation; node.move was made by the side not to move at that node
+            mover = O if (position.ply + played) % 2 == 0 else X
+            while node.parent is not None:
+                node.visits += 1
+                if result == DRAW:
+                    node.score += 0.5
+                elif result == mover:
+                    node.score += 1.0
+                mover = O if mover == X else X
+                node = node.parent
+            root.visits += 1
+        return max(root.children, key=lambda n: n.visits).move
+
+
+ENGINES = {'random': RandomEngine, 'minimax': MinimaxEngine, 'mcts': MCTSEngine}
+
+
+def parse_engine(spec: str):
+    """Build an engine from ``name`` or ``name:key=value,key=value``."""
+    name, _, options = spec.partition(':')
+    if name not in ENGINES:
+        raise ValueError(f"Unknown engine {name!r}, expected one of {sorted(ENGINES)}")
+    kwargs: Dict[str, str] = {}
+    for option in filter(None, options.split(',')):
+        key, sep, value = option.partition('=')
+        if not sep:
+            raise ValueError(f"Bad engine option {option!r} in {spec!r}")
+        kwargs[key.strip()] = value.strip()
+    return ENGINES[name](**kwargs)
+
+
+def play_game(x_engine, o_engine, rng, position=None, random_plies=0):
+    """Play one game to the end and return the finished Position."""
+    position = position or Position()
+    engines = {X: x_engine, O: o_engine}
+    while not position.result:
+        if position.ply < random_plies:
+            move = rng.choice(position.legal_moves())
+        else:
+            move = engines[position.to_move].choose(position, rng)
+        position.play(move)
+    return position
@@ -1,3 +1,38 @@
+import random
+import time
+
+
+def move_to_index(main_row, main_col, sub_row, sub_col):
+    """Encode a move as a cell index from 0 to 80, sub-board by sub-board."""
+    return (main_row * 3 + main_col) * 9 + sub_row * 3 + sub_col
+
+
+def index_to_move(index):
+    """Decode a cell index back to (main_row, main_col, sub_row, sub_col)."""
+    board, cell = divmod(index, 9)
+    return board // 3, board % 3, cell // 3, cell % 3
+
+
+# Bit masks over cell indexes, one bit per cell
+BOARD_MASKS = [0b111111111 << (9 * board) for board in range(9)]
+ALL_CELLS = (1 << 81) - 1
+
+# Zobrist keys for the position hash; the fixed seed makes every peer agree
+_zobrist = random.Random(0x55545454)
+CELL_KEYS = {symbol: [_zobrist.getrandbits(64) for _ in range(81)] for symbol in ('X', 'O')}
+TARGET_KEYS = [_zobrist.getrandbits(64) for _ in range(10)]  # Sub-board to play in, 9 for any
+
+
+def valid_coordinates(*values):
+    """Whether every value is an int from 0 to 2, as board coordinates must be."""
+    return all(type(v) is int and 0 <= v < 3 for v in values)
+
+
+def board_number(current_board):
+    """0-8 for a (row, col) sub-board, 9 for None (any)."""
+    return 9 if current_board is None else current_board[0] * 3 + current_board[1]
+
+
 class UltimateTicTacToe:
     def __init__(self, username):
         self.username = username
@@ -10,6 +45,16 @@ class UltimateTicTacToe:
         self.winner = None
         self.symbol = None  # 'X' or 'O'
         self.sub_board_winners = [[None for _ in range(3)] for _ in range(3)]
+        self.game_id = None  # Chosen by the first player, shared in GAME_START
+        self.moves = bytearray()  # One cell index per move, see move_to_index
+        self.started_at = None
+        self.ended_at = None
+        self.result = None  # 'X', 'O' or 'draw' once the game is over
+        self.game_over_callbacks = []  # Called with this game when it ends
+        self.move_callbacks = []  # Called with this game and the cell index after each move
+        self.reset_callbacks = []  # Called with this game when its board is replaced, see load_moves
+        self.open_cells = ALL_CELLS  # Empty cells in undecided sub-boards
+        self.position_hash = TARGET_KEYS[9]  # Zobrist hash of marks and target sub-board
 
     def create_empty_board(self):
         # Create 3x3 grid of 3x3 boards
@@ -20,6 +65,9 @@ class UltimateTicTacToe:
         if not self.game_started or not self.my_turn:
             return {'valid': False, 'message': 'Not your turn'}
 
+        if not valid_coordinates(main_row, main_col, sub_row, sub_col):
+            return {'valid': False, 'message': 'Invalid move'}
+
         if self.current_board is not None:
             if (main_row, main_col) != self.current_board:
                 return {'valid': False, 'message': 'Wrong sub-board'}
@@ -27,39 +75,69 @@ class UltimateTicTacToe:
         if self.board[main_row][main_col][sub_row][sub_col]:
             return {'valid': False, 'message': 'Cell already taken'}
 
+        if not self.is_legal(main_row, main_col, sub_row, sub_col):
+            return {'valid': False, 'message': 'Illegal move'}
+
         # Make the move
-        self.board[main_row][main_col][sub_row][sub_col] = self.symbol
-        
-        # Check for sub-board win
-        sub_board_result = self.check_sub_board(main_row, main_col)
-        if sub_board_result:
-            # Store the sub-board result
-            self.sub_board_winners[main_row][main_col] = sub_board_result
-            
-        # Check for main board win using sub-board winners
-        game_result = self.check_win(self.sub_board_winners)
-        
-        # Switch player
-        # self.symbol = 'O' if self.symbol == 'X' else 'X'
-        
-        # Set next valid board
-        if self.sub_board_winners[sub_row][sub_col]:
-            self.current_board = None  # Can play anywhere if target board is won
-        else:
-            self.current_board = (sub_row, sub_col)
+        sub_board_result, game_result = self._place(main_row, main_col, sub_row, sub_col, self.symbol)
         
         # Print board for debugging
         print("\nBoard state after move (make move):")
         self.print_board()
         
+        if game_result:
+            self.finish(game_result)
+        self.notify_move(self.moves[-1])
+        
         return {
             'valid': True,
+            'seq': len(self.moves),
+            'hash': self.state_hash,
             'sub_board_result': sub_board_result,
             'game_over': game_result is not None,
             'winner': game_result if game_result and game_result != 'draw' else None,
             'is_draw': game_result == 'draw'
         }
 
+    def get_state(self, since=None):
+        """Compact state for clients and peers.
+
+        ``seq`` is the number of moves played. With ``since`` (an earlier
+        seq) only the moves played after it are included; otherwise the
+        whole board is, as 81 characters in cell index order.
+        """
+        seq = len(self.moves)
+        state = {
+            'seq': seq,
+            'game_id': self.game_id,
+            'started': self.game_started,
+            'symbol': self.symbol,
+            'my_turn': self.my_turn,
+            'sub_boards': [winner for row in self.sub_board_winners for winner in row],
+            'current_board': None if self.current_board is None
+            else self.current_board[0] * 3 + self.current_board[1],
+            'result': self.result,
+            'hash': self.state_hash
+        }
+        if since is not None and 0 <= since <= seq:
+            state['since'] = since
+            state['moves'] = list(self.moves[since:])
+        else:
+            state['board'] = ''.join(self.board[i][j][m][n] or '.'
+                                     for i, j, m, n in map(index_to_move, range(81)))
+        return state
+
+    def get_legal_moves(self):
+        """Get every (main_row, main_col, sub_row, sub_col) the player to move may play."""
+        if self.current_board is not None:
+            boards = [self.current_board]
+        else:
+            boards = [(i, j) for i in range(3) for j in range(3)
+                      if not self.sub_board_winners[i][j]]
+        return [(i, j, m, n) for i, j in boards
+                for m in range(3) for n in range(3)
+                if not self.board[i][j][m][n]]
+
     def check_win(self, board):
         """Check if there's a win in the given board."""
         # Check rows
@@ -110,36 +188,149 @@ class UltimateTicTacToe:
         self.opponent_ready = True
         return self.ready and self.opponent_ready
 
-    def start_game(self, is_first):
+    def start_game(self, is_first, game_id=None):
         """Start the game."""
+        if self.game_started:
+            if self.game_id is None:
+                self.game_id = game_id
+            return  # Both sides call /start_game; don't reset a game in progress
         self.game_started = True
         self.my_turn = is_first
         self.symbol = 'X' if is_first else 'O' 
+        if game_id is None and is_first:
+            game_id = random.getrandbits(63)
+        self.game_id = game_id
+        self.started_at = time.time()
+
+    def finish(self, game_result):
+        """Record the end of the game and notify listeners."""
+        if self.result is not None:
+            return
+        self.result = game_result
+        self.winner = game_result if game_result != 'draw' else None
+        self.ended_at = time.time()
+        for callback in self.game_over_callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"Game over callback error: {e}")
+
+    def notify_move(self, index):
+        for callback in self.move_callbacks:
+            try:
+                callback(self, index)
+            except Exception as e:
+                print(f"Move callback error: {e}")
+
+    @property
+    def state_hash(self):
+        """Position hash as 16 hex digits, safe to send through JSON."""
+        return format(self.position_hash, '016x')
+
+    def symbol_to_move(self):
+        """X makes the even-numbered moves."""
+        return 'X' if len(self.moves) % 2 == 0 else 'O'
+
+    def legal_move_mask(self):
+        """Bit i is set when cell index i may be played next."""
+        if self.result is not None:
+            return 0
+        if self.current_board is None:
+            return self.open_cells
+        return self.open_cells & BOARD_MASKS[board_number(self.current_board)]
+
+    def is_legal(self, main_row, main_col, sub_row, sub_col):
+        """Whether a move may be played next, by whoever's turn it is."""
+        if not valid_coordinates(main_row, main_col, sub_row, sub_col):
+            return False
+        return bool(self.legal_move_mask() >> move_to_index(main_row, main_col, sub_row, sub_col) & 1)
+
+    def track_move(self, index, symbol, previous_board):
+        """Update the legal-move mask and position hash for a move just made."""
+        board = index // 9
+        self.open_cells &= ~(1 << index)
+        if self.sub_board_winners[board // 3][board % 3]:
+            self.open_cells &= ~BOARD_MASKS[board]
+        self.position_hash ^= (CELL_KEYS[symbol][index] ^ TARGET_KEYS[board_number(previous_board)]
+                               ^ TARGET_KEYS[board_number(self.current_board)])
+
+    def _place(self, main_row, main_col, sub_row, sub_col, symbol):
+        """Put a checked move on the board; returns (sub_board_result, game_result)."""
+        previous_board = self.current_board
+        self.board[main_row][main_col][sub_row][sub_col] = symbol
+        self.moves.append(move_to_index(main_row, main_col, sub_row, sub_col))
 
-    def receive_move(self, main_row, main_col, sub_row, sub_col):
-        """Handle opponent's move."""
-        opponent_symbol = 'O' if self.symbol == 'X' else 'X'
-        self.board[main_row][main_col][sub_row][sub_col] = opponent_symbol
-        
         # Check for sub-board win
         sub_board_result = self.check_sub_board(main_row, main_col)
         if sub_board_result:
             # Store the sub-board result
             self.sub_board_winners[main_row][main_col] = sub_board_result
-            
+
         # Check for main board win using sub-board winners
         game_result = self.check_win(self.sub_board_winners)
-        
-        # Update current board for next move
-        if self.sub_board_winners[sub_row][sub_col]:  # If target board is won
-            self.current_board = None  # Can play anywhere
+
+        # Set next valid board
+        if self.sub_board_winners[sub_row][sub_col]:
+            self.current_board = None  # Can play anywhere if target board is won
         else:
             self.current_board = (sub_row, sub_col)
+        self.track_move(self.moves[-1], symbol, previous_board)
+        return sub_board_result, game_result
+
+    def load_moves(self, moves):
+        """Replace the board with the one a list of cell indexes plays out to.
+
+        Used when this board has diverged from the opponent's and theirs is
+        taken instead. Returns False, changing nothing, if the moves are not
+        a legal game.
+        """
+        replay = UltimateTicTacToe(self.username)
+        for ply, index in enumerate(moves):
+            if type(index) is not int or not 0 <= index < 81 or not replay.is_legal(*index_to_move(index)):
+                return False
+            _, game_result = replay._place(*index_to_move(index), 'X' if ply % 2 == 0 else 'O')
+            if game_result:
+                replay.finish(game_result)
+        for name in ('board', 'current_board', 'sub_board_winners', 'moves', 'open_cells',
+                     'position_hash'):
+            setattr(self, name, getattr(replay, name))
+        self.my_turn = replay.symbol_to_move() == self.symbol
+        if replay.result is not None:
+            self.finish(replay.result)
+        for callback in self.reset_callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"Reset callback error: {e}")
+        return True
+
+    def receive_move(self, main_row, main_col, sub_row, sub_col, expected_hash=None):
+        """Handle opponent's move.
+
+        The move is checked before it is applied: it must be the opponent's
+        turn and a legal move. ``expected_hash`` is the sender's position
+        hash after the move; a mismatch means the two boards have diverged.
+        """
+        opponent_symbol = 'O' if self.symbol == 'X' else 'X'
+        if not self.game_started or self.symbol_to_move() != opponent_symbol:
+            return {'valid': False, 'message': 'Not opponent\'s turn'}
+        if not self.is_legal(main_row, main_col, sub_row, sub_col):
+            return {'valid': False, 'message': 'Illegal move'}
+
+        sub_board_result, game_result = self._place(main_row, main_col, sub_row, sub_col,
+                                                     opponent_symbol)
         
         self.my_turn = True  # It's our turn after opponent's move
 
+        if game_result:
+            self.finish(game_result)
+        self.notify_move(self.moves[-1])
     
         return {
+            'valid': True,
+            'diverged': expected_hash is not None and expected_hash != self.state_hash,
+            'seq': len(self.moves),
+            'hash': self.state_hash,
             'sub_board_result': sub_board_result,
             'game_over': game_result is not None,
             'winner': game_result if game_result and game_result != 'draw' else None,
@@ -0,0 +1,171 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from game import UltimateTicTacToe
+from matchmaking import Matchmaker
+from peer import JobsClosed, PeerNetwork
+from ratings import Ratings
+from spectate import SpectatorChannel
+import transport as transport_module
+
+
+class GameHost:
+    """Owns every player's game and peer network in this process.
+
+    With ``use_transport`` all peers share one SelectorTransport loop and
+    connects go through one bounded worker pool, so the number of threads
+    stays flat however many games are running. Without it each player gets
+    its own listener threads, as before.
+    """
+
+    def __init__(self, use_transport=False, max_workers=8, loopback=False, store=None,
+                 ratings=None):
+        self.games: Dict[str, UltimateTicTacToe] = {}
+        self.peers: Dict[str, PeerNetwork] = {}
+        self.channels: Dict[str, SpectatorChannel] = {}  # Spectators, by player watched
+        self.lock = threading.Lock()
+        self.transport = transport_module.get_transport() if use_transport else None
+        self.loopback = loopback  # Keep all peer traffic on 127.0.0.1
+        self.store = store  # Optional records.GameStore for finished games
+        self.ratings = ratings or Ratings()  # Elo ratings, updated as games end
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='host-connect')
+        # Optional rating-based pairing; matched players are connected directly
+        self.matchmaker = Matchmaker(self.connect_players)
+        # Matched players whose connection failed, until they queue again
+        self.match_failures = set()
+
+    def rating_of(self, username):
+        """Rating used for matchmaking."""
+        return self.ratings.rating(username)
+
+    def join_queue(self, username):
+        """Put a player in the matchmaking queue; returns their opponent if matched at once.
+
+        Returns None without queueing a player who is already in a game.
+        """
+        with self.lock:
+            peer = self.peers.get(username)
+            self.match_failures.discard(username)
+        if peer is None or peer.is_connected:
+            return None
+        return self.matchmaker.join(username, self.rating_of(username))
+
+    def match_failed(self, username):
+        """True if the player was matched but the connection could not be made."""
+        with self.lock:
+            return username in self.match_failures
+
+    def connect_players(self, first, second):
+        """Connect two players hosted here, as if ``first`` accepted ``second``'s broadcast.
+
+        ``first`` moves first. The connect runs on the worker pool; returns
+        its job id, or None if it could not be started. The matchmaker has
+        already taken both players out of the queue, so if the connection
+        is not made both are marked as failed (see match_failed) for the
+        lobby to report, and they can queue again.
+        """
+        def on_failed():
+            print(f"Could not connect matched players {first} and {second}")
+            with self.lock:
+                self.match_failures.update(name for name in (first, second) if name in self.peers)
+
+        with self.lock:
+            first_peer, second_peer = self.peers.get(first), self.peers.get(second)
+            first_game = self.games.get(first)
+        if (not first_peer or not second_peer or first_game is None
+                or not second_peer.ensure_sockets()):
+            on_failed()
+            return None
+        # Both live in this process, and the TCP listener is on every address
+        first_peer.update_pending_requests({
+            'username': second, 'ip': '127.0.0.1', 'addresses': ['127.0.0.1'],
+            'tcp_port': second_peer.tcp_port, 'timestamp': time.time(), 'strength': 1
+        })
+
+        def on_connected():
+            first_game.start_game(True)
+            first_peer.send_message({
+                'type': 'GAME_START',
+                'first_player': False,
+                'opponent': first,
+                'game_id': first_game.game_id
+            })
+            # Sends this player's lobby to the game as well
+            first_peer.game_status = {'type': 'GAME_START', 'first_player': True}
+
+        try:
+            job = first_peer.accept_connection_async(second, on_connected, on_failed)
+        except JobsClosed:
+            job = None
+        if job is None:
+            on_failed()
+        return job
+
+    def create_player(self, username):
+        """Create the game and peer network for a player.
+
+        The peer's sockets are opened on first use (see
+        PeerNetwork.ensure_sockets), so logging in stays cheap.
+        """
+        game = UltimateTicTacToe(username)
+        peer = PeerNetwork(username, game, transport=self.transport, executor=self.executor,
+                           loopback=self.loopback)
+        if self.store:
+            game.game_over_callbacks.append(
+                lambda game: self.store.record_game(game, peer.opponent_username))
+        game.game_over_callbacks.append(
+            lambda game: self.ratings.record_game(game, peer.opponent_username))
+        channel = SpectatorChannel(game, peer)
+        game.move_callbacks.append(channel.publish_move)
+        game.reset_callbacks.append(channel.publish_reset)
+        # However the game came about, the player no longer needs an opponent
+        peer.connected_callbacks.append(lambda: self.matchmaker.leave(username))
+        with self.lock:
+            self.games[username] = game
+            self.peers[username] = peer
+            self.channels[username] = channel
+        return game, peer
+
+    def remove_player(self, username):
+        """Disconnect a player and forget their game."""
+        with self.lock:
+            self.games.pop(username, None)
+            peer = self.peers.pop(username, None)
+            channel = self.channels.pop(username, None)
+            self.match_failures.discard(username)
+        self.matchmaker.leave(username)
+        if channel:
+            channel.close()
+        if peer:
+            peer.close()
+
+    def shutdown(self, reason="Server shutting down"):
+        """Tell every connected opponent we are leaving, then close everything down."""
+        with self.lock:
+            peers = dict(self.peers)
+        for username, peer in peers.items():
+            if peer.is_connected:
+                peer.send_message({'type': 'DISCONNECT', 'message': reason})
+            self.remove_player(username)
+        self.matchmaker.stop()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.store:
+            self.store.close()  # Writes out the games that just finished
+        self.ratings.close()
+
+    def stats(self):
+        """Counts for monitoring."""
+        with self.lock:
+            peers = list(self.peers.values())
+            channels = list(self.channels.values())
+        return {
+            'players': len(peers),
+            'connected': sum(1 for p in peers if p.is_connected),
+            'spectators': sum(len(c.subscribers) for c in channels),
+            'dropped': sum(sum(p.drops.snapshot().values()) for p in peers),
+            'queued': self.matchmaker.stats()['queued'],
+            'threads': threading.active_count()
+        }
@@ -0,0 +1,160 @@
+"""Convert print-style game logs into structured game records.
+
+Usage:
+
+    python ingest.py tmp/result/win_logs.txt [more logs...] --db tmp/result/games.db
+
+Logs are read one line at a time, so memory use does not grow with log
+size. Board dumps are skipped; games are rebuilt from the ``Sent:`` and
+``Received move:`` lines printed by PeerNetwork, replayed to find the
+result, and written to a records.GameStore.
+"""
+import argparse
+import ast
+import hashlib
+import os
+import re
+import time
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from game import move_to_index
+from records import GameRecord, GameStore
+from rules import SYMBOLS, Position
+
+# Lines that carry game information; everything else is skipped unparsed
+SENT_PREFIX = 'Sent: '
+RECEIVED_PREFIX = 'Received move: '
+LISTENER_PATTERN = re.compile(r'Starting UDP listener for (.+)\.\.\.$')
+OPPONENT_PATTERN = re.compile(r'Connected to peer (\S+) at ')
+GAME_START_PATTERN = re.compile(r'Game starting, first player: ')
+
+
+class ParsedGame(NamedTuple):
+    username: Optional[str]  # Whose log this is
+    opponent: Optional[str]
+    moves: bytes
+    first_mover_is_self: bool  # Whether the log's owner played X
+    result: str  # 'X', 'O', 'draw' or 'unfinished'
+
+
+class GameParser:
+    """State machine for one log stream."""
+
+    def __init__(self):
+        self.username = None
+        self.opponent = None
+        self.reset()
+
+    def reset(self):
+        self.moves = bytearray()
+        self.taken = set()
+        self.position = Position()  # Replayed to find the result; MOVE messages no longer carry it
+        self.first_mover_is_self = None
+        self.result = None
+
+    def has_game(self):
+        return bool(self.moves)
+
+    def finish(self):
+        game = ParsedGame(self.username, self.opponent, bytes(self.moves),
+                          bool(self.first_mover_is_self), self.result or 'unfinished')
+        self.reset()
+        return game
+
+    def feed(self, line) -> Optional[ParsedGame]:
+        """Parse one line; returns a game when the line ends or replaces one."""
+        if not line or line[0] in '|-\n ':
+            return None  # Board dumps and blank lines
+
+        if line.startswith(SENT_PREFIX):
+            return self._move(line[len(SENT_PREFIX):], by_self=True)
+        if line.startswith(RECEIVED_PREFIX):
+            return self._move(line[len(RECEIVED_PREFIX):], by_self=False)
+
+        match = LISTENER_PATTERN.match(line.rstrip())
+        if match:
+            self.username = match.group(1)
+            return None
+        match = OPPONENT_PATTERN.match(line)
+        if match:
+            self.opponent = match.group(1)
+            return None
+        if GAME_START_PATTERN.match(line) and self.has_game():
+            return self.finish()
+        return None
+
+    def _move(self, text, by_self):
+        # Only MOVE messages matter; skip the literal parse for anything else
+        if "'type': 'MOVE'" not in text:
+            return None
+        try:
+            message = ast.literal_eval(text.strip())
+            index = move_to_index(message['main_row'], message['main_col'],
+                                  message['sub_row'], message['sub_col'])
+        except (ValueError, SyntaxError, KeyError, TypeError):
+            return None
+
+        completed = None
+        if self.result is not None:
+            # A move after the game ended starts the next game
+            completed = self.finish()
+        if index in self.taken:
+            return completed  # Duplicated log line, the cell is already played
+
+        if not self.moves:
+            self.first_mover_is_self = by_self
+        self.moves.append(index)
+        self.taken.add(index)
+        self.position.play(index)
+        if self.position.result:
+            self.result = SYMBOLS[self.position.result]
+        return completed
+
+
+def parse_log(lines: Iterable[str]) -> Iterator[ParsedGame]:
+    """Yield every game found in a stream of log lines."""
+    parser = GameParser()
+    for line in lines:
+        game = parser.feed(line)
+        if game:
+            yield game
+    if parser.has_game():
+        yield parser.finish()
+
+
+def to_record(game: ParsedGame, source: str, ordinal: int, timestamp: float) -> GameRecord:
+    """Build a GameRecord; the id is derived from the source so re-ingesting is a no-op."""
+    username = game.username or 'unknown'
+    opponent = game.opponent or 'unknown'
+    if game.first_mover_is_self:
+        x_player, o_player = username, opponent
+    else:
+        x_player, o_player = opponent, username
+    digest = hashlib.blake2b(f'{source}:{ordinal}:'.encode() + game.moves, digest_size=8).digest()
+    game_id = int.from_bytes(digest, 'big') >> 1  # Fits an SQLite INTEGER
+    return GameRecord(game_id, x_player, o_player, game.result, timestamp, timestamp, game.moves)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert print-style game logs into game records.')
+    parser.add_argument('logs', nargs='+')
+    parser.add_argument('--db', default=os.path.join('tmp', 'result', 'games.db'))
+    args = parser.parse_args()
+
+    store = GameStore(args.db)
+    for path in args.logs:
+        start = time.perf_counter()
+        # Logs carry no timestamps, so the file time is the best we have
+        timestamp = os.path.getmtime(path)
+        games = moves = 0
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for ordinal, game in enumerate(parse_log(f)):
+                store.record(to_record(game, os.path.abspath(path), ordinal, timestamp))
+                games += 1
+                moves += len(game.moves)
+        print(f"{path}: {games} games, {moves} moves in {time.perf_counter() - start:.2f} s")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
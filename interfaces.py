@@ -0,0 +1,179 @@
+import ipaddress
+import socket
+import struct
+import sys
+from typing import List, NamedTuple
+
+_psutil = None  # Imported on first use; False if it is not installed
+
+
+def _load_psutil():
+    """Import psutil when interfaces are first enumerated, not at startup."""
+    global _psutil
+    if _psutil is None:
+        try:
+            import psutil
+            _psutil = psutil
+        except ImportError:  # psutil is optional, fall back to ioctl on Linux
+            _psutil = False
+    return _psutil or None
+
+
+class Interface(NamedTuple):
+    name: str
+    address: str
+    netmask: str
+    broadcast: str
+
+
+def _make_interface(name, address, netmask):
+    """Build an Interface, or return None if it is useless for discovery."""
+    try:
+        network = ipaddress.IPv4Network(f'{address}/{netmask}', strict=False)
+    except ValueError:
+        return None
+    ip = ipaddress.IPv4Address(address)
+    # Loopback and link-local addresses never reach another player,
+    # and /31 or /32 links have no directed broadcast address
+    if ip.is_loopback or ip.is_link_local or network.prefixlen >= 31:
+        return None
+    return Interface(name, address, str(network.netmask), str(network.broadcast_address))
+
+
+def _interfaces_from_psutil():
+    """Enumerate interfaces using psutil (works on Windows and Linux)."""
+    psutil = _load_psutil()
+    stats = psutil.net_if_stats()
+    interfaces = []
+    for name, addrs in psutil.net_if_addrs().items():
+        if name in stats and not stats[name].isup:
+            continue
+        for addr in addrs:
+            if addr.family != socket.AF_INET or not addr.netmask:
+                continue
+            interface = _make_interface(name, addr.address, addr.netmask)
+            if interface:
+                interfaces.append(interface)
+    return interfaces
+
+
+def _interfaces_from_ioctl():
+    """Enumerate interfaces with SIOCGIF* ioctls (Linux only)."""
+    import fcntl
+
+    SIOCGIFFLAGS = 0x8913
+    SIOCGIFADDR = 0x8915
+    SIOCGIFNETMASK = 0x891b
+    IFF_UP = 0x1
+
+    def ioctl(sock, request, name):
+        return fcntl.ioctl(sock.fileno(), request, struct.pack('256s', name.encode()[:15]))
+
+    interfaces = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for _, name in socket.if_nameindex():
+            try:
+                flags = struct.unpack('H', ioctl(s, SIOCGIFFLAGS, name)[16:18])[0]
+                if not flags & IFF_UP:
+                    continue
+                address = socket.inet_ntoa(ioctl(s, SIOCGIFADDR, name)[20:24])
+                netmask = socket.inet_ntoa(ioctl(s, SIOCGIFNETMASK, name)[20:24])
+            except OSError:
+                continue  # No IPv4 address on this interface
+            interface = _make_interface(name, address, netmask)
+            if interface:
+                interfaces.append(interface)
+    return interfaces
+
+
+def get_interfaces() -> List[Interface]:
+    """Get every up IPv4 interface that can reach other players."""
+    try:
+        if _load_psutil() is not None:
+            return _interfaces_from_psutil()
+        if sys.platform.startswith('linux'):
+            return _interfaces_from_ioctl()
+    except Exception as e:
+        print(f"Interface enumeration failed: {e}")
+    return []
+
+
+def _ipv6_from_psutil():
+    psutil = _load_psutil()
+    stats = psutil.net_if_stats()
+    addresses = []
+    for name, addrs in psutil.net_if_addrs().items():
+        if name in stats and not stats[name].isup:
+            continue
+        addresses.extend(addr.address for addr in addrs if addr.family == socket.AF_INET6)
+    return addresses
+
+
+def _ipv6_from_proc():
+    addresses = []
+    with open('/proc/net/if_inet6') as f:
+        for line in f:
+            fields = line.split()
+            addresses.append(str(ipaddress.IPv6Address(bytes.fromhex(fields[0]))))
+    return addresses
+
+
+def get_ipv6_addresses() -> List[str]:
+    """Get the host's global and unique-local IPv6 addresses.
+
+    Link-local addresses are skipped: their scope is an interface name that
+    means nothing on the remote host.
+    """
+    try:
+        if _load_psutil() is not None:
+            found = _ipv6_from_psutil()
+        elif sys.platform.startswith('linux'):
+            found = _ipv6_from_proc()
+        else:
+            found = []
+    except Exception as e:
+        print(f"IPv6 enumeration failed: {e}")
+        return []
+    addresses = []
+    for address in found:
+        ip = ipaddress.IPv6Address(address.split('%')[0])
+        if ip.is_loopback or ip.is_link_local or ip.is_multicast:
+            continue
+        if str(ip) not in addresses:
+            addresses.append(str(ip))
+    return addresses
+
+
+def get_broadcast_addresses(interfaces=None) -> List[str]:
+    """Get the distinct directed broadcast addresses of the given interfaces."""
+    if interfaces is None:
+        interfaces = get_interfaces()
+    addresses = []
+    for interface in interfaces:
+        if interface.broadcast not in addresses:
+            addresses.append(interface.broadcast)
+    return addresses
+
+
+def get_primary_ip(interfaces=None) -> str:
+    """Get the address of the interface holding the default route.
+
+    Falls back to the first enumerated interface when there is no default
+    route (e.g. an offline LAN), and to localhost when there is nothing.
+    """
+    if interfaces is None:
+        interfaces = get_interfaces()
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # No packet is sent, this only asks the kernel for a route
+        s.connect(('8.8.8.8', 80))
+        routed_ip = s.getsockname()[0]
+        if not interfaces or any(i.address == routed_ip for i in interfaces):
+            return routed_ip
+    except OSError:
+        pass
+    finally:
+        s.close()
+    if interfaces:
+        return interfaces[0].address
+    return '127.0.0.1'
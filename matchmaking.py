@@ -0,0 +1,182 @@
+"""Rating-based matchmaking for players hosted in one process.
+
+Players join a queue with a rating and are paired with the closest
+rating available, preferring whoever has waited longest. Ratings are
+grouped into bands of ``band_width`` points. A player's window starts at
+``initial_bands`` bands either side of their own and widens by a band
+every ``widen_interval`` seconds, up to ``max_bands``, so nobody waits
+forever for a perfect opponent. Two players match when either one's
+window reaches the other.
+
+Each band is a FIFO queue. A join looks for an opponent straight away,
+and a waiting player is only looked at again when their window widens:
+a heap keyed on that time tells the matcher who is due. Joins and matches
+cost O(log n) for the heap plus a look at a few neighbouring bands,
+however many players are queued.
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+
+class Ticket(NamedTuple):
+    username: str
+    rating: float
+    band: int
+    joined_at: float
+
+
+class Matchmaker:
+    """Pairs queued players and hands each pair to ``on_match(first, second)``.
+
+    ``first`` is the player who waited longer. ``on_match`` is called
+    outside the lock, from whichever thread made the match. With
+    ``start_thread=False`` nothing calls ``tick`` but the caller.
+    """
+
+    def __init__(self, on_match, band_width=100, initial_bands=1, max_bands=5,
+                 widen_interval=5.0, tick_interval=0.5, start_thread=True):
+        self.on_match = on_match
+        self.band_width = band_width
+        self.initial_bands = initial_bands
+        self.max_bands = max_bands
+        self.widen_interval = widen_interval
+        self.tick_interval = tick_interval
+        self.tickets = {}  # username -> Ticket
+        self.bands = {}  # band -> OrderedDict of username -> Ticket, longest waiting first
+        self.due = []  # Heap of (time the window next widens, order, username)
+        self.order = itertools.count()  # Breaks ties in the heap by join order
+        self.lock = threading.Lock()
+        self.matched = 0
+        self.start_thread = start_thread
+        self.thread = None  # The matcher starts with the first join
+        self.stopped = threading.Event()
+
+    def join(self, username, rating, now=None):
+        """Queue a player, or match them at once. Returns the opponent's name if matched."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self._remove(username)
+            ticket = Ticket(username, rating, int(rating // self.band_width), now)
+            opponent = self._find(ticket, now)
+            if opponent is None:
+                self._add(ticket)
+                self._schedule(ticket, now)
+            else:
+                self._remove(opponent.username)
+                self.matched += 1
+        if self.thread is None and self.start_thread:
+            self._start()
+        if opponent is None:
+            return None
+        # The player already waiting goes first
+        self._notify(opponent.username, username)
+        return opponent.username
+
+    def leave(self, username):
+        """Take a player out of the queue; False if they were not in it."""
+        with self.lock:
+            return self._remove(username) is not None
+
+    def status(self, username, now=None):
+        """Rating and seconds waited for a queued player, or None."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            ticket = self.tickets.get(username)
+        if ticket is None:
+            return None
+        return {'rating': ticket.rating, 'waiting': now - ticket.joined_at,
+                'window': self._window(ticket, now) * self.band_width}
+
+    def tick(self, now=None):
+        """Retry every player whose window has widened since they were last looked at."""
+        now = time.monotonic() if now is None else now
+        pairs = []
+        with self.lock:
+            while self.due and self.due[0][0] <= now:
+                _, _, username = heapq.heappop(self.due)
+                ticket = self.tickets.get(username)
+                if ticket is None:
+                    continue  # Left or was matched since
+                opponent = self._find(ticket, now)
+                if opponent is None:
+                    self._schedule(ticket, now)
+                    continue
+                self._remove(username)
+                self._remove(opponent.username)
+                self.matched += 1
+                if opponent.joined_at <= ticket.joined_at:
+                    pairs.append((opponent.username, username))
+                else:
+                    pairs.append((username, opponent.username))
+        for first, second in pairs:
+            self._notify(first, second)
+        return pairs
+
+    def stop(self):
+        self.stopped.set()
+
+    def stats(self):
+        with self.lock:
+            return {'queued': len(self.tickets), 'bands': len(self.bands), 'matched': self.matched}
+
+    def _window(self, ticket, now):
+        widened = int((now - ticket.joined_at) // self.widen_interval)
+        return min(self.max_bands, self.initial_bands + widened)
+
+    def _schedule(self, ticket, now):
+        if self._window(ticket, now) >= self.max_bands:
+            return  # Widest already; from now on others' searches find this player
+        widened = int((now - ticket.joined_at) // self.widen_interval) + 1
+        heapq.heappush(self.due, (ticket.joined_at + widened * self.widen_interval,
+                                  next(self.order), ticket.username))
+
+    def _find(self, ticket, now):
+        """Longest-waiting player in the nearest band that either window reaches."""
+        window = self._window(ticket, now)
+        for distance in range(self.max_bands + 1):
+            candidates = []
+            for band in {ticket.band - distance, ticket.band + distance}:
+                # The first in a band has waited longest, so has the widest window;
+                # the searching player may be first in their own band, look past them
+                for other in self.bands.get(band, {}).values():
+                    if other.username != ticket.username:
+                        if distance <= window or distance <= self._window(other, now):
+                            candidates.append(other)
+                        break
+            if candidates:
+                return min(candidates, key=lambda t: t.joined_at)
+        return None
+
+    def _add(self, ticket):
+        self.tickets[ticket.username] = ticket
+        self.bands.setdefault(ticket.band, OrderedDict())[ticket.username] = ticket
+
+    def _remove(self, username):
+        ticket = self.tickets.pop(username, None)
+        if ticket is not None:
+            queue = self.bands[ticket.band]
+            del queue[username]
+            if not queue:
+                del self.bands[ticket.band]
+        return ticket
+
+    def _notify(self, first, second):
+        try:
+            self.on_match(first, second)
+        except Exception as e:
+            print(f"Match callback error: {e}")
+
+    def _start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, daemon=True, name='matchmaker')
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.tick_interval):
+            self.tick()
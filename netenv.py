@@ -0,0 +1,151 @@
+import socket
+import sys
+import threading
+import time
+import weakref
+from typing import FrozenSet, List, NamedTuple, Tuple
+
+import interfaces
+
+
+class NetworkSnapshot(NamedTuple):
+    primary_ip: str
+    interfaces: Tuple[interfaces.Interface, ...]
+    broadcast_addresses: Tuple[str, ...]
+    ipv6_addresses: Tuple[str, ...]
+    local_addresses: FrozenSet[str]  # Used to ignore self-broadcasts
+    version: int
+    timestamp: float
+
+    @property
+    def advertised_addresses(self):
+        """Every address a peer may use to reach us, IPv4 first."""
+        return [i.address for i in self.interfaces] + list(self.ipv6_addresses)
+
+
+class NetworkEnvironment:
+    """Process-wide cache of the host's network configuration.
+
+    Reading the snapshot is a plain attribute access. A background thread
+    refreshes it on a timer and, on Linux, whenever netlink reports an
+    address or link change. Subscribers are called when the snapshot changes.
+    """
+
+    REFRESH_INTERVAL = 30  # Seconds between timer refreshes
+    NETLINK_DEBOUNCE = 0.5  # Coalesce bursts of netlink events
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot = self._probe(version=0)
+        self.subscribers: List[weakref.WeakMethod] = []
+        self.watcher_thread = None
+        self.wakeup = threading.Event()
+
+    def _probe(self, version):
+        found = interfaces.get_interfaces()
+        primary_ip = interfaces.get_primary_ip(found)
+        return NetworkSnapshot(
+            primary_ip=primary_ip,
+            interfaces=tuple(found),
+            broadcast_addresses=tuple(interfaces.get_broadcast_addresses(found)),
+            ipv6_addresses=tuple(interfaces.get_ipv6_addresses()),
+            local_addresses=frozenset({primary_ip, '127.0.0.1'} | {i.address for i in found}),
+            version=version,
+            timestamp=time.time()
+        )
+
+    def refresh(self):
+        """Re-probe the interfaces and notify subscribers if anything changed."""
+        with self.lock:
+            old = self.snapshot
+            new = self._probe(version=old.version)
+            changed = ((new.primary_ip, new.interfaces, new.ipv6_addresses) !=
+                       (old.primary_ip, old.interfaces, old.ipv6_addresses))
+            if changed:
+                new = new._replace(version=old.version + 1)
+            self.snapshot = new
+        if changed:
+            print(f"Network changed: {old.primary_ip} -> {new.primary_ip}")
+            self._notify(old, new)
+        return changed
+
+    def subscribe(self, callback):
+        """Call a bound method with (old, new) snapshots on every change.
+
+        Only a weak reference is kept, so subscribing does not keep the
+        owning object alive.
+        """
+        with self.lock:
+            self.subscribers.append(weakref.WeakMethod(callback))
+        self.start()
+
+    def _notify(self, old, new):
+        with self.lock:
+            self.subscribers = [ref for ref in self.subscribers if ref() is not None]
+            callbacks = [ref() for ref in self.subscribers]
+        for callback in callbacks:
+            if callback is None:
+                continue
+            try:
+                callback(old, new)
+            except Exception as e:
+                print(f"Network change callback error: {e}")
+
+    def start(self):
+        """Start the background watcher thread if it is not running."""
+        with self.lock:
+            if self.watcher_thread is not None:
+                return
+            self.watcher_thread = threading.Thread(target=self._watch, daemon=True)
+        self.watcher_thread.start()
+        if sys.platform.startswith('linux'):
+            threading.Thread(target=self._watch_netlink, daemon=True).start()
+
+    def _watch(self):
+        """Refresh on a timer, or early when netlink wakes us up."""
+        while True:
+            woken = self.wakeup.wait(self.REFRESH_INTERVAL)
+            if woken:
+                time.sleep(self.NETLINK_DEBOUNCE)
+                self.wakeup.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Network refresh error: {e}")
+
+    def _watch_netlink(self):
+        """Wake the watcher on rtnetlink link and IPv4 address events."""
+        RTMGRP_LINK = 0x1
+        RTMGRP_IPV4_IFADDR = 0x10
+        try:
+            s = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            s.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+        except (AttributeError, OSError) as e:
+            print(f"Netlink unavailable, using timer refresh only: {e}")
+            return
+        while True:
+            try:
+                if s.recv(65536):
+                    self.wakeup.set()
+            except OSError as e:
+                print(f"Netlink error: {e}")
+                time.sleep(1)
+
+
+_environment = None
+_environment_lock = threading.Lock()
+
+
+def get_environment() -> NetworkEnvironment:
+    """Get the process-wide network environment, creating it on first use."""
+    global _environment
+    if _environment is None:
+        with _environment_lock:
+            if _environment is None:
+                _environment = NetworkEnvironment()
+    return _environment
+
+
+def get_snapshot() -> NetworkSnapshot:
+    """Get the current cached network snapshot."""
+    return get_environment().snapshot
@@ -0,0 +1,284 @@
+"""Opening book built from stored games.
+
+Build it offline from a records.GameStore, in parallel:
+
+    python openings.py build --db tmp/result/games.db --out tmp/result/openings.book
+
+and query it by move sequence (cell indexes, see game.move_to_index):
+
+    python openings.py lookup --book tmp/result/openings.book 40 41
+
+Positions are canonicalised over the 8 symmetries of the board, so
+mirrored and rotated openings share statistics. The book file is an
+open-addressing hash table that is memory-mapped, not loaded: a lookup
+touches one or two slots and the move records they point at.
+
+Building is an external sort, so memory stays flat however many games
+there are: tallies are spilled to disk as sorted runs, the runs are
+merged as a stream, and the hash table is filled in the mapped output.
+"""
+import argparse
+import heapq
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+from game import index_to_move, move_to_index
+from rules import INVERSE_CELL_PERMS, Position
+
+MAGIC = b'UTTTBOOK'
+HEADER = struct.Struct('<8sIIII')  # magic, version, slot count, record count, depth
+SLOT = struct.Struct('<QIHH')  # key, first record, record count, padding
+RECORD = struct.Struct('<BxxxIII')  # move, wins, draws, losses for the side to move
+VERSION = 1
+RUN_ENTRY = struct.Struct('<QBIII')  # key, move, wins, draws, losses in a sorted run
+INDEX_ENTRY = struct.Struct('<QII')  # key, first record, record count while building
+
+
+def _count_chunk(args):
+    """Worker: tally (key, canonical move) -> [wins, draws, losses] for a chunk of games."""
+    games, depth = args
+    counts = defaultdict(lambda: [0, 0, 0])
+    for moves, result in games:
+        position = Position()
+        for ply, index in enumerate(moves[:depth]):
+            key, symmetries = position.key()
+            mover = 'X' if ply % 2 == 0 else 'O'
+            outcome = 1 if result == 'draw' else (0 if result == mover else 2)
+            counts[(key, Position.canonical_move(index, symmetries))][outcome] += 1
+            position.play(index)
+    return dict(counts)
+
+
+def build(store, out_path, depth=12, workers=None, chunk_size=20000, min_games=1,
+          max_entries=1000000):
+    """Build a book file from every finished game in a GameStore.
+
+    At most ``max_entries`` (position, move) tallies are held in memory;
+    past that they are written out as a sorted run and counting goes on.
+    """
+    def chunks():
+        chunk = []
+        for record in store.iter_games():
+            if record.result == 'unfinished':
+                continue
+            chunk.append((record.moves, record.result))
+            if len(chunk) >= chunk_size:
+                yield chunk, depth
+                chunk = []
+        if chunk:
+            yield chunk, depth
+
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    with tempfile.TemporaryDirectory(dir=out_dir, prefix='openings-') as tmp_dir:
+        runs = []
+        totals: Dict[Tuple[int, int], List[int]] = defaultdict(lambda: [0, 0, 0])
+
+        def spill():
+            runs.append(os.path.join(tmp_dir, f'run{len(runs)}'))
+            _write_run(runs[-1], totals)
+            totals.clear()
+
+        workers = workers or os.cpu_count() or 1
+        pending = iter(chunks())
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Read games only as fast as the workers count them: a few chunks
+            # in flight per worker, topped up as each finishes
+            in_flight = set()
+            while True:
+                for chunk in pending:
+                    in_flight.add(executor.submit(_count_chunk, chunk))
+                    if len(in_flight) >= workers * 2:
+                        break
+                if not in_flight:
+                    break
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for entry, (wins, draws, losses) in future.result().items():
+                        total = totals[entry]
+                        total[0] += wins
+                        total[1] += draws
+                        total[2] += losses
+                    if len(totals) >= max_entries:
+                        spill()
+        spill()
+
+        index_path = os.path.join(tmp_dir, 'index')
+        records_path = os.path.join(tmp_dir, 'records')
+        key_count, record_count = _merge_runs(runs, min_games, index_path, records_path)
+        write_book(out_path, index_path, records_path, key_count, record_count, depth)
+    return key_count
+
+
+def _write_run(path, totals):
+    """Write tallies sorted by (key, move)."""
+    with open(path, 'wb') as f:
+        for (key, move), (wins, draws, losses) in sorted(totals.items()):
+            f.write(RUN_ENTRY.pack(key, move, wins, draws, losses))
+
+
+def _read_run(path) -> Iterator[Tuple[int, int, int, int, int]]:
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(RUN_ENTRY.size * 4096)
+            if not data:
+                return
+            yield from RUN_ENTRY.iter_unpack(data)
+
+
+def _merge_runs(runs, min_games, index_path, records_path):
+    """Sum the runs and write each position's moves, returning (positions, records).
+
+    Records go to ``records_path`` in book order; each position's
+    (key, first record, count) goes to ``index_path``.
+    """
+    key_count = record_count = 0
+    with open(index_path, 'wb') as index, open(records_path, 'wb') as records:
+        def flush(key, moves):
+            nonlocal key_count, record_count
+            moves = [(move, *stats) for move, stats in moves.items() if sum(stats) >= min_games]
+            if not moves:
+                return
+            moves.sort(key=lambda m: (-(m[1] + m[2] + m[3]), m[0]))  # Most played first
+            index.write(INDEX_ENTRY.pack(key, record_count, len(moves)))
+            for move, wins, draws, losses in moves:
+                records.write(RECORD.pack(move, wins, draws, losses))
+            key_count += 1
+            record_count += len(moves)
+
+        current, moves = None, {}
+        for key, move, wins, draws, losses in heapq.merge(*(_read_run(run) for run in runs)):
+            if key != current:
+                if current is not None:
+                    flush(current, moves)
+                current, moves = key, {}
+            stats = moves.setdefault(move, [0, 0, 0])
+            stats[0] += wins
+            stats[1] += draws
+            stats[2] += losses
+        if current is not None:
+            flush(current, moves)
+    return key_count, record_count
+
+
+def write_book(out_path, index_path, records_path, key_count, record_count, depth):
+    """Write the hash table file from _merge_runs output, without loading it."""
+    slot_count = 1
+    while slot_count < max(1, key_count) * 2:  # Keep the load factor at or below 0.5
+        slot_count *= 2
+    records_offset = HEADER.size + slot_count * SLOT.size
+
+    tmp_path = out_path + '.tmp'
+    with open(tmp_path, 'w+b') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, slot_count, record_count, depth))
+        f.truncate(records_offset)  # Empty slots are all zeros
+        with mmap.mmap(f.fileno(), records_offset) as table, open(index_path, 'rb') as index:
+            mask = slot_count - 1
+            while True:
+                data = index.read(INDEX_ENTRY.size * 4096)
+                if not data:
+                    break
+                for key, first, count in INDEX_ENTRY.iter_unpack(data):
+                    i = key & mask
+                    while SLOT.unpack_from(table, HEADER.size + i * SLOT.size)[0]:
+                        i = (i + 1) & mask
+                    SLOT.pack_into(table, HEADER.size + i * SLOT.size, key, first, count, 0)
+        f.seek(records_offset)
+        with open(records_path, 'rb') as records:
+            shutil.copyfileobj(records, f)
+    os.replace(tmp_path, out_path)
+
+
+class BookMove(NamedTuple):
+    move: Tuple[int, int, int, int]  # (main_row, main_col, sub_row, sub_col)
+    wins: int
+    draws: int
+    losses: int
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    @property
+    def score(self):
+        """Expected score for the side to move, draws counting half."""
+        return (self.wins + 0.5 * self.draws) / self.games if self.games else 0.0
+
+
+class OpeningBook:
+    """Read-only, memory-mapped view of a book file."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.slot_count, self.record_count, self.depth = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not an opening book")
+        self.records_offset = HEADER.size + self.slot_count * SLOT.size
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def lookup_position(self, position: Position) -> List[BookMove]:
+        """Get book moves for a position, in that position's own frame."""
+        key, symmetries = position.key()
+        mask = self.slot_count - 1
+        i = key & mask
+        while True:
+            slot_key, first, count, _ = SLOT.unpack_from(self.data, HEADER.size + i * SLOT.size)
+            if slot_key == 0:
+                return []
+            if slot_key == key:
+                break
+            i = (i + 1) & mask
+        inverse = INVERSE_CELL_PERMS[symmetries[0]]
+        moves = []
+        for r in range(first, first + count):
+            move, wins, draws, losses = RECORD.unpack_from(
+                self.data, self.records_offset + r * RECORD.size)
+            moves.append(BookMove(index_to_move(inverse[move]), wins, draws, losses))
+        return moves
+
+    def lookup_moves(self, moves) -> List[BookMove]:
+        """Get book moves after a sequence of cell indexes from the start."""
+        return self.lookup_position(Position.from_moves(moves))
+
+    def lookup_game(self, game) -> List[BookMove]:
+        """Get book moves for the current position of an UltimateTicTacToe."""
+        return self.lookup_position(Position.from_game(game))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the opening book.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build')
+    build_parser.add_argument('--db', default=os.path.join('tmp', 'result', 'games.db'))
+    build_parser.add_argument('--out', default=os.path.join('tmp', 'result', 'openings.book'))
+    build_parser.add_argument('--depth', type=int, default=12, help='plies per game to index')
+    build_parser.add_argument('--workers', type=int, default=None)
+    build_parser.add_argument('--min-games', type=int, default=1)
+    lookup_parser = subparsers.add_parser('lookup')
+    lookup_parser.add_argument('--book', default=os.path.join('tmp', 'result', 'openings.book'))
+    lookup_parser.add_argument('moves', nargs='*', type=int, help='cell indexes played so far')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        from records import GameStore
+        positions = build(GameStore(args.db), args.out, args.depth, args.workers,
+                          min_games=args.min_games)
+        print(f"Wrote {positions} positions to {args.out}")
+    else:
+        book = OpeningBook(args.book)
+        for entry in book.lookup_moves(args.moves):
+            print(f"{entry.move} (cell {move_to_index(*entry.move)}): {entry.games} games, "
+                  f"W/D/L {entry.wins}/{entry.draws}/{entry.losses}, score {entry.score:.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,50 +1,264 @@
+import itertools
 import socket
 import threading
 import time
 import pickle
-from typing import List, Dict
-import logging
-import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, NamedTuple, Optional
+import netenv
+import sockopts
+import connector
+import protocol
+from protocol import MessageReader
+from ratelimit import DropCounter, RateLimiter
+from transport import send_all
+from game import index_to_move
+
+
+# Process-wide pool for blocking connects; threads are started lazily
+connect_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='peer-connect')
+
+
+# Message types accepted on each path; anything else is dropped unparsed further
+DISCOVERY_TYPES = {'CONNECT_REQUEST'}
+
+# Shared by every peer, so a version number never means two different states
+_versions = itertools.count(1)
+
+# One DiscoveryFilter per kind of limit for the peers sharing a transport
+_shared_filters = {}
+_shared_filters_lock = threading.Lock()
+
+
+class DiscoveryFilter:
+    """The checks a discovery datagram gets before any player sees it.
+
+    Cheapest first: shape and size, rate per source, then decoding and
+    the fields a CONNECT_REQUEST must carry. On the shared transport one
+    filter serves every player, so a flood is parsed and counted once
+    rather than once per player.
+    """
+
+    def __init__(self, limiter, drops, max_username_length):
+        self.limiter = limiter
+        self.drops = drops
+        self.max_username_length = max_username_length
+
+    def decode(self, data, addr):
+        """The message in a datagram, or None if it is dropped."""
+        if not protocol.looks_like_message(data):
+            self.drops.drop('udp malformed')
+            return None
+        if not self.limiter.allow(addr[0]):
+            self.drops.drop('udp rate')
+            return None
+
+        try:
+            message = protocol.loads(data)
+        except Exception:
+            self.drops.drop('udp malformed')
+            return None
+
+        if not isinstance(message, dict) or message.get('type') not in DISCOVERY_TYPES:
+            self.drops.drop('udp unknown')
+            return None
+
+        # Validate required fields
+        username, tcp_port = message.get('username'), message.get('tcp_port')
+        if (not isinstance(username, str) or not 0 < len(username) <= self.max_username_length
+                or not isinstance(tcp_port, int) or not 0 < tcp_port < 65536
+                or 'local_ip' not in message):
+            self.drops.drop('udp invalid')
+            return None
+        return message
+
+
+class JobsClosed(Exception):
+    """The worker pool has shut down, so no background job can start."""
+
+
+class PeerState(NamedTuple):
+    """What the web pages poll, replaced as a whole so a reader never sees half a change."""
+    version: int
+    connected: bool  # Connected, and the handshake has named the opponent
+    opponent: Optional[str]
+    game_status: Any
 
 
 class PeerNetwork:
-    def __init__(self, username: str, game):
+    # Receive limits, per source address. Broadcasts come once a second per
+    # searching player and moves a few a minute; these only bite on floods
+    UDP_RATE, UDP_BURST = 20, 40
+    UDP_TOTAL_RATE = 500  # Datagrams per second from all sources together
+    ACCEPT_RATE, ACCEPT_BURST = 1, 5
+    PEER_MESSAGE_RATE, PEER_MESSAGE_BURST = 20, 100
+    PEER_BYTE_RATE, PEER_BYTE_BURST = 64 * 1024, 256 * 1024
+    MAX_PENDING_REQUESTS = 32  # Lobby entries; more would not fit on the page anyway
+    MAX_USERNAME_LENGTH = 64
+
+    # Fields the web pages poll; assigning any of them publishes a new ``state``
+    WATCHED = frozenset({'is_connected', 'game_status', 'opponent_username', 'pending_requests'})
+
+    def __init__(self, username: str, game, socket_options=sockopts.DEFAULT_OPTIONS,
+                 transport=None, executor=None, loopback=False):
+        # Held by writers only; readers take ``state`` without locking
+        self.state_lock = threading.Lock()
+        self.update(is_connected=False,
+                    pending_requests=[],
+                    opponent_username=None,
+                    game_status=None)  # To store game status messages
         self.username = username
         self.game = game  # Store game instance
-        self.local_ip = self.get_local_ip()
+        self.socket_options = socket_options
+        # Optional SelectorTransport; without one each peer runs its own threads
+        self.transport = transport
+        # Blocking connects run on a shared pool rather than a thread each
+        self.executor = executor or connect_executor
+        # Discover and connect over 127.0.0.0/8 only, for many players on one host
+        self.loopback = loopback
         self.UDP_PORT = 5005
         self.udp_socket = None
         self.tcp_socket = None
         self.tcp_port = None
         self.peer_connection = None
-        self.is_connected = False
-        self.pending_requests: List[Dict] = []
         self.is_broadcasting = False
         self.broadcast_thread = None
+        self.broadcast_timer = None
+        self.broadcast_count = 0
+        self.message_reader = MessageReader()
         self.request_lock = threading.Lock()
-        self.opponent_username = None
-        self.game_status = None  # To store game status messages
         self.ready = False  # My ready status
         self.opponent_ready = False  # Opponent's ready status
         self.accepted_connection = False
+        # Called with no arguments once a peer connection is made, either way round
+        self.connected_callbacks = []
+        self.connection_lock = threading.Lock()  # Only one socket becomes the peer connection
+        self.state_requests = set()  # ``since`` of each STATE_REQUEST not answered yet
+        self.events = deque(maxlen=100)  # Completion events for the frontend
+        self.job_ids = itertools.count(1)
+        self.jobs = {}  # Running background job per kind: (job id, future)
+        self.job_lock = threading.Lock()
+        self.accept_limiter = RateLimiter(self.ACCEPT_RATE, self.ACCEPT_BURST)
+        self.message_limiter = RateLimiter(self.PEER_MESSAGE_RATE, self.PEER_MESSAGE_BURST)
+        self.byte_limiter = RateLimiter(self.PEER_BYTE_RATE, self.PEER_BYTE_BURST)
+        self.drops = DropCounter(f"{username} receive")
+        if transport:
+            self.discovery_filter = self.shared_discovery_filter(loopback)
+        else:
+            self.discovery_filter = DiscoveryFilter(self.make_udp_limiter(loopback), self.drops,
+                                                    self.MAX_USERNAME_LENGTH)
+        # Sockets and listener threads are opened by ensure_sockets on first use
+        self.socket_lock = threading.Lock()
+        self.sockets_started = False
+
+    @classmethod
+    def make_udp_limiter(cls, loopback):
+        if loopback:
+            # Every player on the host sends from 127.0.0.1, so only the total applies
+            return RateLimiter(cls.UDP_TOTAL_RATE, cls.UDP_TOTAL_RATE * 2)
+        return RateLimiter(cls.UDP_RATE, cls.UDP_BURST, cls.UDP_TOTAL_RATE)
+
+    @classmethod
+    def shared_discovery_filter(cls, loopback):
+        """The filter for every peer on the shared transport."""
+        with _shared_filters_lock:
+            if loopback not in _shared_filters:
+                _shared_filters[loopback] = DiscoveryFilter(
+                    cls.make_udp_limiter(loopback), DropCounter("discovery receive"),
+                    cls.MAX_USERNAME_LENGTH)
+            return _shared_filters[loopback]
+
+    def __setattr__(self, name, value):
+        if name in self.WATCHED:
+            self.update(**{name: value})
+        else:
+            object.__setattr__(self, name, value)
+
+    def update(self, **fields):
+        """Set polled fields together and publish them as one new state."""
+        with self.state_lock:
+            for name, value in fields.items():
+                object.__setattr__(self, name, value)
+            self.publish()
+
+    def changed(self):
+        """Publish a new state after changing a polled field in place."""
+        with self.state_lock:
+            self.publish()
+
+    def publish(self):
+        # Caller holds state_lock. Swapping one reference is atomic, so
+        # readers get either the old state or the new one
+        self.state = PeerState(next(_versions),
+                               self.is_connected and self.opponent_username is not None,
+                               self.opponent_username, self.game_status)
+
+    @property
+    def version(self):
+        """Changes whenever anything the pages poll does."""
+        return self.state.version
+
+    @property
+    def local_ip(self):
+        """Local IP address, read from the process-wide network cache."""
+        if self.loopback:
+            return '127.0.0.1'
+        return netenv.get_snapshot().primary_ip
+
+    def get_discovery_addresses(self):
+        """Get the (advertised addresses, broadcast addresses) for discovery."""
+        if self.loopback:
+            return ['127.0.0.1'], ['127.255.255.255']
+        snapshot = netenv.get_snapshot()
+        # Fall back to the limited broadcast if no interface was found
+        return snapshot.advertised_addresses, list(snapshot.broadcast_addresses) or ['<broadcast>']
+
+    def is_own_broadcast(self, addr, message):
+        """Check whether a discovery datagram was sent by this peer."""
+        if self.loopback:
+            # Every player on the host shares 127.0.0.1, so go by name
+            return message.get('username') == self.username
+        return addr[0] in netenv.get_snapshot().local_addresses
 
     def get_local_ip(self):
         """Get local IP address."""
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        try:
-            s.connect(('8.8.8.8', 80))
-            local_ip = s.getsockname()[0]
-            print(f"Local IP: {local_ip}")
-        except Exception:
-            local_ip = '127.0.0.1'
-            print("Failed to get local IP, using localhost")
-        finally:
-            s.close()
-        return local_ip
+        return self.local_ip
+
+    def on_network_change(self, old, new):
+        """Re-bind the discovery socket after an address change."""
+        print(f"{self.username}: local IP changed from {old.primary_ip} to {new.primary_ip}")
+        # The transport's shared socket is bound to the wildcard address
+        if self.udp_socket and not self.transport:
+            old_socket = self.udp_socket
+            self.initialize_udp_socket()
+            try:
+                old_socket.close()
+            except:
+                pass
+
+    def ensure_sockets(self):
+        """Open the discovery and TCP sockets and start listening, the first time only."""
+        with self.socket_lock:
+            if self.sockets_started:
+                return True
+            if not self.udp_socket and not self.initialize_udp_socket():
+                return False
+            if not self.tcp_socket and not self.initialize_tcp_socket():
+                return False
+            self.start_udp_listener()
+            # Re-bind discovery when the host's addresses change
+            netenv.get_environment().subscribe(self.on_network_change)
+            self.sockets_started = True
+            return True
 
     def initialize_udp_socket(self):
         """Initialize UDP socket for broadcasting and listening."""
         try:
+            if self.transport:
+                self.udp_socket = self.transport.add_discovery_handler(
+                    self.UDP_PORT, self.handle_discovery_message, self.discovery_filter.decode)
+                return True
             self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
             self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -59,16 +273,28 @@ class PeerNetwork:
     def initialize_tcp_socket(self):
         """Initialize TCP socket for direct communication."""
         try:
-            self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if socket.has_dualstack_ipv6():
+                # One listener for both the IPv4 and IPv6 addresses we advertise
+                self.tcp_socket = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+                self.tcp_socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+                bind_address = ('::', 0)
+            else:
+                self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                bind_address = ('0.0.0.0', 0)
             self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.tcp_socket.bind(('0.0.0.0', 0))
+            # Accepted sockets inherit buffer sizes from the listener
+            self.socket_options.apply_buffers(self.tcp_socket)
+            self.tcp_socket.bind(bind_address)
             self.tcp_port = self.tcp_socket.getsockname()[1]
             self.tcp_socket.listen(1)
             print(f"TCP socket initialized on port {self.tcp_port}")
             
-            # Start TCP listener thread
-            tcp_listener_thread = threading.Thread(target=self.listen_for_tcp, daemon=True)
-            tcp_listener_thread.start()
+            if self.transport:
+                self.transport.add_listener(self.tcp_socket, self.handle_tcp_accept)
+            else:
+                # Start TCP listener thread
+                tcp_listener_thread = threading.Thread(target=self.listen_for_tcp, daemon=True)
+                tcp_listener_thread.start()
             
             return True
         except Exception as e:
@@ -80,34 +306,72 @@ class PeerNetwork:
         while True:
             try:
                 client_socket, client_address = self.tcp_socket.accept()
-                if not self.is_connected:
-                    self.peer_connection = client_socket
-                    self.is_connected = True
-                    print(f"Accepted TCP connection from {client_address}")
-                    
-                    # Start message handling thread
-                    threading.Thread(target=self.handle_peer_messages, 
-                                   daemon=True).start()
-                    
-                    # Send connection confirmation
-                    self.send_message({
-                        'type': 'CONNECTION_ACCEPTED',
-                        'username': self.username
-                    })
-                else:
-                    # Reject connection if already connected
-                    client_socket.close()
+                self.handle_tcp_accept(client_socket, client_address)
             except Exception as e:
                 print(f"TCP accept error: {e}")
                 break
 
+    def handle_tcp_accept(self, client_socket, client_address):
+        """Take an incoming TCP connection as the peer connection."""
+        if not self.accept_limiter.allow(client_address[0]):
+            self.drops.drop('tcp accept rate')
+            client_socket.close()
+            return
+        self.socket_options.apply(client_socket)
+        if self.claim_connection(client_socket):
+            print(f"Accepted TCP connection from {client_address}")
+            
+            self.start_peer_reader()
+            
+            # Send connection confirmation
+            self.send_message({
+                'type': 'CONNECTION_ACCEPTED',
+                'username': self.username
+            })
+            self.notify_connected()
+        else:
+            # Reject connection if already connected
+            client_socket.close()
+
+    def claim_connection(self, peer_socket, opponent_username=None):
+        """Make ``peer_socket`` the peer connection; False if there already is one."""
+        with self.connection_lock:
+            if self.is_connected:
+                return False
+            self.peer_connection = peer_socket
+            fields = {'is_connected': True}
+            if opponent_username is not None:
+                fields['opponent_username'] = opponent_username
+            self.update(**fields)
+            return True
+
+    def notify_connected(self):
+        for callback in self.connected_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Connected callback error: {e}")
+
+    def start_peer_reader(self):
+        """Start reading messages from the new peer connection."""
+        self.message_reader = MessageReader()
+        if self.transport:
+            self.transport.add_connection(
+                self.peer_connection, self.handle_peer_data,
+                lambda: self.handle_disconnect("Opponent disconnected"))
+        else:
+            # Start message handling thread
+            threading.Thread(target=self.handle_peer_messages,
+                             daemon=True).start()
+
+    def start_udp_listener(self):
+        """Start receiving discovery broadcasts."""
+        if not self.transport:
+            threading.Thread(target=self.listen_for_udp, daemon=True).start()
+
     def start(self):
         """Start the peer network."""
-        self.initialize_udp_socket()
-
-        # Start UDP listener thread
-        udp_listener_thread = threading.Thread(target=self.listen_for_udp, daemon=True)
-        udp_listener_thread.start()
+        self.ensure_sockets()
 
         while True:
             if not self.is_connected:
@@ -133,96 +397,73 @@ class PeerNetwork:
 
     def broadcast_connect_request(self):
         """Start broadcasting connection requests with improved reliability."""
-        if not self.tcp_socket:
-            if not self.initialize_tcp_socket():
-                return False
-
-        if not self.udp_socket:
-            if not self.initialize_udp_socket():
-                return False
+        if not self.ensure_sockets():
+            return False
 
         print(f"Broadcasting connection request from {self.username}...")
         self.is_broadcasting = True
         
+        if self.transport:
+            if self.broadcast_timer:
+                self.broadcast_timer.cancel()
+            self.broadcast_timer = self.transport.call_later(0, self.broadcast_tick, interval=1)
+            return True
+
         def broadcast_loop():
-            broadcast_count = 0
             while self.is_broadcasting and not self.is_connected:
-                try:
-                    request_msg = pickle.dumps({
-                        'type': 'CONNECT_REQUEST',
-                        'username': self.username,
-                        'local_ip': self.local_ip,
-                        'tcp_port': self.tcp_port,
-                        'sequence': broadcast_count
-                    })
-                    
-                    # Send to broadcast address
-                    self.udp_socket.sendto(request_msg, ('<broadcast>', self.UDP_PORT))
-                    
-                    # Also try sending to subnet broadcast
-                    subnet_broadcast = '.'.join(self.local_ip.split('.')[:-1] + ['255'])
-                    self.udp_socket.sendto(request_msg, (subnet_broadcast, self.UDP_PORT))
-                    
-                    broadcast_count += 1
-                    time.sleep(1)  # Broadcast more frequently
-                except Exception as e:
-                    print(f"Broadcasting error: {e}")
-                    time.sleep(1)  # Prevent tight loop on error
-                    continue
+                self.broadcast_once()
+                time.sleep(1)  # Broadcast more frequently
 
         self.broadcast_thread = threading.Thread(target=broadcast_loop, daemon=True)
         self.broadcast_thread.start()
         return True
 
+    def broadcast_tick(self):
+        """Transport timer callback: broadcast until searching stops."""
+        if not self.is_broadcasting or self.is_connected:
+            self.broadcast_timer.cancel()
+            return
+        self.broadcast_once()
+
+    def broadcast_once(self):
+        """Send one connection request to every broadcast address."""
+        try:
+            advertised_addresses, broadcast_addresses = self.get_discovery_addresses()
+            request_msg = pickle.dumps({
+                'type': 'CONNECT_REQUEST',
+                'username': self.username,
+                'local_ip': self.local_ip,
+                'addresses': advertised_addresses,
+                'tcp_port': self.tcp_port,
+                'sequence': self.broadcast_count
+            })
+            
+            # Send once to each interface's directed broadcast address
+            for broadcast_address in broadcast_addresses:
+                try:
+                    self.udp_socket.sendto(request_msg, (broadcast_address, self.UDP_PORT))
+                except BlockingIOError:
+                    pass  # Send buffer full; the next broadcast goes out in a second
+            
+            self.broadcast_count += 1
+        except Exception as e:
+            print(f"Broadcasting error: {e}")
+
     def stop_broadcasting(self):
         """Stop broadcasting connection requests."""
         self.is_broadcasting = False
+        if self.broadcast_timer:
+            self.broadcast_timer.cancel()
         if self.broadcast_thread:
             self.broadcast_thread.join(timeout=1)
 
     def listen_for_udp(self):
         """Listen for incoming UDP messages with improved error handling and validation."""
         print(f"Starting UDP listener for {self.username}...")
-        while True:
+        while self.udp_socket is not None:  # Cleared by close()
             try:
                 data, addr = self.udp_socket.recvfrom(4096)
-                print(f"Received UDP data from {addr}")
-                if not data:
-                    continue
-
-                try:
-                    message = pickle.loads(data)
-                    print(f"Decoded message: {message}")
-                except pickle.UnpicklingError:
-                    print(f"Invalid message format from {addr}")
-                    continue
-
-                if not isinstance(message, dict) or 'type' not in message:
-                    print(f"Malformed message from {addr}")
-                    continue
-
-                if (message['type'] == 'CONNECT_REQUEST' and 
-                    addr[0] != self.local_ip and  # Ignore self-broadcasts
-                    not self.is_connected):  # Only process if not already connected
-                    
-                    # Validate required fields
-                    required_fields = ['username', 'local_ip', 'tcp_port']
-                    if not all(field in message for field in required_fields):
-                        print(f"Missing required fields in message from {addr}")
-                        continue
-
-                    request = {
-                        'username': message['username'],
-                        'ip': addr[0],  # Use actual sender IP
-                        'tcp_port': message['tcp_port'],
-                        'timestamp': time.time(),
-                        'strength': 1  # New field to track request persistence
-                    }
-
-                    self.update_pending_requests(request)
-                    print(f"\nNew connection request from {request['username']} at {request['ip']}")
-                    self.display_pending_requests()
-
+                self.handle_udp_datagram(data, addr)
             except socket.error as e:
                 print(f"UDP socket error: {e}")
                 time.sleep(1)  # Prevent tight loop on error
@@ -230,8 +471,42 @@ class PeerNetwork:
                 print(f"Unexpected error in UDP listener: {e}")
                 time.sleep(1)
 
+    def handle_udp_datagram(self, data, addr):
+        """Handle one discovery datagram."""
+        message = self.discovery_filter.decode(data, addr)
+        if message is not None:
+            self.handle_discovery_message(message, addr)
+
+    def handle_discovery_message(self, message, addr):
+        """Handle a discovery message that passed the DiscoveryFilter."""
+        if (message['type'] == 'CONNECT_REQUEST' and 
+            not self.is_own_broadcast(addr, message) and  # Ignore self-broadcasts
+            not self.is_connected):  # Only process if not already connected
+            username, tcp_port = message['username'], message['tcp_port']
+            request = {
+                'username': username,
+                'ip': addr[0],  # Use actual sender IP
+                # Sender IP first, then every advertised address
+                'addresses': connector.order_addresses(
+                    addr[0], message.get('addresses', [])),
+                'tcp_port': tcp_port,
+                'timestamp': time.time(),
+                'strength': 1  # New field to track request persistence
+            }
+
+            full = len(self.pending_requests) >= self.MAX_PENDING_REQUESTS
+            # Repeats of a broadcast only refresh the entry, and a full table
+            # is counted in the drop summary instead, so a flood stays quiet
+            if self.update_pending_requests(request) and not full:
+                print(f"New connection request from {username} at {request['ip']}")
+
     def update_pending_requests(self, new_request: Dict):
-        """Update pending requests with thread safety and improved handling."""
+        """Add or refresh a pending request; True if it was added.
+
+        Past MAX_PENDING_REQUESTS the weakest request makes room: the one
+        rebroadcast least, oldest first. A player who keeps searching
+        outlasts a flood of one-off names.
+        """
         with self.request_lock:
             current_time = time.time()
             
@@ -253,38 +528,36 @@ class PeerNetwork:
                 existing_request['timestamp'] = current_time
                 existing_request['strength'] += 1
                 existing_request['ip'] = new_request['ip']
+                existing_request['addresses'] = new_request['addresses']
                 existing_request['tcp_port'] = new_request['tcp_port']
             else:
+                if len(self.pending_requests) >= self.MAX_PENDING_REQUESTS:
+                    weakest = min(self.pending_requests, key=lambda r: (r['strength'], r['timestamp']))
+                    self.pending_requests.remove(weakest)
+                    self.drops.drop('pending requests full')
                 # Add new request
                 self.pending_requests.append(new_request)
+            self.changed()
+            return existing_request is None
 
-    def display_pending_requests(self):
-        """Display current pending requests in a formatted way."""
+    def expire_requests(self):
+        """Drop requests older than 30 seconds and return the current version."""
         with self.request_lock:
-            if not self.pending_requests:
-                print("\nNo pending connection requests.")
-                return
-
-            print("\nPending connection requests:")
-            print("-" * 50)
-            for i, request in enumerate(self.pending_requests, 1):
-                age = time.time() - request['timestamp']
-                print(f"{i}. Username: {request['username']}")
-                print(f"   IP: {request['ip']}:{request['tcp_port']}")
-                print(f"   Age: {age:.1f} seconds")
-                print(f"   Signal Strength: {'█' * request['strength']}")
-                print("-" * 50)
+            current_time = time.time()
+            if any(current_time - r['timestamp'] >= 30 for r in self.pending_requests):
+                self.pending_requests = [
+                    r for r in self.pending_requests
+                    if current_time - r['timestamp'] < 30
+                ]
+        return self.version
 
     def get_pending_requests(self):
         """Get list of pending connection requests."""
         print(f"Getting pending requests for {self.username}")
+        # The lobby polls this first, so it is when we start listening
+        self.ensure_sockets()
+        self.expire_requests()
         with self.request_lock:
-            current_time = time.time()
-            # Clean up old requests before returning
-            self.pending_requests = [
-                r for r in self.pending_requests 
-                if current_time - r['timestamp'] < 30
-            ]
             # Filter out self requests
             filtered_requests = [
                 r for r in self.pending_requests 
@@ -300,55 +573,141 @@ class PeerNetwork:
 
     def accept_connection(self, opponent_username):
         """Accept a connection request from a specific user."""
-        for request in self.pending_requests:
-            if request['username'] == opponent_username:
+        with self.request_lock:
+            request = next((r for r in self.pending_requests
+                            if r['username'] == opponent_username), None)
+        if request is None or self.is_connected:
+            return False
+
+        # Stop broadcasting if we're searching
+        self.stop_broadcasting()
+
+        if not self.ensure_sockets():
+            return False
+
+        try:
+            # Race every advertised address and keep the first that connects
+            peer_socket, address = connector.connect_first(
+                request['addresses'], request['tcp_port'], self.socket_options)
+        except OSError as e:
+            print(f"Connection error: {e}")
+            return False
+
+        if not self.claim_connection(peer_socket, opponent_username):
+            # The opponent, or someone else, connected to us meanwhile
+            peer_socket.close()
+            return False
+        print(f"Connected to peer {opponent_username} at {address}:{request['tcp_port']}")
+
+        self.start_peer_reader()
+
+        # Clean up requests
+        with self.request_lock:
+            self.pending_requests = []
+
+        # Send connection confirmation
+        self.send_message({
+            'type': 'CONNECTION_ACCEPTED',
+            'username': self.username
+        })
+
+        self.accepted_connection = True
+        self.notify_connected()
+
+        return True
+
+    def submit_job(self, kind, work, **details):
+        """Run ``work`` on the executor without blocking the caller.
+
+        Returns a job id straight away. When ``work`` finishes, an event of
+        type ``kind`` is queued (see get_events) carrying the job id,
+        ``details`` and whether ``work`` returned a true value. While a job
+        of the same kind is still running its id is returned instead of
+        queueing another, so each peer has at most one job of each kind.
+        Raises JobsClosed once the executor has shut down.
+        """
+        with self.job_lock:
+            running = self.jobs.get(kind)
+            if running is not None and not running[1].done():
+                return running[0]
+            job_id = next(self.job_ids)
+
+            def run():
+                event = {'type': kind, 'job': job_id, **details}
                 try:
-                    # Stop broadcasting if we're searching
-                    self.stop_broadcasting()
-                    
-                    # Initialize TCP connection
-                    if not self.tcp_socket:
-                        if not self.initialize_tcp_socket():
-                            return False
-                    
-                    # Connect to peer
-                    peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    print(f"Attempting to connect to {request['ip']}:{request['tcp_port']}")
-                    # Set a timeout for the connection attempt
-                    peer_socket.settimeout(5)
-                    peer_socket.connect((request['ip'], request['tcp_port']))
-                    # Reset to blocking mode after connection
-                    peer_socket.settimeout(None)
-                    self.peer_connection = peer_socket
-                    self.is_connected = True
-                    self.opponent_username = opponent_username
-                    print(f"Connected to peer {opponent_username} at {request['ip']}:{request['tcp_port']}")
-
-                    # Start message handling thread
-                    threading.Thread(target=self.handle_peer_messages,
-                                  daemon=True).start()
-                    
-                    # Clean up requests
-                    self.pending_requests = []
-                    
-                    # Send connection confirmation
-                    self.send_message({
-                        'type': 'CONNECTION_ACCEPTED',
-                        'username': self.username
-                    })
-                    
-                    self.accepted_connection = True
-                    
-                    return True
+                    event['success'] = bool(work())
                 except Exception as e:
-                    print(f"Connection error: {e}")
-                    # Clean up failed connection
+                    print(f"{kind} job error: {e}")
+                    event['success'] = False
+                    event['error'] = str(e)
+                self.post_event(event)
+
+            try:
+                self.jobs[kind] = (job_id, self.executor.submit(run))
+            except RuntimeError as e:
+                raise JobsClosed(str(e)) from e
+        return job_id
+
+    def job_running(self, kind):
+        with self.job_lock:
+            running = self.jobs.get(kind)
+        return running is not None and not running[1].done()
+
+    def accept_connection_async(self, opponent_username, on_connected=None, on_failed=None):
+        """Accept a connection request without blocking the caller.
+
+        The result is delivered as a CONNECT_RESULT event (see submit_job).
+        ``on_connected`` or ``on_failed`` is called from the worker thread
+        once the attempt is over. Returns the job id, or None if a
+        connection attempt is already in progress; raises JobsClosed
+        during shutdown.
+        """
+        if self.job_running('CONNECT_RESULT'):
+            return None
+
+        def connect():
+            success = False
+            try:
+                success = self.accept_connection(opponent_username)
+            finally:
+                callback = on_connected if success else on_failed
+                if callback:
                     try:
-                        peer_socket.close()
-                    except:
-                        pass
-                    return False
-        return False
+                        callback()
+                    except Exception as e:
+                        print(f"Connect callback error: {e}")
+            return success
+
+        return self.submit_job('CONNECT_RESULT', connect, username=opponent_username)
+
+    def broadcast_connect_request_async(self):
+        """Start searching off the caller's thread; reported as a BROADCAST_RESULT event."""
+        return self.submit_job('BROADCAST_RESULT', self.broadcast_connect_request)
+
+    def leave(self, reason="Opponent left the game"):
+        """Tell the opponent we are leaving, then drop the connection."""
+        if self.is_connected:
+            self.send_message({'type': 'DISCONNECT', 'message': reason})
+        self.handle_disconnect("You left the game")
+        return True
+
+    def leave_async(self):
+        """leave() off the caller's thread; reported as a DISCONNECT_RESULT event."""
+        return self.submit_job('DISCONNECT_RESULT', self.leave)
+
+    def post_event(self, event):
+        """Queue an event for the frontend."""
+        self.events.append(event)
+
+    def get_events(self):
+        """Get and clear queued events."""
+        events = []
+        try:
+            while True:
+                events.append(self.events.popleft())
+        except IndexError:
+            pass
+        return events
 
     def reject_connection(self, username):
         """Reject a connection request from a specific user."""
@@ -361,70 +720,234 @@ class PeerNetwork:
         """Handle incoming messages from connected peer."""
         while self.is_connected:
             try:
-                data = self.peer_connection.recv(1024)
+                data = self.peer_connection.recv(4096)
                 if not data:
                     self.handle_disconnect("Opponent disconnected")
                     break
-                message = pickle.loads(data)
-                
-                if message.get('type') == 'MOVE':
-                    print(f"Received move: {message}")
-                    # Update game state and get results
-                    result = self.game.receive_move(
-                        message['main_row'],
-                        message['main_col'],
-                        message['sub_row'],
-                        message['sub_col']
-                    )
-                    self.game.print_board()
-                    
-                    # Store the move and results in game_status for the frontend
-                    self.game_status = {
-                        'type': 'MOVE',
-                        'main_row': message['main_row'],
-                        'main_col': message['main_col'],
-                        'sub_row': message['sub_row'],
-                        'sub_col': message['sub_col'],
-                        'sub_board_result': result.get('sub_board_result'),
-                        'game_over': result.get('game_over'),
-                        'winner': result.get('winner'),
-                        'is_draw': result.get('is_draw')
-                    }
-                elif message.get('type') == 'GAME_START':
-                    print(f"Game starting, first player: {message.get('first_player')}")
-                    self.game_status = {
-                        'type': 'GAME_START',
-                        'first_player': message.get('first_player')
-                    }
-                elif message.get('type') == 'DISCONNECT':
-                    self.handle_disconnect(message.get('message', 'Opponent disconnected'))
-                    break
-                else:
-                    print(f"Received unknown message type: {message}")
+                self.handle_peer_data(data)
             except Exception as e:
                 print(f"Message handling error: {e}")
                 self.handle_disconnect("Connection error occurred")
                 break
 
+    def handle_peer_data(self, data):
+        """Handle bytes received from the peer; one read may hold several messages."""
+        # Bytes can't be dropped from the middle of a stream, so a flood ends the connection
+        if not self.byte_limiter.allow('peer', len(data)):
+            self.drops.drop('tcp byte rate')
+            self.handle_disconnect("Opponent sent too much data")
+            return
+        try:
+            for message in self.message_reader.feed(data):
+                if not self.is_connected:
+                    break
+                if not isinstance(message, dict):
+                    self.drops.drop('tcp unknown')
+                    continue
+                if not self.message_limiter.allow('peer'):
+                    self.drops.drop('tcp message rate')
+                    continue
+                self.handle_message(message)
+        except Exception as e:
+            print(f"Message handling error: {e}")
+            self.handle_disconnect("Connection error occurred")
+
+    def handle_message(self, message):
+        """Apply one message from the peer to the game."""
+        if message.get('type') == 'MOVE':
+            print(f"Received move: {message}")
+            # Update game state and get results
+            result = self.game.receive_move(
+                message.get('main_row'),
+                message.get('main_col'),
+                message.get('sub_row'),
+                message.get('sub_col'),
+                message.get('hash')
+            )
+            if not result['valid']:
+                # Not applied; tell the sender at once rather than play on out of step
+                print(f"Rejected move from peer: {result['message']}")
+                self.send_message({'type': 'MOVE_REJECTED', 'seq': message.get('seq'),
+                                   'message': result['message']})
+                self.game_status = {'type': 'DESYNC', 'message': result['message']}
+                return
+            if result['diverged']:
+                # Replaying moves after ours cannot fix this; ask for their whole game
+                print(f"Board diverged from peer after move {result['seq']}")
+                self.request_state(full=True)
+            self.game.print_board()
+            
+            # Store the move and results in game_status for the frontend
+            self.game_status = {
+                'type': 'MOVE',
+                'seq': result['seq'],
+                'hash': result['hash'],
+                'diverged': result['diverged'],
+                'main_row': message['main_row'],
+                'main_col': message['main_col'],
+                'sub_row': message['sub_row'],
+                'sub_col': message['sub_col'],
+                'sub_board_result': result.get('sub_board_result'),
+                'game_over': result.get('game_over'),
+                'winner': result.get('winner'),
+                'is_draw': result.get('is_draw')
+            }
+        elif message.get('type') == 'GAME_START':
+            print(f"Game starting, first player: {message.get('first_player')}")
+            if self.game.game_started and self.game.moves:
+                # The opponent restarted mid-game; compare notes instead of starting over
+                self.request_state()
+            # Start now so a MOVE that follows cannot be undone by a late /start_game
+            self.game.start_game(message.get('first_player'), message.get('game_id'))
+            self.game_status = {
+                'type': 'GAME_START',
+                'first_player': message.get('first_player')
+            }
+        elif message.get('type') == 'MOVE_REJECTED':
+            print(f"Peer rejected our move {message.get('seq')}: {message.get('message')}")
+            self.take_back_move(message)
+        elif message.get('type') == 'STATE_REQUEST':
+            self.send_message({'type': 'STATE', **self.game.get_state(message.get('since'))})
+        elif message.get('type') == 'STATE':
+            self.apply_state(message)
+        elif message.get('type') == 'CONNECTION_ACCEPTED':
+            # The accepting side only learns who connected from this message
+            self.opponent_username = message.get('username')
+        elif message.get('type') == 'DISCONNECT':
+            self.handle_disconnect(message.get('message', 'Opponent disconnected'))
+        else:
+            print(f"Received unknown message type: {message}")
+
+    def request_state(self, full=False):
+        """Ask the peer for the moves we may have missed, or with ``full`` for all of them."""
+        since = 0 if full else len(self.game.moves)
+        self.state_requests.add(since)
+        self.send_message({'type': 'STATE_REQUEST', 'since': since})
+
+    def take_back_move(self, message):
+        """Undo our last move after the peer refused it, then compare whole games.
+
+        The peer never applied the move and still waits for one, so keeping
+        it would leave neither side able to move.
+        """
+        moves = self.game.moves
+        my_parity = 0 if self.game.symbol == 'X' else 1
+        if (message.get('seq') != len(moves) or len(moves) % 2 != 1 - my_parity
+                or self.game.result is not None
+                or not self.game.load_moves(list(moves[:-1]))):
+            # Not our latest move, or it already ended the game
+            self.game_status = {'type': 'DESYNC', 'message': message.get('message')}
+            return
+        self.game_status = {'type': 'STATE', 'seq': len(self.game.moves), 'full': True}
+        # The refusal may mean the boards differ; check against the peer's game
+        self.request_state(full=True)
+
+    def apply_state(self, state):
+        """Catch up on opponent moves from a STATE answering our STATE_REQUEST.
+
+        If the peer's moves disagree with ours on one of the opponent's
+        moves, a full STATE (since 0) replaces our board with theirs and
+        anything else asks for one. A STATE we did not ask for, or one that
+        changes a move of our own, is never applied.
+        """
+        moves = state.get('moves')
+        since = state.get('since')
+        if type(since) is not int or since not in self.state_requests:
+            self.drops.drop('unrequested state')
+            return
+        self.state_requests.discard(since)
+        if not isinstance(moves, list) or not 0 <= since <= len(self.game.moves):
+            print(f"Cannot sync from state: {state}")
+            return
+        my_parity = 0 if self.game.symbol == 'X' else 1
+        for ply, index in enumerate(moves, since):
+            if ply % 2 == my_parity and (ply >= len(self.game.moves) or self.game.moves[ply] != index):
+                self.reject_state(ply)
+                return
+            if ply < len(self.game.moves):
+                if self.game.moves[ply] != index:
+                    print(f"Game state diverged from peer at move {ply}")
+                    self.replace_state(state)
+                    return
+            elif (type(index) is not int or not 0 <= index < 81
+                    or not self.game.receive_move(*index_to_move(index))['valid']):
+                self.replace_state(state)
+                return
+        # Tell the frontend to fetch /state rather than replaying one move
+        self.game_status = {'type': 'STATE', 'seq': len(self.game.moves)}
+
+    def replace_state(self, state):
+        """Take the peer's game as it stands, once we have all of it."""
+        if state.get('since') != 0:
+            self.request_state(full=True)
+            return
+        moves = state['moves']
+        my_parity = 0 if self.game.symbol == 'X' else 1
+        for ply in range(my_parity, max(len(moves), len(self.game.moves)), 2):
+            theirs = moves[ply] if ply < len(moves) else None
+            ours = self.game.moves[ply] if ply < len(self.game.moves) else None
+            if theirs != ours:
+                self.reject_state(ply)
+                return
+        if self.game.load_moves(moves):
+            print(f"Board replaced with the peer's, {len(self.game.moves)} moves")
+            # The board changed under the page; it must fetch all of it
+            self.game_status = {'type': 'STATE', 'seq': len(self.game.moves), 'full': True}
+        else:
+            self.game_status = {'type': 'DESYNC', 'message': 'Peer sent a game that is not legal'}
+
+    def reject_state(self, ply):
+        """The peer's game rewrites a move of ours: keep our board and stop."""
+        print(f"Peer's game changes our move {ply}; not applied")
+        self.game_status = {'type': 'DESYNC', 'message': 'Peer changed a move of ours'}
+
     def handle_disconnect(self, reason="Connection lost"):
         """Handle disconnection with cleanup."""
-        self.is_connected = False
-        self.game_status = reason
+        self.update(is_connected=False, game_status=reason, opponent_username=None)
+        self.state_requests.clear()
         if self.peer_connection:
+            if self.transport:
+                self.transport.remove(self.peer_connection)
             try:
                 self.peer_connection.close()
             except:
                 pass
         self.peer_connection = None
-        self.opponent_username = None
         print(f"Peer connection lost: {reason}")
 
+    def close(self):
+        """Release every socket this peer owns."""
+        self.stop_broadcasting()
+        if self.is_connected:
+            self.handle_disconnect("You left the game")
+        if self.tcp_socket:
+            if self.transport:
+                self.transport.remove(self.tcp_socket)
+            try:
+                self.tcp_socket.close()
+            except:
+                pass
+            self.tcp_socket = None
+        if self.transport:
+            # The discovery socket is shared, only stop receiving on it
+            self.transport.remove_discovery_handler(self)
+        elif self.udp_socket:
+            try:
+                self.udp_socket.close()
+            except:
+                pass
+        self.udp_socket = None
+
     def send_message(self, message):
         """Send message to connected peer."""
         if self.is_connected and self.peer_connection:
             try:
                 serialized_message = pickle.dumps(message)
-                self.peer_connection.send(serialized_message)
+                if self.transport:
+                    # Queued on the loop, which may be the thread we are on
+                    self.transport.send(self.peer_connection, serialized_message)
+                else:
+                    send_all(self.peer_connection, serialized_message)
                 print(f"Sent: {message}")
             except Exception as e:
                 print(f"Message send error: {e}")
@@ -432,10 +955,19 @@ class PeerNetwork:
 
     def get_game_status(self):
         """Get current game status."""
-        status = self.game_status
-        self.game_status = None  # Clear after reading
+        status = self.state.game_status
+        self.clear_game_status(status)
         return status
 
+    def clear_game_status(self, status):
+        """Clear a status the frontend has read, unless a newer one replaced it."""
+        if status is None:
+            return
+        with self.state_lock:
+            if self.game_status is status:
+                object.__setattr__(self, 'game_status', None)
+                self.publish()
+
 
 def main():
     username = input("Enter your username: ")
@@ -0,0 +1,67 @@
+import io
+import pickle
+
+# Discovery requests are a couple of hundred bytes and moves far less;
+# anything bigger is not ours
+MAX_DATAGRAM_SIZE = 1024
+MAX_MESSAGE_SIZE = 64 * 1024
+
+
+class ProtocolError(Exception):
+    """Received data that is not a valid peer message."""
+
+
+class _DataUnpickler(pickle.Unpickler):
+    """Unpickle plain data only (dicts, lists, strings, numbers).
+
+    Messages never contain objects, and refusing every class lookup means
+    a crafted pickle from the network cannot run code.
+    """
+
+    def find_class(self, module, name):
+        raise ProtocolError(f"Message refers to {module}.{name}")
+
+
+def looks_like_message(data):
+    """Cheap check before unpickling: small, and a pickle of protocol 2 or later."""
+    return 2 < len(data) <= MAX_DATAGRAM_SIZE and data[0] == 0x80 and 2 <= data[1] <= 5
+
+
+def loads(data):
+    """Unpickle one datagram, refusing anything but plain data."""
+    return _DataUnpickler(io.BytesIO(data)).load()
+
+
+class MessageReader:
+    """Split a TCP byte stream into peer messages.
+
+    Messages are sent back to back as pickles with no length prefix, so one
+    recv() may hold several messages or only part of one. Pickles are
+    self-delimiting: keep unpickling until the buffer runs out and hold on
+    to any incomplete tail until more data arrives.
+    """
+
+    def __init__(self):
+        self.buffer = b''
+
+    def feed(self, data):
+        """Add received bytes and return every complete message.
+
+        Raises ProtocolError for data that is not a message, or when an
+        incomplete message grows past MAX_MESSAGE_SIZE.
+        """
+        self.buffer += data
+        messages = []
+        stream = io.BytesIO(self.buffer)
+        while stream.tell() < len(self.buffer):
+            start = stream.tell()
+            try:
+                messages.append(_DataUnpickler(stream).load())
+            except (EOFError, pickle.UnpicklingError):
+                # Incomplete message, wait for the rest
+                stream.seek(start)
+                break
+        self.buffer = self.buffer[stream.tell():]
+        if len(self.buffer) > MAX_MESSAGE_SIZE:
+            raise ProtocolError(f"Incomplete message over {MAX_MESSAGE_SIZE} bytes")
+        return messages
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+class TokenBucket:
+    """Allows ``rate`` events per second on average, in bursts of up to ``burst``."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def take(self, cost=1.0, now=None):
+        """Spend ``cost`` tokens if there are enough; False means drop."""
+        if now is None:
+            now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+class RateLimiter:
+    """A token bucket per source, plus one shared by all sources.
+
+    The shared bucket caps the total when a flood comes from many (or
+    spoofed) addresses; only the most recently seen ``max_sources`` keep
+    their own bucket, so memory stays bounded.
+    """
+
+    def __init__(self, rate, burst, total_rate=None, total_burst=None, max_sources=4096):
+        self.rate = rate
+        self.burst = burst
+        self.max_sources = max_sources
+        self.buckets = OrderedDict()
+        self.total = None
+        if total_rate is not None:
+            self.total = TokenBucket(total_rate, total_burst or total_rate * 2)
+        self.lock = threading.Lock()
+
+    def allow(self, source, cost=1.0):
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(source)
+            if bucket is None:
+                bucket = self.buckets[source] = TokenBucket(self.rate, self.burst, now)
+                if len(self.buckets) > self.max_sources:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(source)
+            if not bucket.take(cost, now):
+                return False
+            return self.total is None or self.total.take(cost, now)
+
+
+class DropCounter:
+    """Counts dropped packets by reason, logging a summary at most every ``log_interval``."""
+
+    def __init__(self, name, log_interval=10.0):
+        self.name = name
+        self.log_interval = log_interval
+        self.counts = Counter()
+        self.unlogged = Counter()
+        self.last_log = float('-inf')  # The first drop is always logged
+        self.lock = threading.Lock()
+
+    def drop(self, reason):
+        with self.lock:
+            self.counts[reason] += 1
+            self.unlogged[reason] += 1
+            now = time.monotonic()
+            if now - self.last_log < self.log_interval:
+                return
+            summary = ', '.join(f'{reason}: {count}' for reason, count in self.unlogged.items())
+            self.unlogged.clear()
+            self.last_log = now
+        print(f"{self.name}: dropped {summary}")
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
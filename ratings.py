@@ -0,0 +1,280 @@
+"""Elo ratings, updated as each game ends, and a leaderboard over them.
+
+Every player starts at 1500. When a game finishes, both players' ratings
+move by ``k_factor`` times the difference between the result (1 for a
+win, 0.5 for a draw, 0 for a loss) and the result the rating gap
+predicted. A game is counted once, however many of its players are
+hosted here.
+
+The leaderboard counts players per whole rating point in a Fenwick tree
+indexed from the top, so "how many players are rated above me" is a
+prefix sum and the k-th best player is a walk down the tree: rank and
+top-n lookups cost O(log R) steps for R rating points, however many
+players there are. Ratings are kept in SQLite and read back at startup.
+"""
+import atexit
+import heapq
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+DEFAULT_RATING = 1500
+K_FACTOR = 32
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ratings (
+    name TEXT PRIMARY KEY,
+    rating REAL NOT NULL,
+    games INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    draws INTEGER NOT NULL,
+    losses INTEGER NOT NULL
+);
+"""
+
+
+class PlayerRating(NamedTuple):
+    name: str
+    rating: float
+    games: int = 0
+    wins: int = 0
+    draws: int = 0
+    losses: int = 0
+
+    def after(self, rating, score):
+        """This player after a game scored 1, 0.5 or 0."""
+        return PlayerRating(self.name, rating, self.games + 1, self.wins + (score == 1),
+                            self.draws + (score == 0.5), self.losses + (score == 0))
+
+
+def expected_score(rating, opponent_rating):
+    """Score (0 to 1) the rating gap predicts for the first player."""
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def elo_update(rating, opponent_rating, score, k_factor=K_FACTOR):
+    """New rating after scoring ``score`` against ``opponent_rating``."""
+    return rating + k_factor * (score - expected_score(rating, opponent_rating))
+
+
+class Leaderboard:
+    """Players ordered by rating, with O(log R) rank and top-n lookups.
+
+    Ratings outside ``low``-``high`` share the end points. Players whose
+    ratings round to the same point share a rank.
+    """
+
+    def __init__(self, low=0, high=4000):
+        self.low = low
+        self.high = high
+        self.size = high - low + 1
+        self.tree = [0] * (self.size + 1)  # Fenwick tree of player counts, best point first
+        self.points = {}  # Tree index -> {name: rating}
+        self.ratings = {}  # name -> rating
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def set(self, name, rating):
+        self.remove(name)
+        index = self._index(rating)
+        self.ratings[name] = rating
+        self.points.setdefault(index, {})[name] = rating
+        self._add(index, 1)
+
+    def remove(self, name):
+        rating = self.ratings.pop(name, None)
+        if rating is None:
+            return
+        index = self._index(rating)
+        players = self.points[index]
+        del players[name]
+        if not players:
+            del self.points[index]
+        self._add(index, -1)
+
+    def rank(self, name):
+        """1 for the best player, or None if the player is not on the board."""
+        rating = self.ratings.get(name)
+        if rating is None:
+            return None
+        return self._count(self._index(rating) - 1) + 1
+
+    def top(self, n=100):
+        """The best ``n`` players as (rank, name, rating), best first."""
+        result = []
+        while len(result) < n and len(result) < len(self.ratings):
+            # The point holding the next player, then everyone on it
+            index = self._find(len(result) + 1)
+            rank = len(result) + 1
+            players = self.points[index]
+            for name, rating in heapq.nlargest(n - len(result), players.items(),
+                                               key=lambda item: item[1]):
+                result.append((rank, name, rating))
+        return result
+
+    def _index(self, rating):
+        point = min(self.high, max(self.low, round(rating)))
+        return self.high - point + 1
+
+    def _add(self, index, delta):
+        while index <= self.size:
+            self.tree[index] += delta
+            index += index & -index
+
+    def _count(self, index):
+        """Players on tree indexes 1 to ``index``, i.e. rated at or above that point."""
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    def _find(self, k):
+        """Smallest tree index with at least ``k`` players at or above it."""
+        index = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            if index + step <= self.size and self.tree[index + step] < k:
+                index += step
+                k -= self.tree[index]
+            step >>= 1
+        return index + 1
+
+
+class Ratings:
+    """Every player's rating, kept in SQLite at ``path`` (in memory if None).
+
+    ``record`` updates both players and the leaderboard at once and only
+    queues the two changed rows: as in records.GameStore, a background
+    thread writes them in batches, so a game ending never waits on the
+    disk. The same thread reads the saved ratings at startup. Games are
+    recognised by id, so a game reported by both of its players counts once.
+    """
+
+    RECENT_GAMES = 10000  # Game ids remembered for spotting a game reported twice
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 1.0  # Seconds to wait for a batch to fill up
+
+    def __init__(self, path=None, k_factor=K_FACTOR):
+        self.path = path
+        self.k_factor = k_factor
+        self.players = {}  # name -> PlayerRating, for players with at least one game
+        self.leaderboard = Leaderboard()
+        self.recent = OrderedDict()  # Game ids already counted
+        self.lock = threading.Lock()
+        self.version = 0  # Bumped on every change, for conditional GETs
+        self.queue = queue.Queue()
+        self.loaded = threading.Event()
+        self.writer_thread = threading.Thread(target=self._write_loop, daemon=True,
+                                              name='ratings-writer')
+        self.writer_thread.start()
+        atexit.register(self.flush)
+
+    def rating(self, name):
+        return self.player(name).rating
+
+    def player(self, name):
+        self.loaded.wait()
+        with self.lock:
+            return self.players.get(name) or PlayerRating(name, DEFAULT_RATING)
+
+    def rank(self, name):
+        """Leaderboard position, or None before the player's first game."""
+        self.loaded.wait()
+        with self.lock:
+            return self.leaderboard.rank(name)
+
+    def top(self, n=100):
+        """The best ``n`` players as (rank, PlayerRating), best first."""
+        self.loaded.wait()
+        with self.lock:
+            return [(rank, self.players[name]) for rank, name, _ in self.leaderboard.top(n)]
+
+    def record_game(self, game, opponent_username):
+        """Count a finished UltimateTicTacToe."""
+        if game.symbol == 'X':
+            x_player, o_player = game.username, opponent_username
+        else:
+            x_player, o_player = opponent_username, game.username
+        return self.record(game.game_id, x_player, o_player, game.result)
+
+    def record(self, game_id, x_player, o_player, result):
+        """Update both players for a result of 'X', 'O' or 'draw'; False if not counted."""
+        if game_id is None or not x_player or not o_player or result not in ('X', 'O', 'draw'):
+            print(f"Not rating incomplete game {game_id}: {x_player} v {o_player}, {result}")
+            return False
+        score = {'X': 1, 'O': 0, 'draw': 0.5}[result]
+        self.loaded.wait()
+        with self.lock:
+            if game_id in self.recent:
+                return False
+            self.recent[game_id] = True
+            if len(self.recent) > self.RECENT_GAMES:
+                self.recent.popitem(last=False)
+
+            x = self.players.get(x_player) or PlayerRating(x_player, DEFAULT_RATING)
+            o = self.players.get(o_player) or PlayerRating(o_player, DEFAULT_RATING)
+            x, o = (x.after(elo_update(x.rating, o.rating, score, self.k_factor), score),
+                    o.after(elo_update(o.rating, x.rating, 1 - score, self.k_factor), 1 - score))
+            for player in (x, o):
+                self.players[player.name] = player
+                self.leaderboard.set(player.name, player.rating)
+            self.version += 1
+        self.queue.put(x)
+        self.queue.put(o)
+        print(f"Rated {x_player} {x.rating:.0f}, {o_player} {o.rating:.0f}")
+        return True
+
+    def flush(self):
+        """Block until every queued rating has been written."""
+        self.queue.join()
+
+    def close(self):
+        if not self.writer_thread.is_alive():
+            return
+        self.flush()
+        self.queue.put(None)
+        self.writer_thread.join()
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.path or ':memory:')
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            with self.lock:
+                for row in conn.execute('SELECT * FROM ratings'):
+                    player = PlayerRating(*row)
+                    self.players[player.name] = player
+                    self.leaderboard.set(player.name, player.rating)
+        except sqlite3.Error as e:
+            print(f"Ratings load error: {e}")
+        finally:
+            self.loaded.set()  # Start from whatever was read rather than hang the server
+
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.FLUSH_INTERVAL
+            while batch[-1] is not None and len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            # Only a player's latest rating needs writing
+            latest = {player.name: player for player in batch if player is not None}
+            try:
+                if latest:
+                    with conn:
+                        conn.executemany('INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?, ?, ?)',
+                                         list(latest.values()))
+            except sqlite3.Error as e:
+                print(f"Ratings write error: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if batch[-1] is None:
+                conn.close()
+                return
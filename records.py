@@ -0,0 +1,208 @@
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from typing import Iterator, NamedTuple, Optional
+
+from game import index_to_move
+
+# Results are stored as small integers; 'unfinished' only comes from log ingestion
+RESULT_CODES = {'unfinished': 0, 'X': 1, 'O': 2, 'draw': 3}
+RESULT_NAMES = {code: name for name, code in RESULT_CODES.items()}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,      -- game_id chosen by the first player
+    x_player INTEGER NOT NULL,   -- X always moves first
+    o_player INTEGER NOT NULL,
+    result INTEGER NOT NULL,
+    started_at INTEGER NOT NULL, -- Milliseconds since the epoch
+    ended_at INTEGER NOT NULL,
+    moves BLOB NOT NULL          -- One byte per move, a cell index 0-80
+);
+"""
+
+
+class GameRecord(NamedTuple):
+    game_id: int
+    x_player: str
+    o_player: str
+    result: str  # 'X', 'O', 'draw' or 'unfinished'
+    started_at: float
+    ended_at: float
+    moves: bytes
+
+    @property
+    def first_player(self):
+        return self.x_player
+
+    def iter_moves(self):
+        """Yield (main_row, main_col, sub_row, sub_col) for every move."""
+        for index in self.moves:
+            yield index_to_move(index)
+
+    @classmethod
+    def from_game(cls, game, opponent_username):
+        """Build a record from a finished UltimateTicTacToe."""
+        if game.symbol == 'X':
+            x_player, o_player = game.username, opponent_username
+        else:
+            x_player, o_player = opponent_username, game.username
+        return cls(game.game_id, x_player, o_player, game.result,
+                   game.started_at, game.ended_at, bytes(game.moves))
+
+
+class GameStore:
+    """SQLite store of finished games.
+
+    ``record`` only queues the game; a background writer thread inserts
+    queued games in batches, one transaction per batch. The same game
+    recorded by both players in one process is stored once.
+    """
+
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 1.0  # Seconds to wait for a batch to fill up
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue()
+        self.player_ids = {}
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+        self.writer_thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer_thread.start()
+        # Write out anything still queued when the server exits
+        atexit.register(self.flush)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def record(self, record: GameRecord):
+        """Queue a finished game for writing; False if it is incomplete."""
+        if (type(record.game_id) is not int or record.result not in RESULT_CODES
+                or not isinstance(record.x_player, str) or not record.x_player
+                or not isinstance(record.o_player, str) or not record.o_player
+                or not isinstance(record.started_at, (int, float))
+                or not isinstance(record.ended_at, (int, float))
+                or not isinstance(record.moves, (bytes, bytearray))):
+            print(f"Not recording incomplete game: {record}")
+            return False
+        self.queue.put(record)
+        return True
+
+    def record_game(self, game, opponent_username):
+        """Queue a finished UltimateTicTacToe for writing."""
+        self.record(GameRecord.from_game(game, opponent_username))
+
+    def flush(self):
+        """Block until every queued game has been written."""
+        self.queue.join()
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.writer_thread.join()
+
+    def _write_loop(self):
+        conn = self.connect()
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.FLUSH_INTERVAL
+            while batch[-1] is not None and len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            records = [r for r in batch if r is not None]
+            try:
+                if records:
+                    self._write_batch(conn, records)
+            except sqlite3.Error as e:
+                print(f"Game store write error: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if batch[-1] is None:
+                conn.close()
+                return
+
+    def _player_id(self, conn, name):
+        player_id = self.player_ids.get(name)
+        if player_id is None:
+            conn.execute('INSERT OR IGNORE INTO players (name) VALUES (?)', (name,))
+            player_id = conn.execute('SELECT id FROM players WHERE name = ?', (name,)).fetchone()[0]
+            self.player_ids[name] = player_id
+        return player_id
+
+    def _write_batch(self, conn, records):
+        try:
+            self._insert(conn, records)
+        except sqlite3.IntegrityError as e:
+            # The whole batch rolled back; retry alone so one bad game loses only itself
+            print(f"Game store batch failed ({e}), writing its {len(records)} games one by one")
+            self.player_ids.clear()  # Ids handed out in the rolled-back transaction
+            for record in records:
+                try:
+                    self._insert(conn, [record])
+                except sqlite3.IntegrityError as e:
+                    self.player_ids.clear()
+                    print(f"Game store dropped game {record.game_id}: {e}")
+
+    def _insert(self, conn, records):
+        with conn:
+            rows = [(r.game_id, self._player_id(conn, r.x_player), self._player_id(conn, r.o_player),
+                     RESULT_CODES[r.result], int(r.started_at * 1000), int(r.ended_at * 1000),
+                     r.moves) for r in records]
+            conn.executemany('INSERT OR IGNORE INTO games VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def iter_games(self, player: Optional[str] = None, batch_size=10000) -> Iterator[GameRecord]:
+        """Stream stored games in id order without loading them all at once."""
+        query = """
+            SELECT g.id, x.name, o.name, g.result, g.started_at, g.ended_at, g.moves
+            FROM games g JOIN players x ON x.id = g.x_player JOIN players o ON o.id = g.o_player
+        """
+        params = ()
+        if player is not None:
+            query += ' WHERE x.name = ? OR o.name = ?'
+            params = (player, player)
+        conn = self.connect()
+        try:
+            cursor = conn.execute(query + ' ORDER BY g.id', params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for game_id, x_player, o_player, result, started_at, ended_at, moves in rows:
+                    yield GameRecord(game_id, x_player, o_player, RESULT_NAMES[result],
+                                     started_at / 1000, ended_at / 1000, moves)
+        finally:
+            conn.close()
+
+    def get_game(self, game_id) -> Optional[GameRecord]:
+        conn = self.connect()
+        try:
+            row = conn.execute("""
+                SELECT g.id, x.name, o.name, g.result, g.started_at, g.ended_at, g.moves
+                FROM games g JOIN players x ON x.id = g.x_player JOIN players o ON o.id = g.o_player
+                WHERE g.id = ?
+            """, (game_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return GameRecord(row[0], row[1], row[2], RESULT_NAMES[row[3]],
+                          row[4] / 1000, row[5] / 1000, row[6])
+
+    def count(self):
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM games').fetchone()[0]
+        finally:
+            conn.close()
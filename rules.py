@@ -0,0 +1,161 @@
+"""Compact, print-free replay of the UltimateTicTacToe rules.
+
+game.UltimateTicTacToe is the authoritative per-player game; Position is
+the lightweight version used where many positions are replayed or
+searched (the opening book, engines and tournaments). Cells are numbered
+0-80 as in game.move_to_index.
+"""
+import hashlib
+from typing import List, Tuple
+
+from game import index_to_move
+
+EMPTY, X, O, DRAW = 0, 1, 2, 3
+SYMBOLS = {X: 'X', O: 'O', DRAW: 'draw'}
+
+LINES = [(0, 1, 2), (3, 4, 5), (6, 7, 8), (0, 3, 6), (1, 4, 7), (2, 5, 8), (0, 4, 8), (2, 4, 6)]
+
+# The 8 symmetries of a 3x3 grid, as maps of (row, col)
+_SYMMETRIES = [
+    lambda r, c: (r, c),
+    lambda r, c: (c, 2 - r),
+    lambda r, c: (2 - r, 2 - c),
+    lambda r, c: (2 - c, r),
+    lambda r, c: (r, 2 - c),
+    lambda r, c: (2 - r, c),
+    lambda r, c: (c, r),
+    lambda r, c: (2 - c, 2 - r),
+]
+
+
+def _grid_perm(symmetry):
+    return [3 * r + c for r, c in (symmetry(i // 3, i % 3) for i in range(9))]
+
+
+# GRID_PERMS[s][i]: where square i of a 3x3 grid goes under symmetry s.
+# CELL_PERMS[s][i]: the same for cell index i, applied to board and cell.
+GRID_PERMS = [_grid_perm(s) for s in _SYMMETRIES]
+CELL_PERMS = [[p[i // 9] * 9 + p[i % 9] for i in range(81)] for p in GRID_PERMS]
+INVERSE_CELL_PERMS = [[perm.index(i) for i in range(81)] for perm in CELL_PERMS]
+
+
+def line_winner(squares):
+    """Same rule as UltimateTicTacToe.check_win: a line of equal non-empty values wins.
+
+    On the main board a line of three drawn sub-boards therefore ends the
+    game as a draw, as it does in game.py.
+    """
+    for a, b, c in LINES:
+        if squares[a] and squares[a] == squares[b] == squares[c]:
+            return squares[a]
+    if all(squares):
+        return DRAW
+    return EMPTY
+
+
+class Position:
+    """Cells, sub-board results and the target sub-board, with undo for search."""
+
+    __slots__ = ('cells', 'sub_results', 'target', 'ply', 'result', 'history')
+
+    def __init__(self):
+        self.cells = [EMPTY] * 81
+        self.sub_results = [EMPTY] * 9  # X, O or DRAW once a sub-board is decided
+        self.target = None  # Sub-board to play in, None for any
+        self.ply = 0
+        self.result = EMPTY  # X, O or DRAW once the game is over
+        self.history = []  # (index, previous target, sub-board decided by the move)
+
+    @classmethod
+    def from_moves(cls, moves):
+        position = cls()
+        for index in moves:
+            position.play(index)
+        return position
+
+    @classmethod
+    def from_game(cls, game):
+        """Build from an UltimateTicTacToe, with the side to move taken from the board."""
+        position = cls()
+        for index in range(81):
+            main_row, main_col, sub_row, sub_col = index_to_move(index)
+            mark = game.board[main_row][main_col][sub_row][sub_col]
+            if mark:
+                position.cells[index] = X if mark == 'X' else O
+                position.ply += 1
+        for board in range(9):
+            winner = game.sub_board_winners[board // 3][board % 3]
+            position.sub_results[board] = {'X': X, 'O': O}.get(winner, DRAW if winner else EMPTY)
+        if game.current_board is not None:
+            position.target = game.current_board[0] * 3 + game.current_board[1]
+        position.result = line_winner(position.sub_results)
+        return position
+
+    @property
+    def to_move(self):
+        return X if self.ply % 2 == 0 else O
+
+    def legal_moves(self) -> List[int]:
+        if self.result:
+            return []
+        cells = self.cells
+        if self.target is not None:
+            boards = (self.target,)
+        else:
+            boards = [b for b in range(9) if not self.sub_results[b]]
+        return [i for b in boards for i in range(b * 9, b * 9 + 9) if not cells[i]]
+
+    def play(self, index):
+        board, cell = divmod(index, 9)
+        self.cells[index] = self.to_move
+        self.ply += 1
+        decided = False
+        if not self.sub_results[board]:
+            winner = line_winner(self.cells[board * 9:board * 9 + 9])
+            if winner:
+                self.sub_results[board] = winner
+                self.result = line_winner(self.sub_results)
+                decided = True
+        self.history.append((index, self.target, decided))
+        self.target = None if self.sub_results[cell] else cell
+
+    def undo(self):
+        index, self.target, decided = self.history.pop()
+        self.cells[index] = EMPTY
+        self.ply -= 1
+        if decided:
+            self.sub_results[index // 9] = EMPTY
+            self.result = EMPTY
+
+    def key(self) -> Tuple[int, List[int]]:
+        """Return (64-bit canonical key, symmetries that reach the canonical frame).
+
+        More than one symmetry is returned when the position is itself
+        symmetric; the first is the one used to map moves back.
+        """
+        occupied = [(i, v) for i, v in enumerate(self.cells) if v]
+        best = None
+        symmetries = []
+        for s, perm in enumerate(CELL_PERMS):
+            x_mask = o_mask = 0
+            for i, v in occupied:
+                if v == X:
+                    x_mask |= 1 << perm[i]
+                else:
+                    o_mask |= 1 << perm[i]
+            target = 9 if self.target is None else GRID_PERMS[s][self.target]
+            candidate = (x_mask, o_mask, target)
+            if best is None or candidate < best:
+                best = candidate
+                symmetries = [s]
+            elif candidate == best:
+                symmetries.append(s)
+        x_mask, o_mask, target = best
+        raw = x_mask.to_bytes(11, 'little') + o_mask.to_bytes(11, 'little') + bytes([target])
+        key = int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), 'little')
+        return key or 1, symmetries  # 0 marks an empty slot
+
+    @staticmethod
+    def canonical_move(index, symmetries):
+        """Map a move into the canonical frame; equivalent moves map to the same cell."""
+        return min(CELL_PERMS[s][index] for s in symmetries)
@@ -0,0 +1,238 @@
+"""Production entry point for the web app.
+
+    python serve.py --backend threaded --port 5000 --workers 64
+    python serve.py --backend gevent --workers 1000
+    python serve.py --backend gunicorn --workers 64 --keep-alive 5 --timeout 30
+
+Every player's game and peer connection lives in memory in the serving
+process, so all backends run a single process: ``--workers`` is the number
+of requests running at once (threaded), gunicorn's gthread worker threads
+or greenlets (gevent). gevent and gunicorn are optional installs; gevent
+suits the most open connections, since idle and streaming ones cost a
+greenlet rather than a thread. ``--timeout`` only applies to gunicorn.
+
+SIGTERM or Ctrl-C stops accepting requests, gives in-flight ones up to
+``--drain-timeout`` seconds, then sends DISCONNECT to every connected
+opponent, closes the peer sockets and writes out finished games.
+"""
+import argparse
+import os
+import re
+import signal
+
+BACKENDS = ('threaded', 'gevent', 'gunicorn')
+
+
+def load_app():
+    from app import app, host
+    return app, host
+
+
+# Long-lived responses that must not hold one of the --workers request slots
+STREAM_PATH = re.compile(r'^/spectate/[^/]+/stream')
+
+
+def serve_threaded(args):
+    """Werkzeug's HTTP/1.1 server without the debugger or reloader.
+
+    Every connection gets a thread (up to ``--max-connections``), but only
+    ``--workers`` requests run the app at once. A connection waiting for
+    its next poll and a spectator stream hold no request slot, so open
+    tabs and watchers cannot starve everyone else, and a connection is
+    closed after ``--max-keepalive-requests`` requests.
+    """
+    import threading
+    import time
+    from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+    app, host = load_app()
+    slots = threading.BoundedSemaphore(args.workers)
+    connections = threading.BoundedSemaphore(args.max_connections)
+
+    class RequestHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep connections open between polls
+        timeout = args.keep_alive  # Idle seconds before a kept-alive connection is closed
+
+        def handle(self):
+            self.requests_left = args.max_keepalive_requests
+            super().handle()
+
+        def handle_one_request(self):
+            super().handle_one_request()
+            self.requests_left -= 1
+            if self.requests_left <= 0:
+                self.close_connection = True  # Back of the queue, like any new connection
+
+        def run_wsgi(self):
+            if STREAM_PATH.match(self.path):
+                super().run_wsgi()  # Runs as long as the watcher does, on this connection's thread
+                return
+            with slots:
+                super().run_wsgi()
+
+        def log_request(self, code='-', size='-'):
+            if args.access_log:
+                super().log_request(code, size)
+
+    class BoundedWSGIServer(ThreadedWSGIServer):
+        """Refuses connections beyond --max-connections instead of starting a thread for each."""
+
+        refusing = False
+
+        def process_request(self, request, client_address):
+            if not connections.acquire(blocking=False):
+                if not self.refusing:  # Once per overload, not once per connection
+                    print(f"{args.max_connections} connections open, refusing new ones")
+                self.refusing = True
+                self.shutdown_request(request)
+                return
+            self.refusing = False
+            super().process_request(request, client_address)
+
+        def process_request_thread(self, request, client_address):
+            try:
+                super().process_request_thread(request, client_address)
+            finally:
+                connections.release()
+
+    server = BoundedWSGIServer(args.host, args.port, app, handler=RequestHandler)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever(), so it can't run on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} request slots")
+    server.serve_forever()
+    server.server_close()
+
+    # Every slot free again means no request is still running
+    deadline = time.monotonic() + args.drain_timeout
+    for _ in range(args.workers):
+        if not slots.acquire(timeout=max(0, deadline - time.monotonic())):
+            print(f"Requests still running after {args.drain_timeout} s, closing anyway")
+            break
+    host.shutdown()
+
+
+def serve_gevent(args):
+    """gevent's WSGI server: one greenlet per connection, for many idle or streaming clients."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        raise SystemExit('The gevent backend needs gevent: pip install gevent')
+    # Patch before the app creates any sockets or threads
+    monkey.patch_all()
+    import gevent
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+
+    app, host = load_app()
+    server = WSGIServer((args.host, args.port), app, spawn=Pool(args.workers),
+                        log='default' if args.access_log else None)
+
+    def stop():
+        server.stop(timeout=args.drain_timeout)
+
+    gevent.signal_handler(signal.SIGTERM, stop)
+    gevent.signal_handler(signal.SIGINT, stop)
+    print(f"Serving on http://{args.host}:{args.port} with up to {args.workers} greenlets")
+    server.serve_forever()
+    host.shutdown()
+
+
+def serve_gunicorn(args):
+    """gunicorn with one gthread worker process."""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit('The gunicorn backend needs gunicorn: pip install gunicorn')
+
+    def worker_exit(server, worker):
+        from app import host
+        host.shutdown()
+
+    options = {
+        'bind': f'{args.host}:{args.port}',
+        'workers': 1,  # Games are in memory; a second process would not see them
+        'worker_class': 'gthread',
+        'threads': args.workers,
+        'keepalive': args.keep_alive,
+        'timeout': 30 if args.timeout is None else args.timeout,
+        'graceful_timeout': args.drain_timeout,
+        'accesslog': '-' if args.access_log else None,
+        'worker_exit': worker_exit,
+    }
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app()[0]
+
+    Application().run()
+
+
+def profile_imports(top=15):
+    """Import the app in a fresh interpreter under -X importtime and summarise."""
+    import subprocess
+    import sys
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    if not rows:
+        print(result.stderr)
+        return
+    total = sum(self_us for _, self_us, _, _ in rows)
+    print(f"Importing app took {total / 1000:.1f} ms across {len(rows)} modules\n")
+    print('Slowest direct imports of app (cumulative):')
+    for name, _, cumulative_us, _ in sorted((r for r in rows if r[3] == 1), key=lambda r: -r[2])[:top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+    print('\nSlowest modules on their own (self):')
+    for name, self_us, _, _ in sorted(rows, key=lambda r: -r[1])[:top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the game web app.')
+    parser.add_argument('--backend', choices=BACKENDS, default=os.environ.get('SERVE_BACKEND', 'threaded'))
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WORKERS', 64)),
+                        help='requests run at once (threaded), threads (gunicorn) or greenlets (gevent)')
+    parser.add_argument('--keep-alive', type=float, default=5,
+                        help='seconds an idle connection is kept open')
+    parser.add_argument('--max-keepalive-requests', type=int, default=100,
+                        help='requests served on one connection before it is closed (threaded)')
+    parser.add_argument('--max-connections', type=int, default=1000,
+                        help='open connections, each with its own thread (threaded)')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='seconds before gunicorn restarts a stuck worker (gunicorn only, default 30)')
+    parser.add_argument('--drain-timeout', type=float, default=10,
+                        help='seconds to let in-flight requests finish on shutdown')
+    parser.add_argument('--access-log', action='store_true')
+    parser.add_argument('--profile-import', action='store_true',
+                        help='report where app import time goes (-X importtime) and exit')
+    args = parser.parse_args(argv)
+
+    if args.profile_import:
+        profile_imports()
+        return
+    if args.backend != 'gunicorn' and args.timeout is not None:
+        print(f"--timeout only applies to gunicorn; the {args.backend} backend ignores it")
+
+    {'threaded': serve_threaded, 'gevent': serve_gevent, 'gunicorn': serve_gunicorn}[args.backend](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import socket
+from typing import NamedTuple, Optional
+
+
+class SocketOptions(NamedTuple):
+    """Socket options applied to every peer TCP connection.
+
+    Use ``None`` to leave an option at the operating system default.
+    """
+    nodelay: bool = True  # Disable Nagle so small MOVE messages go out at once
+    keepalive: bool = True
+    keepidle: Optional[int] = 10  # Seconds idle before the first probe
+    keepintvl: Optional[int] = 5  # Seconds between probes
+    keepcnt: Optional[int] = 3  # Failed probes before the connection is dropped
+    sndbuf: Optional[int] = 64 * 1024
+    rcvbuf: Optional[int] = 64 * 1024
+
+    def apply_buffers(self, sock):
+        """Set buffer sizes; call before connect/listen so the window scale matches."""
+        if self.sndbuf is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        if self.rcvbuf is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+
+    def apply(self, sock):
+        """Apply every option to a connected (or about to connect) TCP socket."""
+        self.apply_buffers(sock)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.nodelay))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, int(self.keepalive))
+        if not self.keepalive:
+            return
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            # Linux, and Windows 10 1709+ with Python 3.7+
+            for option, value in ((socket.TCP_KEEPIDLE, self.keepidle),
+                                  (getattr(socket, 'TCP_KEEPINTVL', None), self.keepintvl),
+                                  (getattr(socket, 'TCP_KEEPCNT', None), self.keepcnt)):
+                if option is not None and value is not None:
+                    sock.setsockopt(socket.IPPROTO_TCP, option, value)
+        elif hasattr(socket, 'SIO_KEEPALIVE_VALS') and self.keepidle is not None:
+            # Older Windows: idle and interval only, in milliseconds
+            sock.ioctl(socket.SIO_KEEPALIVE_VALS,
+                       (1, self.keepidle * 1000, (self.keepintvl or 1) * 1000))
+
+
+# Profile used by PeerNetwork unless another one is passed in
+DEFAULT_OPTIONS = SocketOptions()
+
+# Operating system defaults, useful as a baseline for benchmarks
+SYSTEM_DEFAULT_OPTIONS = SocketOptions(nodelay=False, keepalive=False, sndbuf=None, rcvbuf=None)
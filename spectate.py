@@ -0,0 +1,178 @@
+"""Spectator fan-out: one publisher per player's game, many watchers.
+
+Every move is encoded once into an immutable Server-Sent Events frame
+and the same bytes object is handed to every subscriber. Subscribers
+have bounded queues: one that falls behind has its queue dropped and
+gets a single snapshot of the whole game instead, so a slow phone never
+holds up the players or the other watchers.
+"""
+import json
+import threading
+from collections import deque
+
+from game import index_to_move
+
+
+def encode_event(kind, seq, data):
+    """One SSE frame; ``id`` lets a reconnecting EventSource report where it was."""
+    payload = json.dumps(data, separators=(',', ':'))
+    return f'event: {kind}\nid: {seq}\ndata: {payload}\n\n'.encode()
+
+
+KEEPALIVE_FRAME = b': keepalive\n\n'
+
+
+class Subscriber:
+    """One watcher's bounded queue of (seq, frame) pairs."""
+
+    def __init__(self, channel, max_queue):
+        self.channel = channel
+        self.max_queue = max_queue
+        self.frames = deque()
+        self.condition = threading.Condition()
+        self.lagging = True  # Start with a snapshot
+        self.last_seq = -1
+        self.closed = False
+        self.dropped = 0  # Frames replaced by a snapshot
+
+    def offer(self, seq, frame):
+        """Called by the publisher; never blocks on the watcher."""
+        with self.condition:
+            if self.lagging:
+                pass  # The snapshot it is about to get already covers this move
+            elif len(self.frames) >= self.max_queue:
+                self.dropped += len(self.frames) + 1
+                self.frames.clear()
+                self.lagging = True
+            else:
+                self.frames.append((seq, frame))
+            self.condition.notify()
+
+    def resync(self):
+        """Send a snapshot next instead of the queued moves."""
+        with self.condition:
+            self.frames.clear()
+            self.lagging = True
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def next_frame(self, timeout=None):
+        """Block for the next frame to send; None on timeout or once closed."""
+        with self.condition:
+            while not self.frames and not self.lagging and not self.closed:
+                if not self.condition.wait(timeout):
+                    return None
+            if self.closed and not self.frames:
+                return None
+            if self.lagging:
+                self.lagging = False
+                catch_up = True
+            else:
+                seq, frame = self.frames.popleft()
+                catch_up = False
+        if catch_up:
+            # Built outside our lock; frames queued meanwhile are skipped by seq
+            seq, frame = self.channel.snapshot_frame()
+            self.last_seq = seq
+            return frame
+        if seq <= self.last_seq:
+            return self.next_frame(timeout)
+        self.last_seq = seq
+        return frame
+
+
+class SpectatorChannel:
+    """Publishes one player's game to everyone watching it."""
+
+    MAX_SUBSCRIBERS = 500
+    QUEUE_LIMIT = 64  # Moves a watcher may fall behind before it is sent a snapshot
+
+    def __init__(self, game, peer):
+        self.game = game
+        self.peer = peer
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.subscribers = ()  # Replaced, never mutated, so publishing needs no lock
+        self.snapshot = None  # (seq, frame), encoded once and shared until the next move
+
+    def subscribe(self):
+        """Add a watcher; returns None when the channel is full."""
+        with self.lock:
+            if len(self.subscribers) >= self.MAX_SUBSCRIBERS:
+                return None
+            subscriber = Subscriber(self, self.QUEUE_LIMIT)
+            self.subscribers = self.subscribers + (subscriber,)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers = tuple(s for s in self.subscribers if s is not subscriber)
+
+    def players(self):
+        opponent = self.peer.opponent_username
+        if self.game.symbol == 'O':
+            return opponent, self.game.username
+        return self.game.username, opponent
+
+    def snapshot_frame(self):
+        """The whole game so far as one frame, rebuilt only after a new move."""
+        with self.lock:
+            if self.snapshot is None or self.snapshot[0] != self.seq:
+                game = self.game
+                x_player, o_player = self.players()
+                cells = ''.join(game.board[r][c][m][n] or '.'
+                                for r, c, m, n in map(index_to_move, range(81)))
+                current = game.current_board
+                self.snapshot = (self.seq, encode_event('snapshot', self.seq, {
+                    'x': x_player,
+                    'o': o_player,
+                    'cells': cells,
+                    'sub_boards': [w for row in game.sub_board_winners for w in row],
+                    'current_board': None if current is None else current[0] * 3 + current[1],
+                    'result': game.result,
+                }))
+            return self.snapshot
+
+    def publish_move(self, game, index):
+        """Move callback: encode the move once and queue it for every watcher."""
+        main_row, main_col, sub_row, sub_col = index_to_move(index)
+        current = game.current_board
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+            subscribers = self.subscribers
+        frame = encode_event('move', seq, {
+            'index': index,
+            'mark': game.board[main_row][main_col][sub_row][sub_col],
+            'sub_board': game.sub_board_winners[main_row][main_col],
+            'current_board': None if current is None else current[0] * 3 + current[1],
+            'result': game.result,
+        })
+        for subscriber in subscribers:
+            subscriber.offer(seq, frame)
+
+    def publish_reset(self, game):
+        """Reset callback: the board was replaced, so every watcher needs a snapshot."""
+        with self.lock:
+            self.seq += 1  # Invalidates the cached snapshot
+            subscribers = self.subscribers
+        for subscriber in subscribers:
+            subscriber.resync()
+
+    def close(self):
+        with self.lock:
+            subscribers, self.subscribers = self.subscribers, ()
+        for subscriber in subscribers:
+            subscriber.close()
+
+    def stats(self):
+        subscribers = self.subscribers
+        return {
+            'watchers': len(subscribers),
+            'moves': self.seq,
+            'dropped': sum(s.dropped for s in subscribers)
+        }
@@ -1,154 +1,328 @@
+// Cells are numbered 0-80 sub-board by sub-board, as in game.py's move_to_index:
+// index = (main_row * 3 + main_col) * 9 + sub_row * 3 + sub_col
+const LINES = [
+    [0, 1, 2], [3, 4, 5], [6, 7, 8],
+    [0, 3, 6], [1, 4, 7], [2, 5, 8],
+    [0, 4, 8], [2, 4, 6]
+];
+
+// Same rules as UltimateTicTacToe.check_win: a line of equal marks wins
+// (three drawn sub-boards make a drawn line), a full board is a draw
+function lineWinner(squares) {
+    for (const [a, b, c] of LINES) {
+        if (squares[a] && squares[a] === squares[b] && squares[a] === squares[c]) {
+            return squares[a];
+        }
+    }
+    return squares.every(square => square) ? 'draw' : null;
+}
+
+// Zobrist keys from /zobrist as BigInts, matching game.py's position hash
+function parseKeys(keys) {
+    return {
+        X: keys.cells.X.map(key => BigInt('0x' + key)),
+        O: keys.cells.O.map(key => BigInt('0x' + key)),
+        targets: keys.targets.map(key => BigInt('0x' + key))
+    };
+}
+
 class UltimateTicTacToeGame {
     constructor() {
-        this.currentBoard = null;  // Which sub-board to play in (null means any)
+        // The board as the server describes it in /state
+        this.cells = new Array(81).fill('');  // '', 'X' or 'O'
+        this.subBoards = new Array(9).fill(null);  // null, 'X', 'O' or 'draw'
+        this.currentBoard = null;  // Sub-board (0-8) to play in, null means any
+        this.result = null;  // 'X', 'O' or 'draw' once the game is over
         this.gameStarted = true;  // Game starts immediately
         this.myTurn = false;
         this.symbol = null;  // 'X' or 'O'
-        
+        this.seq = 0;  // Moves applied to the board, see /state
+        this.keys = null;  // Zobrist keys, once loaded
+        this.hash = null;  // Position hash (BigInt) kept up to date with the board
+
+        // What the page shows, so paint() only touches what changed
+        this.shownCells = new Array(81).fill('');
+        this.shownSubBoards = new Array(9).fill(null);
+        this.shownPlayable = new Array(81).fill(false);
+        this.shownStatus = null;
+        this.paintQueued = false;
+
         this.setupBoard();
         this.startConnectionCheck();
         this.initializeGame();
     }
 
     async initializeGame() {
+        this.loadKeys();
         try {
+            // After a refresh the game is already on; rebuild it instead of restarting
+            const stateResponse = await fetch('/state');
+            if (stateResponse.ok) {
+                const state = await stateResponse.json();
+                if (state.started) {
+                    this.applyState(state);
+                    return;
+                }
+            }
+
             const response = await fetch('/start_game', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 }
             });
-            
+
             const result = await response.json();
             if (result.success) {
                 this.myTurn = result.first_player;
                 this.symbol = this.myTurn ? 'X' : 'O';
-                this.updateStatus();
-                this.highlightPlayableBoard();
+                this.render();
             }
         } catch (error) {
             console.error('Error starting game:', error);
         }
     }
 
+    async loadKeys() {
+        try {
+            const response = await fetch('/zobrist');
+            this.keys = parseKeys(await response.json());
+            this.hash = this.fullHash();
+        } catch (error) {
+            console.error('Could not load hash keys, moves will not be checked:', error);
+        }
+    }
+
+    async syncState(full = false) {
+        // A diverged board can't be fixed by replaying moves; fetch all of it
+        const response = await fetch(full ? '/state' : `/state?since=${this.seq}`);
+        if (response.ok) {
+            this.applyState(await response.json());
+        }
+    }
+
+    applyState(state) {
+        // Either the whole board or only the moves after state.since
+        if (state.board !== undefined) {
+            for (let i = 0; i < 81; i++) {
+                this.cells[i] = state.board[i] === '.' ? '' : state.board[i];
+            }
+        } else {
+            state.moves.forEach((index, offset) => {
+                // X makes the even-numbered moves
+                this.cells[index] = (state.since + offset) % 2 === 0 ? 'X' : 'O';
+            });
+        }
+        this.subBoards = state.sub_boards.slice();
+        this.currentBoard = state.current_board;
+        this.result = state.result;
+        this.seq = state.seq;
+        this.symbol = state.symbol;
+        this.myTurn = state.my_turn;
+        this.hash = this.fullHash();
+        this.render();
+    }
+
+    fullHash() {
+        if (!this.keys) return null;
+        let hash = this.keys.targets[this.currentBoard === null ? 9 : this.currentBoard];
+        this.cells.forEach((mark, index) => {
+            if (mark) {
+                hash ^= this.keys[mark][index];
+            }
+        });
+        return hash;
+    }
+
+    // Whether our board matches a hash (16 hex digits) the server sent
+    matchesHash(hex) {
+        return this.hash === null || hex === undefined || this.hash === BigInt('0x' + hex);
+    }
+
+    isLegal(index) {
+        const board = Math.floor(index / 9);
+        return !this.result && !this.cells[index] && !this.subBoards[board] &&
+            (this.currentBoard === null || this.currentBoard === board);
+    }
+
+    applyMove(index, symbol) {
+        // Mirrors UltimateTicTacToe.make_move / receive_move
+        const board = Math.floor(index / 9);
+        this.cells[index] = symbol;
+        this.seq += 1;
+        const subBoardResult = lineWinner(this.cells.slice(board * 9, board * 9 + 9));
+        if (subBoardResult) {
+            this.subBoards[board] = subBoardResult;
+        }
+        this.result = lineWinner(this.subBoards);
+        const target = index % 9;
+        const previousBoard = this.currentBoard;
+        this.currentBoard = this.subBoards[target] ? null : target;
+        if (this.hash !== null) {
+            this.hash ^= this.keys[symbol][index] ^
+                this.keys.targets[previousBoard === null ? 9 : previousBoard] ^
+                this.keys.targets[this.currentBoard === null ? 9 : this.currentBoard];
+        }
+    }
+
+    // Enough to take back one move played with applyMove
+    snapshot(index) {
+        return {
+            index: index,
+            subBoards: this.subBoards.slice(),
+            currentBoard: this.currentBoard,
+            result: this.result,
+            seq: this.seq,
+            myTurn: this.myTurn,
+            hash: this.hash
+        };
+    }
+
+    restore(snapshot) {
+        this.cells[snapshot.index] = '';
+        this.subBoards = snapshot.subBoards;
+        this.currentBoard = snapshot.currentBoard;
+        this.result = snapshot.result;
+        this.seq = snapshot.seq;
+        this.myTurn = snapshot.myTurn;
+        this.hash = snapshot.hash;
+    }
+
     setupBoard() {
         const board = document.getElementById('gameBoard');
         board.innerHTML = '';
-        
-        for (let i = 0; i < 3; i++) {
-            for (let j = 0; j < 3; j++) {
-                const subBoard = document.createElement('div');
-                subBoard.className = 'sub-board';
-                subBoard.dataset.row = i;
-                subBoard.dataset.col = j;
-                
-                for (let m = 0; m < 3; m++) {
-                    for (let n = 0; n < 3; n++) {
-                        const cell = document.createElement('div');
-                        cell.className = 'cell';
-                        cell.dataset.mainRow = i;
-                        cell.dataset.mainCol = j;
-                        cell.dataset.subRow = m;
-                        cell.dataset.subCol = n;
-                        cell.addEventListener('click', (e) => this.handleMove(e));
-                        subBoard.appendChild(cell);
-                    }
-                }
-                
-                board.appendChild(subBoard);
+        this.subBoardElements = [];
+        this.cellElements = [];
+
+        for (let b = 0; b < 9; b++) {
+            const subBoard = document.createElement('div');
+            subBoard.className = 'sub-board';
+            for (let c = 0; c < 9; c++) {
+                const cell = document.createElement('div');
+                cell.className = 'cell';
+                cell.dataset.index = b * 9 + c;
+                subBoard.appendChild(cell);
+                this.cellElements.push(cell);
             }
+            board.appendChild(subBoard);
+            this.subBoardElements.push(subBoard);
         }
+
+        // One listener for the whole board instead of one per cell
+        board.addEventListener('click', (e) => {
+            const cell = e.target.closest('.cell');
+            if (cell) {
+                this.handleMove(Number(cell.dataset.index));
+            }
+        });
     }
 
-    async handleMove(event) {
-        if (!this.myTurn || !this.gameStarted) return;
-        
-        const cell = event.target;
-        if (cell.textContent) return; // Cell already taken
-        
-        const mainRow = parseInt(cell.dataset.mainRow);
-        const mainCol = parseInt(cell.dataset.mainCol);
-        const subRow = parseInt(cell.dataset.subRow);
-        const subCol = parseInt(cell.dataset.subCol);
-        
-        if (this.currentBoard && 
-            (mainRow !== this.currentBoard[0] || mainCol !== this.currentBoard[1])) {
-            return;
+    async handleMove(index) {
+        if (!this.myTurn || !this.gameStarted || !this.isLegal(index)) return;
+
+        // Show the move straight away and let the server confirm it
+        const before = this.snapshot(index);
+        this.applyMove(index, this.symbol);
+        this.myTurn = false;
+        const expectedHash = this.hash;
+        this.render();
+
+        const board = Math.floor(index / 9);
+        const cell = index % 9;
+        let result;
+        try {
+            const response = await fetch('/make_move', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    main_row: Math.floor(board / 3),
+                    main_col: board % 3,
+                    sub_row: Math.floor(cell / 3),
+                    sub_col: cell % 3
+                })
+            });
+            result = await response.json();
+        } catch (error) {
+            result = {valid: false, message: String(error)};
+        }
+
+        if (!result.valid) {
+            console.error('Move rejected:', result.message);
+            if (result.state) {
+                this.applyState(result.state);  // The server's board wins
+            } else if (this.seq === before.seq + 1) {
+                this.restore(before);
+                this.render();
+            } else {
+                this.syncState(true);
+            }
+        } else if (expectedHash !== null && BigInt('0x' + result.hash) !== expectedHash) {
+            console.error('Board out of sync after move', result.seq);
+            this.syncState(true);
         }
-        
-        const response = await fetch('/make_move', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                main_row: mainRow,
-                main_col: mainCol,
-                sub_row: subRow,
-                sub_col: subCol
-            })
+    }
+
+    render() {
+        // Several updates in one frame are painted together, once
+        if (this.paintQueued) return;
+        this.paintQueued = true;
+        requestAnimationFrame(() => {
+            this.paintQueued = false;
+            this.paint();
         });
-        
-        const result = await response.json();
-        if (result.valid) {
-            cell.textContent = this.symbol;
-            this.myTurn = false;
-            this.updateStatus();
-            
-            // Handle sub-board result
-            if (result.sub_board_result) {
-                this.handleSubBoardResult(
-                    mainRow,
-                    mainCol,
-                    result.sub_board_result
-                );
+    }
+
+    paint() {
+        for (let b = 0; b < 9; b++) {
+            const winner = this.subBoards[b];
+            if (winner !== this.shownSubBoards[b]) {
+                // Cells stay in the page, hidden by CSS, so a resync can bring them back
+                const subBoard = this.subBoardElements[b];
+                subBoard.classList.toggle('won', Boolean(winner));
+                subBoard.classList.toggle('won-x', winner === 'X');
+                subBoard.classList.toggle('won-o', winner === 'O');
+                subBoard.classList.toggle('draw', winner === 'draw');
+                subBoard.dataset.mark = winner === 'draw' ? '-' : (winner || '');
+                this.shownSubBoards[b] = winner;
             }
-            
-            // Handle game over
-            if (result.game_over) {
-                if (result.is_draw) {
-                    this.handleGameOver('draw');
-                } else {
-                    this.handleGameOver(result.winner);
-                }
-                return;
+        }
+
+        for (let i = 0; i < 81; i++) {
+            if (this.cells[i] !== this.shownCells[i]) {
+                this.cellElements[i].textContent = this.cells[i];
+                this.shownCells[i] = this.cells[i];
             }
-            
-            // Update current board based on target board state
-            const targetSubBoard = document.querySelector(
-                `.sub-board[data-row="${subRow}"][data-col="${subCol}"]`
-            );
-            if (targetSubBoard.classList.contains('won')) {
-                this.currentBoard = null;  // Can play anywhere
-            } else {
-                this.currentBoard = [subRow, subCol];
+            const playable = this.isLegal(i);
+            if (playable !== this.shownPlayable[i]) {
+                this.cellElements[i].classList.toggle('playable', playable);
+                this.shownPlayable[i] = playable;
             }
-            
-            this.highlightPlayableBoard();
         }
-    }
 
-    updateStatus() {
-        const status = document.getElementById('status');
-        if (this.myTurn) {
-            status.textContent = `Your turn! (${this.symbol})`;
-        } else {
-            status.textContent = `Opponent's turn (${this.symbol === 'X' ? 'O' : 'X'})`;
+        const text = this.statusText();
+        if (text !== this.shownStatus) {
+            document.getElementById('status').textContent = text;
+            document.getElementById('gameBoard').classList.toggle('over', Boolean(this.result));
+            this.shownStatus = text;
         }
     }
 
-    handleGameOver(result) {
-        const status = document.getElementById('status');
-        if (result === 'draw') {
-            status.textContent = "Game Over - It's a draw!";
-        } else {
-            status.textContent = result === this.symbol ? 'You won!' : 'You lost!';
+    statusText() {
+        if (this.result === 'draw') {
+            return "Game Over - It's a draw!";
         }
-        
-        // Disable all cells
-        document.querySelectorAll('.cell').forEach(cell => {
-            cell.style.pointerEvents = 'none';
-        });
+        if (this.result) {
+            return this.result === this.symbol ? 'You won!' : 'You lost!';
+        }
+        if (!this.symbol) {
+            return 'Game in progress...';
+        }
+        if (this.myTurn) {
+            return `Your turn! (${this.symbol})`;
+        }
+        return `Opponent's turn (${this.symbol === 'X' ? 'O' : 'X'})`;
     }
 
     startConnectionCheck() {
@@ -156,7 +330,7 @@ class UltimateTicTacToeGame {
             try {
                 const response = await fetch('/check_connection');
                 const data = await response.json();
-                
+
                 if (!data.connected) {
                     alert('Opponent disconnected');
                     window.location.href = '/lobby';
@@ -170,105 +344,32 @@ class UltimateTicTacToeGame {
     }
 
     handleGameStatus(status) {
-        if (status.type === 'MOVE') {
-            const cell = document.querySelector(
-                `.cell[data-main-row="${status.main_row}"]` +
-                `[data-main-col="${status.main_col}"]` +
-                `[data-sub-row="${status.sub_row}"]` +
-                `[data-sub-col="${status.sub_col}"]`
-            );
-            
-            if (cell) {
-                cell.textContent = this.symbol === 'X' ? 'O' : 'X';
-                this.myTurn = true;
-                this.updateStatus();
-                
-                // Handle sub-board result
-                if (status.sub_board_result) {
-                    this.handleSubBoardResult(
-                        status.main_row,
-                        status.main_col,
-                        status.sub_board_result
-                    );
-                }
-                
-                // Handle game over
-                if (status.game_over) {
-                    if (status.is_draw) {
-                        this.handleGameOver('draw');
-                    } else {
-                        this.handleGameOver(status.winner);
-                    }
-                    return;
-                }
-                
-                // Update current board based on target board state
-                const targetSubBoard = document.querySelector(
-                    `.sub-board[data-row="${status.sub_row}"][data-col="${status.sub_col}"]`
-                );
-                if (targetSubBoard.classList.contains('won')) {
-                    this.currentBoard = null;  // Can play anywhere
-                } else {
-                    this.currentBoard = [status.sub_row, status.sub_col];
-                }
-                
-                this.highlightPlayableBoard();
+        if (status.type === 'MOVE' && status.seq !== this.seq + 1) {
+            this.syncState();  // Missed a poll; fetch every move since ours
+        } else if (status.type === 'MOVE') {
+            const index = (status.main_row * 3 + status.main_col) * 9 + status.sub_row * 3 + status.sub_col;
+            this.applyMove(index, this.symbol === 'X' ? 'O' : 'X');
+            this.myTurn = true;
+            this.render();
+            if (!this.matchesHash(status.hash)) {
+                console.error('Board out of sync after move', status.seq);
+                this.syncState(true);
             }
+        } else if (status.type === 'STATE') {
+            this.syncState(Boolean(status.full));  // full: the server's board was replaced
+        } else if (status.type === 'DESYNC') {
+            // A move was rejected on one side; the server's board is the reference
+            console.error('Game out of sync:', status.message);
+            this.syncState();
         } else if (status.type === 'GAME_START') {
             this.gameStarted = true;
             this.myTurn = status.first_player;
             this.symbol = this.myTurn ? 'X' : 'O';
-            this.updateStatus();
-            this.highlightPlayableBoard();
-        }
-    }
-
-    handleSubBoardResult(mainRow, mainCol, result) {
-        const subBoard = document.querySelector(
-            `.sub-board[data-row="${mainRow}"][data-col="${mainCol}"]`
-        );
-        
-        if (subBoard) {
-            // Clear all cells in the sub-board
-            subBoard.innerHTML = '';
-            subBoard.classList.add('won');
-            
-            if (result === 'draw') {
-                subBoard.classList.add('draw');
-                subBoard.textContent = '-';
-            } else {
-                subBoard.classList.add(`won-${result.toLowerCase()}`);
-                subBoard.textContent = result;  // 'X' or 'O'
-            }
-        }
-    }
-
-    highlightPlayableBoard() {
-        // Remove previous highlights
-        document.querySelectorAll('.cell').forEach(cell => {
-            cell.classList.remove('playable');
-        });
-
-        // Add highlights to playable cells
-        if (this.currentBoard) {
-            const [row, col] = this.currentBoard;
-            document.querySelectorAll(
-                `.cell[data-main-row="${row}"][data-main-col="${col}"]`
-            ).forEach(cell => {
-                if (!cell.textContent) {
-                    cell.classList.add('playable');
-                }
-            });
-        } else {
-            document.querySelectorAll('.cell').forEach(cell => {
-                if (!cell.textContent) {
-                    cell.classList.add('playable');
-                }
-            });
+            this.render();
         }
     }
 }
 
 document.addEventListener('DOMContentLoaded', () => {
     window.game = new UltimateTicTacToeGame();
-}); 
\ No newline at end of file
+});
@@ -0,0 +1,40 @@
+async function login() {
+    const username = document.getElementById('username').value.trim();
+    const errorMessage = document.getElementById('error-message');
+
+    if (!username) {
+        errorMessage.textContent = 'Please enter a username';
+        errorMessage.style.display = 'block';
+        return;
+    }
+
+    const formData = new FormData();
+    formData.append('username', username);
+
+    try {
+        const response = await fetch('/create_game', {
+            method: 'POST',
+            body: formData
+        });
+
+        const data = await response.json();
+
+        if (data.success) {
+            window.location.href = '/lobby';
+        } else {
+            errorMessage.textContent = data.error || 'An error occurred';
+            errorMessage.style.display = 'block';
+        }
+    } catch (error) {
+        console.error('Error:', error);
+        errorMessage.textContent = 'Connection error occurred';
+        errorMessage.style.display = 'block';
+    }
+}
+
+// Allow Enter key to submit
+document.getElementById('username').addEventListener('keypress', function(e) {
+    if (e.key === 'Enter') {
+        login();
+    }
+});
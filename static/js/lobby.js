@@ -0,0 +1,243 @@
+let checkConnectionInterval;
+// Background jobs started by the server, by job id; see waitForJob
+const pendingJobs = new Map();
+let eventsInterval = null;
+
+document.addEventListener('DOMContentLoaded', () => {
+    // Display username
+    fetch('/get_username')
+        .then(response => response.json())
+        .then(data => {
+            document.getElementById('username').textContent = data.username;
+        });
+
+    updateLeaderboard();
+
+    // Start checking for available players
+    updatePlayersList();
+    setInterval(updatePlayersList, 2000);
+
+    // Start connection check for game redirect
+    startConnectionCheck();
+});
+
+function startConnectionCheck() {
+    checkConnectionInterval = setInterval(async () => {
+        try {
+            const response = await fetch('/check_connection');
+            const data = await response.json();
+
+            if (data.connected && data.game_status) {
+                if (data.game_status.type === 'GAME_START') {
+                    // Clear interval and redirect to game
+                    clearInterval(checkConnectionInterval);
+                    window.location.href = '/game';
+                }
+            }
+        } catch (error) {
+            console.error('Connection check error:', error);
+        }
+    }, 1000);
+}
+
+function findMatch() {
+    document.getElementById('findMatch').style.display = 'none';
+    document.getElementById('cancelSearch').style.display = 'inline';
+
+    fetch('/broadcast_request', {
+        method: 'POST'
+    }).then(response => response.json())
+      .then(data => {
+          if (!data.success) {
+              alert(data.error || 'Failed to start matchmaking');
+              cancelSearch();
+              return;
+          }
+          waitForJob(data.job, result => {
+              if (!result.success) {
+                  alert('Failed to initialize connection');
+                  cancelSearch();
+              }
+          });
+      });
+}
+
+// Rated matchmaking: the server pairs us and starts the game, which the
+// connection check picks up like any other
+let queueInterval = null;
+
+function quickMatch() {
+    fetch('/matchmaking/join', {
+        method: 'POST'
+    }).then(response => response.json())
+      .then(data => {
+          if (!data.success) {
+              alert(data.error || 'Could not join the queue');
+              return;
+          }
+          document.getElementById('quickMatch').style.display = 'none';
+          document.getElementById('leaveQueue').style.display = 'inline';
+          showQueueStatus(data.status, false);
+          queueInterval = setInterval(async () => {
+              const response = await fetch('/matchmaking/status');
+              const result = await response.json();
+              showQueueStatus(result.status, result.failed);
+          }, 2000);
+      });
+}
+
+function leaveQueue() {
+    clearInterval(queueInterval);
+    document.getElementById('quickMatch').style.display = 'inline';
+    document.getElementById('leaveQueue').style.display = 'none';
+    document.getElementById('queueStatus').style.display = 'none';
+    fetch('/matchmaking/leave', {
+        method: 'POST'
+    });
+}
+
+function showQueueStatus(status, failed) {
+    const element = document.getElementById('queueStatus');
+    element.style.display = 'block';
+    if (failed) {
+        // Matched, but the connection was not made; out of the queue now
+        clearInterval(queueInterval);
+        document.getElementById('quickMatch').style.display = 'inline';
+        document.getElementById('leaveQueue').style.display = 'none';
+        element.textContent = 'Could not connect to your opponent. Try Quick Match again.';
+        return;
+    }
+    if (!status) {
+        // Out of the queue: matched, and the game is being set up. Keep
+        // polling until the connection check moves us to the game, in
+        // case setting it up fails
+        element.textContent = 'Opponent found, starting the game...';
+        return;
+    }
+    element.textContent = `Looking for an opponent rated ${Math.round(status.rating - status.window)}` +
+        `-${Math.round(status.rating + status.window)} (${Math.round(status.waiting)} s)`;
+}
+
+function cancelSearch() {
+    document.getElementById('findMatch').style.display = 'inline';
+    document.getElementById('cancelSearch').style.display = 'none';
+
+    fetch('/cancel_search', {
+        method: 'POST'
+    });
+}
+
+function updatePlayersList() {
+    fetch('/get_requests')
+        .then(response => response.json())
+        .then(players => {
+            const playersList = document.getElementById('playersList');
+            const statusMessage = document.getElementById('statusMessage');
+
+            if (players.length === 0) {
+                playersList.replaceChildren();
+                statusMessage.style.display = 'block';
+            } else {
+                statusMessage.style.display = 'none';
+                // Usernames arrive in discovery datagrams; never parse them as HTML
+                playersList.replaceChildren(...players.map(player => {
+                    const accept = document.createElement('button');
+                    accept.textContent = 'Accept';
+                    accept.addEventListener('click', () => acceptMatch(player.username));
+                    return playerRow(player.username, accept);
+                }));
+            }
+        });
+}
+
+// Ratings only change when a game ends, so the lobby loads them once
+function updateLeaderboard() {
+    fetch('/leaderboard?limit=10')
+        .then(response => response.json())
+        .then(data => {
+            const me = data.me;
+            document.getElementById('myRating').textContent = me.rank ?
+                `Your rating: ${Math.round(me.rating)} (#${me.rank}, ${me.wins}W ${me.draws}D ${me.losses}L)` :
+                `Your rating: ${Math.round(me.rating)} (unranked until your first game)`;
+            // Names come from other peers; set as text, never as HTML
+            document.getElementById('leaderboardList').replaceChildren(...data.players.map(player =>
+                playerRow(`#${player.rank} ${player.name}`, String(Math.round(player.rating)))));
+        });
+}
+
+function playerRow(label, value) {
+    const row = document.createElement('div');
+    row.className = 'player-item';
+    const name = document.createElement('span');
+    name.textContent = label;
+    row.appendChild(name);
+    if (typeof value === 'string') {
+        const detail = document.createElement('span');
+        detail.textContent = value;
+        row.appendChild(detail);
+    } else {
+        row.appendChild(value);
+    }
+    return row;
+}
+
+function acceptMatch(username) {
+    fetch('/handle_request', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({
+            username: username,
+            accept: true
+        })
+    }).then(response => response.json())
+      .then(data => {
+          if (!data.success) {
+              return;
+          }
+          // The connection is made in the background
+          waitForJob(data.job, result => {
+              if (result.success) {
+                  window.location.href = '/game';
+              } else {
+                  alert(`Could not connect to ${username}`);
+              }
+          });
+      });
+}
+
+// /events hands each event out once, so a single poller reads them
+// and passes each job's result to whoever is waiting for it
+function waitForJob(job, onResult) {
+    pendingJobs.set(job, onResult);
+    if (eventsInterval) {
+        return;
+    }
+    eventsInterval = setInterval(async () => {
+        try {
+            const response = await fetch('/events');
+            const events = await response.json();
+            for (const event of events) {
+                const callback = pendingJobs.get(event.job);
+                if (callback) {
+                    pendingJobs.delete(event.job);
+                    callback(event);
+                }
+            }
+            if (pendingJobs.size === 0) {
+                clearInterval(eventsInterval);
+                eventsInterval = null;
+            }
+        } catch (error) {
+            console.error('Event check error:', error);
+        }
+    }, 250);
+}
+
+function logout() {
+    clearInterval(checkConnectionInterval);
+    fetch('/logout').then(() => {
+        window.location.href = '/';
+    });
+}
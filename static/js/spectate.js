@@ -0,0 +1,65 @@
+const board = document.getElementById('gameBoard');
+const username = board.dataset.username;
+const subBoards = [];
+const cells = [];  // By cell index, sub-board by sub-board
+let subBoardWinners = new Array(9).fill(null);
+
+for (let b = 0; b < 9; b++) {
+    const subBoard = document.createElement('div');
+    subBoard.className = 'sub-board';
+    for (let c = 0; c < 9; c++) {
+        const cell = document.createElement('div');
+        cell.className = 'cell';
+        subBoard.appendChild(cell);
+        cells.push(cell);
+    }
+    board.appendChild(subBoard);
+    subBoards.push(subBoard);
+}
+
+function setSubBoard(b, winner, currentBoard) {
+    const classes = ['sub-board'];
+    if (winner === 'X') classes.push('won-x');
+    else if (winner === 'O') classes.push('won-o');
+    else if (winner === 'draw') classes.push('draw');
+    else if (currentBoard === null || currentBoard === b) classes.push('playable');
+    subBoards[b].className = classes.join(' ');
+}
+
+function setStatus(result) {
+    const status = document.getElementById('status');
+    if (result === 'draw') status.textContent = 'Game over: draw';
+    else if (result) status.textContent = `Game over: ${result} wins`;
+    else status.textContent = 'Game in progress...';
+}
+
+const events = new EventSource(`/spectate/${encodeURIComponent(username)}/stream`);
+
+// Sent first, and again whenever this page fell too far behind
+events.addEventListener('snapshot', (event) => {
+    const state = JSON.parse(event.data);
+    document.getElementById('players').textContent =
+        `${state.x || '?'} (X) vs ${state.o || '?'} (O)`;
+    for (let i = 0; i < 81; i++) {
+        cells[i].textContent = state.cells[i] === '.' ? '' : state.cells[i];
+    }
+    subBoardWinners = state.sub_boards;
+    for (let b = 0; b < 9; b++) {
+        setSubBoard(b, state.sub_boards[b], state.current_board);
+    }
+    setStatus(state.result);
+});
+
+events.addEventListener('move', (event) => {
+    const move = JSON.parse(event.data);
+    cells[move.index].textContent = move.mark;
+    subBoardWinners[Math.floor(move.index / 9)] = move.sub_board;
+    for (let b = 0; b < 9; b++) {
+        setSubBoard(b, subBoardWinners[b], move.current_board);
+    }
+    setStatus(move.result);
+});
+
+events.onerror = () => {
+    document.getElementById('status').textContent = 'Reconnecting...';
+};
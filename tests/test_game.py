@@ -0,0 +1,38 @@
+from game import UltimateTicTacToe, index_to_move
+
+
+def started_game(first=True):
+    game = UltimateTicTacToe('me')
+    game.start_game(first, game_id=1)
+    return game
+
+
+def test_make_move_rejects_malformed_coordinates():
+    game = started_game()
+    for move in (('0', 0, 0, 0), (5, 0, 0, 0), (0, 0, -1, 0), (None, 0, 0, 0), (0.0, 0, 0, 0)):
+        assert game.make_move(*move) == {'valid': False, 'message': 'Invalid move'}
+    assert game.make_move(0, 0, 0, 0)['valid']
+
+
+def play(game, indexes):
+    """Play alternate moves on ``game``, X's with make_move and O's with receive_move."""
+    for index in indexes:
+        if game.symbol_to_move() == game.symbol:
+            assert game.make_move(*index_to_move(index))['valid']
+        else:
+            assert game.receive_move(*index_to_move(index))['valid']
+
+
+def test_load_moves_replays_a_game_and_rejects_an_illegal_one():
+    game, other = started_game(), started_game()
+    play(game, [40, 36, 0, 4])  # Each move sends the next player to the sub-board of its cell
+    resets = []
+    other.reset_callbacks.append(resets.append)
+    assert other.load_moves(list(game.moves))
+    assert other.moves == game.moves and other.state_hash == game.state_hash
+    assert other.board == game.board and other.my_turn and resets == [other]
+
+    before = other.state_hash
+    assert not other.load_moves([40, 0])  # O had to play in sub-board 4
+    assert not other.load_moves([40, 'x'])
+    assert other.state_hash == before and len(resets) == 1
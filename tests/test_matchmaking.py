@@ -0,0 +1,86 @@
+import socket
+import time
+
+from host import GameHost
+from matchmaking import Matchmaker
+
+
+def tcp_pair():
+    with socket.create_server(('127.0.0.1', 0)) as listener:
+        client = socket.create_connection(listener.getsockname())
+        server, _ = listener.accept()
+    return server, client
+
+
+def test_manual_ticks_start_no_thread():
+    pairs = []
+    matchmaker = Matchmaker(lambda *pair: pairs.append(pair), start_thread=False)
+    assert matchmaker.join('a', 1500, now=0) is None
+    assert matchmaker.join('b', 1900, now=1) is None
+    assert matchmaker.thread is None
+    matchmaker.tick(100)  # Both windows have widened to the full 500 points
+    assert pairs == [('a', 'b')]
+
+
+def test_connected_players_are_not_queued_and_leave_on_connecting():
+    host = GameHost()
+    host.matchmaker.start_thread = False
+    _, peer = host.create_player('me')
+    host.create_player('busy')
+    busy = host.peers['busy']
+    busy.claim_connection(None, 'someone')
+    assert host.join_queue('busy') is None
+    assert host.matchmaker.status('busy') is None
+
+    host.join_queue('me')
+    assert host.matchmaker.status('me') is not None
+    ours, theirs = tcp_pair()
+    try:
+        peer.handle_tcp_accept(ours, ('127.0.0.1', 40000))
+        assert peer.is_connected
+        assert host.matchmaker.status('me') is None
+
+        # A second connection is refused, not swapped in for the first
+        extra, other = tcp_pair()
+        peer.handle_tcp_accept(extra, ('127.0.0.1', 40001))
+        assert peer.peer_connection is ours
+        assert extra.fileno() == -1
+        other.close()
+        assert not peer.accept_connection('someone')
+    finally:
+        peer.handle_disconnect()
+        theirs.close()
+
+
+def test_matched_player_without_a_game_is_not_connected():
+    host = GameHost()
+    host.create_player('a')
+    host.create_player('b')
+    del host.games['a']
+    assert host.connect_players('a', 'b') is None
+
+
+def test_failed_match_is_reported_to_both_players():
+    host = GameHost()
+    host.create_player('a')
+    _, b = host.create_player('b')
+    b.ensure_sockets = lambda: False
+    assert host.connect_players('a', 'b') is None
+    assert host.match_failed('a') and host.match_failed('b')
+    host.matchmaker.start_thread = False
+    host.join_queue('a')  # Queueing again clears it
+    assert not host.match_failed('a')
+
+
+def test_failed_connect_is_reported_once_the_attempt_ends():
+    host = GameHost()
+    _, a = host.create_player('a')
+    host.create_player('b')
+    a.accept_connection = lambda opponent: False
+    job = host.connect_players('a', 'b')
+    assert job is not None
+    deadline = time.monotonic() + 2
+    while not host.match_failed('b') and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert host.match_failed('a') and host.match_failed('b')
+    host.peers['b'].close()
@@ -0,0 +1,37 @@
+import random
+
+from openings import OpeningBook, build
+from records import GameRecord
+
+
+class Store:
+    def __init__(self, games):
+        self.games = games
+
+    def iter_games(self):
+        return iter(self.games)
+
+
+def random_games(count, seed=1):
+    rng = random.Random(seed)
+    return [GameRecord(i, 'ann', 'bob', rng.choice(['X', 'O', 'draw']), 0, 0,
+                       bytes(rng.randrange(81) for _ in range(6))) for i in range(count)]
+
+
+def test_spilled_build_matches_one_in_memory(tmp_path):
+    store = Store(random_games(300))
+    build(store, str(tmp_path / 'memory.book'), workers=1)
+    build(store, str(tmp_path / 'spilled.book'), workers=2, chunk_size=20, max_entries=50)
+    assert (tmp_path / 'memory.book').read_bytes() == (tmp_path / 'spilled.book').read_bytes()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['memory.book', 'spilled.book']
+
+
+def test_min_games_counts_every_run(tmp_path):
+    # Each run sees the opening once; only the merged total reaches min_games
+    games = [GameRecord(i, 'ann', 'bob', 'X', 0, 0, bytes([40])) for i in range(3)]
+    path = str(tmp_path / 'book')
+    build(Store(games), path, workers=1, chunk_size=1, max_entries=1, min_games=3)
+    book = OpeningBook(path)
+    [entry] = book.lookup_moves([])
+    assert (entry.move, entry.wins, entry.games) == ((1, 1, 1, 1), 3, 3)
+    book.close()
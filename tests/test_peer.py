@@ -0,0 +1,149 @@
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from game import UltimateTicTacToe
+from peer import JobsClosed, PeerNetwork
+
+
+def connect_request(username, **fields):
+    message = dict({'type': 'CONNECT_REQUEST', 'username': username,
+                    'local_ip': '10.0.0.9', 'tcp_port': 5000, 'addresses': ['10.0.0.9']}, **fields)
+    return pickle.dumps(message)
+
+
+def pending_request(username, **fields):
+    return dict({'username': username, 'ip': '10.0.0.1', 'addresses': [], 'tcp_port': 5000,
+                 'timestamp': time.time(), 'strength': 1}, **fields)
+
+
+def make_peer():
+    # Sockets only open on first use, so none are opened here
+    return PeerNetwork('me', UltimateTicTacToe('me'))
+
+
+def test_pending_requests_are_capped(capsys):
+    peer = make_peer()
+    for i in range(PeerNetwork.MAX_PENDING_REQUESTS + 20):
+        # Spread over sources so the per-source rate limit does not apply
+        peer.handle_udp_datagram(connect_request(f'user{i}'), (f'10.0.{i}.1', 5005))
+    assert len(peer.pending_requests) == PeerNetwork.MAX_PENDING_REQUESTS
+    assert peer.drops.snapshot() == {'pending requests full': 20}
+    # One line per request until the table is full, then one drop summary
+    assert capsys.readouterr().out.count('\n') == PeerNetwork.MAX_PENDING_REQUESTS + 1
+
+
+def test_searching_player_outlasts_a_flood_of_names():
+    peer = make_peer()
+    for _ in range(2):
+        peer.handle_udp_datagram(connect_request('bob'), ('10.0.0.2', 5005))
+    for i in range(200):
+        peer.handle_udp_datagram(connect_request(f'flood{i}'), (f'10.1.{i}.1', 5005))
+    assert 'bob' in [r['username'] for r in peer.pending_requests]
+    assert len(peer.pending_requests) == PeerNetwork.MAX_PENDING_REQUESTS
+
+
+def test_repeated_request_refreshes_quietly(capsys):
+    peer = make_peer()
+    for _ in range(3):
+        peer.handle_udp_datagram(connect_request('bob'), ('10.0.0.2', 5005))
+    assert [r['strength'] for r in peer.pending_requests] == [3]
+    assert capsys.readouterr().out.count('\n') == 1
+
+
+def test_invalid_requests_are_dropped():
+    peer = make_peer()
+    for fields in ({'username': ['bob']}, {'username': ''}, {'username': 'x' * 100},
+                   {'tcp_port': '5000'}, {'tcp_port': 70000}):
+        peer.handle_udp_datagram(pickle.dumps(dict(pickle.loads(connect_request('bob')), **fields)),
+                                 ('10.0.0.2', 5005))
+    peer.handle_udp_datagram(connect_request('bob', addresses='fe80::1'), ('10.0.0.2', 5005))
+    assert peer.drops.snapshot() == {'udp invalid': 5}
+    assert [r['addresses'] for r in peer.pending_requests] == [['10.0.0.2']]
+
+
+def test_full_table_makes_room_for_a_new_request():
+    peer = make_peer()
+    for i in range(PeerNetwork.MAX_PENDING_REQUESTS):
+        peer.update_pending_requests(pending_request(f'user{i}', timestamp=time.time() - 1 + i / 100))
+    assert peer.update_pending_requests(pending_request('matched'))
+    names = [r['username'] for r in peer.pending_requests]
+    assert len(names) == PeerNetwork.MAX_PENDING_REQUESTS
+    assert 'matched' in names and 'user0' not in names
+
+
+def started_pair():
+    x_game, o_game = UltimateTicTacToe('x'), UltimateTicTacToe('o')
+    x_game.start_game(True, game_id=1)
+    o_game.start_game(False, game_id=1)
+    x_peer = PeerNetwork('x', x_game)
+    sent = []
+    x_peer.send_message = sent.append
+    return x_game, o_game, x_peer, sent
+
+
+def test_diverged_board_is_replaced_by_the_peers_game():
+    x_game, o_game, x_peer, sent = started_pair()
+    x_game.make_move(0, 0, 0, 0)
+    o_game.receive_move(0, 0, 0, 0)
+    o_result = o_game.make_move(0, 0, 0, 2)
+
+    # O's move arrives as a different cell; the hash shows the boards differ
+    x_peer.handle_message({'type': 'MOVE', 'main_row': 0, 'main_col': 0, 'sub_row': 0,
+                           'sub_col': 1, 'seq': 2, 'hash': o_result['hash']})
+    assert sent == [{'type': 'STATE_REQUEST', 'since': 0}]
+
+    x_peer.handle_message({'type': 'STATE', **o_game.get_state(sent[0]['since'])})
+    assert x_game.moves == o_game.moves == bytearray([0, 2])
+    assert x_game.state_hash == o_game.state_hash
+    assert x_game.my_turn
+    assert x_peer.game_status == {'type': 'STATE', 'seq': 2, 'full': True}
+
+
+def test_unrequested_state_is_ignored():
+    x_game, _, x_peer, _ = started_pair()
+    x_game.make_move(1, 1, 1, 1)
+    # A legal game, but not one we asked for
+    x_peer.handle_message({'type': 'STATE', 'since': 0, 'moves': [9, 1], 'seq': 2})
+    assert x_game.moves == bytearray([40])
+    assert x_peer.drops.snapshot() == {'unrequested state': 1}
+
+
+def test_state_that_changes_our_own_move_is_refused():
+    x_game, _, x_peer, sent = started_pair()
+    x_game.make_move(1, 1, 1, 1)
+    x_peer.request_state(full=True)
+    x_peer.handle_message({'type': 'STATE', 'since': 0, 'moves': [9, 1], 'seq': 2})
+    assert x_game.moves == bytearray([40])
+    assert x_peer.game_status['type'] == 'DESYNC'
+
+
+def test_partial_state_that_disagrees_asks_for_the_whole_game():
+    x_game, _, x_peer, sent = started_pair()
+    x_game.make_move(0, 0, 0, 0)
+    x_peer.request_state()
+    # O must answer in sub-board 0; cell 80 is not there
+    x_peer.handle_message({'type': 'STATE', 'since': 1, 'moves': [80], 'seq': 2})
+    assert sent == [{'type': 'STATE_REQUEST', 'since': 1}, {'type': 'STATE_REQUEST', 'since': 0}]
+    assert x_game.moves == bytearray([0])
+
+
+def test_rejected_move_is_taken_back():
+    x_game, _, x_peer, sent = started_pair()
+    result = x_game.make_move(1, 1, 1, 1)
+    x_game.my_turn = False  # As the /make_move route does
+    x_peer.handle_message({'type': 'MOVE_REJECTED', 'seq': result['seq'], 'message': 'Illegal move'})
+    assert x_game.moves == bytearray()
+    assert x_game.my_turn
+    assert x_peer.game_status == {'type': 'STATE', 'seq': 0, 'full': True}
+    assert sent == [{'type': 'STATE_REQUEST', 'since': 0}]
+
+
+def test_connect_during_shutdown_is_not_already_connecting():
+    executor = ThreadPoolExecutor(max_workers=1)
+    peer = PeerNetwork('me', UltimateTicTacToe('me'), executor=executor)
+    executor.shutdown()
+    with pytest.raises(JobsClosed):
+        peer.accept_connection_async('bob')
@@ -0,0 +1,37 @@
+import pickle
+
+import pytest
+
+import protocol
+
+
+def test_looks_like_message():
+    assert protocol.looks_like_message(pickle.dumps({'type': 'CONNECT_REQUEST'}))
+    assert not protocol.looks_like_message(b'')
+    assert not protocol.looks_like_message(b'GET / HTTP/1.1\r\n')
+    assert not protocol.looks_like_message(pickle.dumps('x', protocol=1))
+    assert not protocol.looks_like_message(pickle.dumps('x' * protocol.MAX_DATAGRAM_SIZE))
+
+
+def test_loads_refuses_objects():
+    assert protocol.loads(pickle.dumps({'moves': [1, 2], 'ok': True})) == {'moves': [1, 2], 'ok': True}
+    with pytest.raises(protocol.ProtocolError):
+        protocol.loads(pickle.dumps(protocol.MessageReader()))
+
+
+def test_message_reader_splits_and_joins_messages():
+    first, second = pickle.dumps({'type': 'MOVE', 'seq': 1}), pickle.dumps({'type': 'MOVE', 'seq': 2})
+    reader = protocol.MessageReader()
+    data = first + second
+    assert reader.feed(data[:len(first) + 3]) == [{'type': 'MOVE', 'seq': 1}]
+    assert reader.feed(b'') == []
+    assert reader.feed(data[len(first) + 3:]) == [{'type': 'MOVE', 'seq': 2}]
+    assert reader.buffer == b''
+
+
+def test_message_reader_rejects_objects_and_oversized_tails():
+    with pytest.raises(protocol.ProtocolError):
+        protocol.MessageReader().feed(pickle.dumps(protocol.MessageReader()))
+    oversized = pickle.dumps('x' * (protocol.MAX_MESSAGE_SIZE + 10))
+    with pytest.raises(protocol.ProtocolError):
+        protocol.MessageReader().feed(oversized[:-1])
@@ -0,0 +1,39 @@
+from ratelimit import DropCounter, RateLimiter, TokenBucket
+
+
+def test_token_bucket_allows_burst_then_refills():
+    bucket = TokenBucket(rate=2, burst=3, now=0.0)
+    assert [bucket.take(now=0.0) for _ in range(4)] == [True, True, True, False]
+    assert bucket.take(now=0.5)  # One token back after half a second
+    assert not bucket.take(now=0.5)
+    assert bucket.take(cost=3, now=10.0)  # Refill is capped at the burst
+    assert not bucket.take(now=10.0)
+
+
+def test_rate_limiter_is_per_source():
+    limiter = RateLimiter(rate=0, burst=2)
+    assert [limiter.allow('a') for _ in range(3)] == [True, True, False]
+    assert limiter.allow('b')
+
+
+def test_rate_limiter_total_caps_every_source_together():
+    limiter = RateLimiter(rate=0, burst=10, total_rate=0, total_burst=3)
+    assert [limiter.allow(source) for source in 'abcd'] == [True, True, True, False]
+
+
+def test_rate_limiter_forgets_least_recent_sources():
+    limiter = RateLimiter(rate=0, burst=1, max_sources=2)
+    assert limiter.allow('a') and limiter.allow('b')
+    assert not limiter.allow('b')
+    assert limiter.allow('c')  # Pushes out 'a'
+    assert len(limiter.buckets) == 2
+    assert limiter.allow('a')  # A fresh bucket
+
+
+def test_drop_counter_logs_a_summary_at_most_once_per_interval(capsys):
+    drops = DropCounter('test', log_interval=3600)
+    for _ in range(5):
+        drops.drop('udp rate')
+    drops.drop('udp malformed')
+    assert drops.snapshot() == {'udp rate': 5, 'udp malformed': 1}
+    assert capsys.readouterr().out.count('\n') == 1
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from ratings import DEFAULT_RATING, Leaderboard, Ratings, elo_update, expected_score
+
+
+def test_elo_update_is_zero_sum_between_equal_k_factors():
+    assert expected_score(1500, 1500) == 0.5
+    assert expected_score(1900, 1500) == pytest.approx(10 / 11)
+    assert elo_update(1500, 1500, 1) == 1516
+    assert elo_update(1500, 1500, 0.5) == 1500
+    gain = elo_update(1600, 1400, 0) - 1600
+    assert elo_update(1400, 1600, 1) - 1400 == pytest.approx(-gain)
+
+
+def test_leaderboard_matches_a_sorted_list():
+    rng = random.Random(1)
+    board, ratings = Leaderboard(), {}
+    for step in range(5000):
+        name = f'p{rng.randrange(500)}'
+        if rng.random() < 0.1:
+            board.remove(name)
+            ratings.pop(name, None)
+        else:
+            ratings[name] = rng.gauss(1500, 400)
+            board.set(name, ratings[name])
+        if step % 250:
+            continue
+        points = {name: min(4000, max(0, round(rating))) for name, rating in ratings.items()}
+        for name in ratings:
+            assert board.rank(name) == 1 + sum(1 for p in points.values() if p > points[name])
+        top = board.top(50)
+        assert [rating for _, _, rating in top] == sorted(ratings.values(), reverse=True)[:50]
+        assert all(rank == board.rank(name) for rank, name, _ in top)
+    assert len(board) == len(ratings)
+
+
+def test_leaderboard_ties_share_a_rank_and_ends_are_clamped():
+    board = Leaderboard()
+    for name, rating in (('a', 1600.2), ('b', 1599.9), ('c', 1500), ('d', 5000), ('e', -20)):
+        board.set(name, rating)
+    assert [board.rank(name) for name in 'abcde'] == [2, 2, 4, 1, 5]
+    assert board.top(3) == [(1, 'd', 5000), (2, 'a', 1600.2), (2, 'b', 1599.9)]
+    assert board.top(100)[-1] == (5, 'e', -20)
+    assert board.rank('nobody') is None
+
+
+def test_ratings_count_a_game_once_and_persist(tmp_path):
+    path = str(tmp_path / 'ratings.db')
+    ratings = Ratings(path)
+    assert ratings.record(1, 'ann', 'bob', 'X')
+    assert not ratings.record(1, 'ann', 'bob', 'X')  # Reported by the other player too
+    assert not ratings.record(2, 'ann', None, 'X')
+    assert ratings.record(3, 'bob', 'cat', 'draw')
+    assert ratings.rating('ann') == 1516
+    assert ratings.rating('nobody') == DEFAULT_RATING
+    assert ratings.rank('nobody') is None
+    assert [(rank, player.name) for rank, player in ratings.top()] == [(1, 'ann'), (2, 'cat'), (3, 'bob')]
+    bob = ratings.player('bob')
+    assert (bob.games, bob.wins, bob.draws, bob.losses) == (2, 0, 1, 1)
+    ratings.close()
+
+    reloaded = Ratings(path)
+    assert reloaded.top() == ratings.top()
+    reloaded.close()
@@ -0,0 +1,26 @@
+from records import GameRecord, GameStore
+
+
+def game(game_id, x_player='ann', o_player='bob'):
+    return GameRecord(game_id, x_player, o_player, 'X', 1000.0, 1060.0, bytes([40, 0]))
+
+
+def test_game_without_a_player_is_not_queued(tmp_path):
+    store = GameStore(str(tmp_path / 'games.db'))
+    assert not store.record(game(1, o_player=None))
+    assert not store.record(game(2, x_player=''))
+    assert store.record(game(3))
+    store.close()
+    assert store.count() == 1
+
+
+def test_bad_row_loses_only_itself(tmp_path):
+    store = GameStore(str(tmp_path / 'games.db'))
+    store.close()  # Write batches by hand
+    conn = store.connect()
+    # Stands in for any row the database refuses
+    conn.execute('CREATE TRIGGER no_eve BEFORE INSERT ON players WHEN NEW.name = "eve" '
+                 'BEGIN SELECT RAISE(ABORT, "no eve"); END')
+    store._write_batch(conn, [game(1), game(2, o_player='eve'), game(3, x_player='cat')])
+    conn.close()
+    assert [r.game_id for r in store.iter_games()] == [1, 3]
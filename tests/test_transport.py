@@ -0,0 +1,146 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from transport import SelectorTransport, send_all
+
+
+@pytest.fixture
+def transport():
+    transport = SelectorTransport()
+    transport.start()
+    yield transport
+    transport.stop()
+
+
+def run_on_loop(transport, callback):
+    done = threading.Event()
+    transport.call_soon(lambda: (callback(), done.set()))
+    assert done.wait(2), 'event loop is stuck'
+
+
+class Player:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.datagrams = []
+        self.received = threading.Event()
+
+    def on_datagram(self, data, addr):
+        if self.fail:
+            raise ValueError('bad datagram')
+        self.datagrams.append(data)
+        self.received.set()
+
+
+def test_failing_discovery_handler_does_not_starve_others(transport):
+    broken, player = Player(fail=True), Player()
+    udp_socket = transport.add_discovery_handler(0, broken.on_datagram)
+    transport.add_discovery_handler(0, player.on_datagram)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.sendto(b'hello', ('127.0.0.1', udp_socket.getsockname()[1]))
+    sender.close()
+    assert player.received.wait(2)
+    assert player.datagrams == [b'hello']
+
+
+def test_client_reset_before_accept_does_not_block_the_loop(transport):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(5)
+    accepted = []
+    transport.add_listener(listener, lambda client, address: accepted.append(client))
+    run_on_loop(transport, lambda: None)
+    assert not listener.getblocking()
+
+    # Readiness reported with nothing to accept, as after a reset
+    handler = transport.selector.get_key(listener).data
+    run_on_loop(transport, lambda: handler(None))
+
+    client = socket.create_connection(listener.getsockname())
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    client.close()
+    run_on_loop(transport, lambda: None)
+    for sock in accepted:
+        sock.close()
+    listener.close()
+
+
+def test_send_all_waits_for_room_on_a_non_blocking_socket():
+    left, right = socket.socketpair()
+    left.setblocking(False)
+    data = bytes(range(256)) * 16384  # 4 MB, far more than the socket buffers
+    received = bytearray()
+
+    def read():
+        while len(received) < len(data):
+            received.extend(right.recv(1 << 16))
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    send_all(left, data)
+    reader.join(5)
+    assert bytes(received) == data
+    left.close()
+    right.close()
+
+
+def test_send_all_times_out_when_the_peer_stops_reading():
+    left, right = socket.socketpair()
+    left.setblocking(False)
+    with pytest.raises(TimeoutError):
+        send_all(left, b'x' * (16 << 20), timeout=0.2)
+    left.close()
+    right.close()
+
+
+def test_peer_that_stops_reading_does_not_hold_up_the_loop(transport):
+    left, right = socket.socketpair()
+    closed = threading.Event()
+    transport.add_connection(left, lambda data: None, closed.set)
+    for _ in range(3):
+        transport.send(left, b'x' * (transport.MAX_OUTBOUND // 2))
+    run_on_loop(transport, lambda: None)  # Would wait on the peer if sends blocked
+    assert closed.wait(2)  # Too much queued: the peer counts as gone
+    left.close()
+    right.close()
+
+
+def test_queued_bytes_are_written_as_the_peer_reads(transport):
+    left, right = socket.socketpair()
+    transport.add_connection(left, lambda data: None, lambda: None)
+    data = bytes(range(256)) * 2048  # 512 KB, more than the socket buffers
+    transport.send(left, data[:300000])
+    transport.send(left, data[300000:])
+    received = bytearray()
+    right.settimeout(2)
+    while len(received) < len(data):
+        received.extend(right.recv(1 << 16))
+    assert bytes(received) == data
+    transport.remove(left)
+    left.close()
+    right.close()
+
+
+def test_discovery_datagrams_are_decoded_once_for_all_players(transport):
+    decoded = []
+
+    def decode(data, addr):
+        decoded.append(data)
+        return None if data == b'junk' else data.decode()
+
+    first, second = Player(), Player()
+    udp_socket = transport.add_discovery_handler(0, first.on_datagram, decode)
+    transport.add_discovery_handler(0, second.on_datagram)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for payload in (b'junk', b'one', b'two'):
+        sender.sendto(payload, ('127.0.0.1', udp_socket.getsockname()[1]))
+    sender.close()
+    run_on_loop(transport, lambda: None)
+    deadline = time.monotonic() + 2
+    while len(second.datagrams) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert first.datagrams == second.datagrams == ['one', 'two']
+    assert decoded == [b'junk', b'one', b'two']
@@ -0,0 +1,344 @@
+"""Self-play tournaments between engines, with Elo ratings.
+
+    python tournament.py --engine random --engine minimax:depth=2 --engine mcts:playouts=200 \\
+        --format roundrobin --games-per-pair 1000 --out tmp/result/tournament.jsonl
+
+Games are played in a process pool and every finished game is appended
+to the JSONL file as soon as it completes, so a run can be stopped and
+continued with the same command: games already in the file are not
+replayed. ``--report`` only reads the file and prints the ratings.
+See engine.py for engine specs.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, NamedTuple
+
+from engine import parse_engine, play_game
+from rules import SYMBOLS
+
+ELO_PER_NATURAL_UNIT = 400 / math.log(10)
+Z_95 = 1.96
+
+_engines = {}  # Engines built in this worker process, by spec
+
+
+class Job(NamedTuple):
+    game: int  # Position in the schedule, unique within a tournament
+    round: int
+    x: str  # Engine spec playing X
+    o: str
+    seed: str
+    random_plies: int
+
+
+def _play(job: Job):
+    """Worker: play one scheduled game and return its result entry."""
+    for spec in (job.x, job.o):
+        if spec not in _engines:
+            _engines[spec] = parse_engine(spec)
+    start = time.perf_counter()
+    position = play_game(_engines[job.x], _engines[job.o], random.Random(job.seed),
+                         random_plies=job.random_plies)
+    return {
+        'game': job.game,
+        'round': job.round,
+        'x': job.x,
+        'o': job.o,
+        'result': SYMBOLS[position.result],
+        'moves': bytes(index for index, _, _ in position.history).hex(),
+        'seconds': round(time.perf_counter() - start, 4),
+    }
+
+
+def round_robin(engines, games_per_pair):
+    """Pairings for one round: every pair plays games_per_pair games, alternating X."""
+    for i, a in enumerate(engines):
+        for b in engines[i + 1:]:
+            for k in range(games_per_pair):
+                yield (a, b) if k % 2 == 0 else (b, a)
+
+
+def swiss_pairings(engines, points, played, byes, rng):
+    """Pair engines with similar scores, avoiding rematches where possible.
+
+    Returns (pairs, bye); bye is None unless the number of engines is odd,
+    and goes to the lowest-placed engine that has not had one yet.
+    """
+    order = sorted(engines, key=lambda e: (-points[e], rng.random()))
+    bye = None
+    if len(order) % 2:
+        bye = next((e for e in reversed(order) if e not in byes), order[-1])
+        order.remove(bye)
+    pairs = []
+    while order:
+        a = order.pop(0)
+        opponent = next((b for b in order if b not in played[a]), order[0])
+        order.remove(opponent)
+        pairs.append((a, opponent))
+    return pairs, bye
+
+
+def game_points(entry):
+    """(points for X, points for O) from a result entry."""
+    if entry['result'] == 'draw':
+        return 0.5, 0.5
+    return (1.0, 0.0) if entry['result'] == 'X' else (0.0, 1.0)
+
+
+class Rating(NamedTuple):
+    engine: str
+    elo: float
+    ci: float  # Half-width of the 95% confidence interval
+    games: int
+    score: float  # Points per game
+
+
+def _invert(matrix):
+    """Gauss-Jordan inverse of a small, well-conditioned matrix."""
+    n = len(matrix)
+    a = [row[:] + [float(i == j) for j in range(n)] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        a[col], a[pivot] = a[pivot], a[col]
+        p = a[col][col]
+        a[col] = [v / p for v in a[col]]
+        for r in range(n):
+            if r != col and a[r][col]:
+                f = a[r][col]
+                a[r] = [v - f * w for v, w in zip(a[r], a[col])]
+    return [row[n:] for row in a]
+
+
+def compute_ratings(entries, anchor=None) -> List[Rating]:
+    """Bradley-Terry maximum likelihood Elo, draws counting half a win.
+
+    Every pair that met gets one virtual draw so that an engine that never
+    scored still has a finite rating. Ratings average 0 unless ``anchor``
+    names an engine to pin at 0; intervals come from the Fisher information.
+    """
+    games: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    points: Dict[str, float] = defaultdict(float)
+    for entry in entries:
+        x_points, o_points = game_points(entry)
+        games[entry['x']][entry['o']] += 1
+        games[entry['o']][entry['x']] += 1
+        points[entry['x']] += x_points
+        points[entry['o']] += o_points
+    engines = sorted(games)
+    if not engines:
+        return []
+    index = {e: i for i, e in enumerate(engines)}
+    n = len(engines)
+    counts = [[0.0] * n for _ in range(n)]
+    wins = [0.0] * n
+    for a, opponents in games.items():
+        for b, count in opponents.items():
+            counts[index[a]][index[b]] = count + 1  # With the virtual draw
+        wins[index[a]] = points[a] + 0.5 * len(opponents)
+
+    # Minorization-maximization (Hunter 2004)
+    strength = [1.0] * n
+    for _ in range(10000):
+        new = [wins[i] / sum(counts[i][j] / (strength[i] + strength[j])
+                             for j in range(n) if counts[i][j]) for i in range(n)]
+        mean_log = sum(math.log(s) for s in new) / n
+        new = [s / math.exp(mean_log) for s in new]
+        change = max(abs(math.log(a / b)) for a, b in zip(new, strength))
+        strength = new
+        if change < 1e-10:
+            break
+    theta = [math.log(s) for s in strength]
+
+    # Fisher information is singular along the all-ones direction; use the
+    # pseudo-inverse, which corresponds to ratings that average to zero
+    info = [[0.0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(n):
+            if i != j and counts[i][j]:
+                p = strength[i] / (strength[i] + strength[j])
+                info[i][j] = -counts[i][j] * p * (1 - p)
+                info[i][i] += counts[i][j] * p * (1 - p)
+    covariance = _invert([[v + 1.0 / n for v in row] for row in info])
+    covariance = [[v - 1.0 / n for v in row] for row in covariance]
+
+    a = index.get(anchor)
+    ratings = []
+    for e in engines:
+        i = index[e]
+        if a is None:
+            elo = theta[i]
+            variance = covariance[i][i]
+        else:
+            elo = theta[i] - theta[a]
+            variance = covariance[i][i] + covariance[a][a] - 2 * covariance[i][a]
+        total = sum(games[e].values())
+        ratings.append(Rating(e, elo * ELO_PER_NATURAL_UNIT,
+                              Z_95 * math.sqrt(max(variance, 0.0)) * ELO_PER_NATURAL_UNIT,
+                              total, points[e] / total))
+    ratings.sort(key=lambda r: -r.elo)
+    return ratings
+
+
+def print_ratings(ratings):
+    print(f"{'engine':<40} {'elo':>8} {'95% ci':>8} {'games':>8} {'score':>6}")
+    for r in ratings:
+        print(f"{r.engine:<40} {r.elo:>8.1f} {'±' + format(r.ci, '.1f'):>8} {r.games:>8} {r.score:>6.3f}")
+
+
+def load_results(path):
+    """Read finished games from a results file, keyed by game number."""
+    done = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut short by an interrupted run
+                done[entry['game']] = entry
+    return done
+
+
+class Tournament:
+    """Schedules rounds, skips games already in the results file and streams new ones to it."""
+
+    MAX_IN_FLIGHT_PER_WORKER = 4  # Keeps memory flat however many games are scheduled
+
+    def __init__(self, engines, out_path, games_per_pair=2, seed=0, random_plies=2,
+                 workers=None, store=None):
+        self.engines = engines
+        self.out_path = out_path
+        self.games_per_pair = games_per_pair
+        self.seed = seed
+        self.random_plies = random_plies
+        self.workers = workers or os.cpu_count() or 1
+        self.store = store
+        self.done = load_results(out_path)
+        if os.path.exists(out_path) and os.path.getsize(out_path):
+            with open(out_path, 'rb+') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')  # Don't glue new results onto a line cut short
+        self.next_game = 0
+        self.played_now = 0
+        self.started = time.perf_counter()
+
+    def jobs_for(self, round_number, pairs):
+        jobs = []
+        for x, o in pairs:
+            jobs.append(Job(self.next_game, round_number, x, o,
+                            f'{self.seed}:{self.next_game}', self.random_plies))
+            self.next_game += 1
+        return jobs
+
+    def play(self, executor, jobs):
+        """Play the jobs not already done; return the entries of all of them."""
+        pending = [job for job in jobs if job.game not in self.done]
+        in_flight = set()
+        limit = self.workers * self.MAX_IN_FLIGHT_PER_WORKER
+        with open(self.out_path, 'a') as out:
+            while pending or in_flight:
+                while pending and len(in_flight) < limit:
+                    in_flight.add(executor.submit(_play, pending.pop(0)))
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    self.record(out, future.result())
+        return [self.done[job.game] for job in jobs]
+
+    def record(self, out, entry):
+        out.write(json.dumps(entry) + '\n')
+        out.flush()
+        self.done[entry['game']] = entry
+        if self.store is not None:
+            from records import GameRecord
+            digest = hashlib.blake2b(f"{self.seed}:{entry['game']}".encode(), digest_size=8).digest()
+            now = time.time()
+            self.store.record(GameRecord(int.from_bytes(digest, 'big') >> 1, entry['x'], entry['o'],
+                                         entry['result'], now - entry['seconds'], now,
+                                         bytes.fromhex(entry['moves'])))
+        self.played_now += 1
+        if self.played_now % 1000 == 0:
+            rate = self.played_now / (time.perf_counter() - self.started)
+            print(f"{len(self.done)} games done ({rate:.1f} games/s)")
+
+    def run_round_robin(self, rounds):
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for round_number in range(rounds):
+                jobs = self.jobs_for(round_number, round_robin(self.engines, self.games_per_pair))
+                self.play(executor, jobs)
+
+    def run_swiss(self, rounds):
+        rng = random.Random(self.seed)
+        points = {e: 0.0 for e in self.engines}
+        played = defaultdict(set)
+        byes = set()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for round_number in range(rounds):
+                pairs, bye = swiss_pairings(self.engines, points, played, byes, rng)
+                colored = [(a, b) if k % 2 == 0 else (b, a)
+                           for a, b in pairs for k in range(self.games_per_pair)]
+                for entry in self.play(executor, self.jobs_for(round_number, colored)):
+                    x_points, o_points = game_points(entry)
+                    points[entry['x']] += x_points
+                    points[entry['o']] += o_points
+                for a, b in pairs:
+                    played[a].add(b)
+                    played[b].add(a)
+                if bye is not None:
+                    byes.add(bye)
+                    points[bye] += self.games_per_pair  # A bye scores as winning the round
+                print(f"Round {round_number + 1}: "
+                      + ', '.join(f'{e} {points[e]:g}' for e in sorted(points, key=lambda e: -points[e])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a self-play tournament between engines.')
+    parser.add_argument('--engine', action='append', default=[],
+                        help='engine spec, e.g. minimax:depth=3 (repeat for each entrant)')
+    parser.add_argument('--format', choices=['roundrobin', 'swiss'], default='roundrobin')
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--games-per-pair', type=int, default=2,
+                        help='games per pairing and round, colors alternate')
+    parser.add_argument('--random-plies', type=int, default=2,
+                        help='random opening plies, so deterministic engines play varied games')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=os.path.join('tmp', 'result', 'tournament.jsonl'))
+    parser.add_argument('--db', default=None, help='also store the games in this GameStore')
+    parser.add_argument('--anchor', default=None, help='engine whose rating is pinned at 0')
+    parser.add_argument('--report', action='store_true', help='only print ratings from --out')
+    args = parser.parse_args()
+
+    if not args.report:
+        engines = list(dict.fromkeys(args.engine))
+        if len(engines) < 2:
+            parser.error('at least two different --engine specs are needed')
+        for spec in engines:
+            parse_engine(spec)  # Fail on bad specs before starting any workers
+        store = None
+        if args.db:
+            from records import GameStore
+            store = GameStore(args.db)
+        tournament = Tournament(engines, args.out, args.games_per_pair, args.seed,
+                                args.random_plies, args.workers, store)
+        start = time.perf_counter()
+        if args.format == 'swiss':
+            tournament.run_swiss(args.rounds)
+        else:
+            tournament.run_round_robin(args.rounds)
+        if store is not None:
+            store.close()
+        print(f"Played {tournament.played_now} games in {time.perf_counter() - start:.1f} s")
+
+    print_ratings(compute_ratings(load_results(args.out).values(), args.anchor))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+import heapq
+import itertools
+import queue
+import selectors
+import socket
+import threading
+import time
+
+
+class Timer:
+    """Handle for a callback scheduled on the transport loop."""
+
+    def __init__(self, when, callback, interval=None):
+        self.when = when
+        self.callback = callback
+        self.interval = interval  # Repeat every interval seconds if set
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Connection:
+    """A peer connection on the loop, with the bytes still waiting to go out."""
+
+    def __init__(self, handler, on_close):
+        self.handler = handler
+        self.on_close = on_close
+        self.outbound = bytearray()
+
+
+class SelectorTransport:
+    """Single-threaded event loop for every PeerNetwork in the process.
+
+    One thread multiplexes the TCP listeners, all peer connections and a
+    shared UDP discovery socket with ``selectors`` (epoll on Linux), so the
+    thread count stays flat no matter how many peers exist. Every socket it
+    watches is switched to non-blocking mode, so a readiness report that is
+    stale by the time the loop reads (a client that resets before accept,
+    say) costs one BlockingIOError instead of stalling every peer. Sends
+    go through send(): what the socket will not take at once is queued
+    and written when the loop reports the socket writable, so a peer that
+    stops reading holds up nobody else.
+
+    Callbacks run on the loop thread and must not block.
+    """
+
+    RECV_SIZE = 4096
+    MAX_OUTBOUND = 1024 * 1024  # Bytes queued for a peer that is not reading before dropping it
+    DISCOVERY_BATCH = 256  # Datagrams read per wakeup of the discovery socket
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.pending = queue.SimpleQueue()  # Callables to run on the loop thread
+        self.timers = []
+        self.timer_ids = itertools.count()  # Tie-breaker for the timer heap
+        self.discovery_socket = None
+        self.discovery_handlers = {}
+        self.discovery_decode = None
+        self.connections = {}  # socket -> Connection; only touched on the loop thread
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        # Socket pair used to wake the loop from other threads
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ, self._drain_wakeup)
+
+    def start(self):
+        """Start the loop thread if it is not running."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name='selector-transport', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the loop thread."""
+        self.running = False
+        self._wake()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1)
+        self.thread = None
+
+    def in_loop(self):
+        return threading.current_thread() is self.thread
+
+    def call_soon(self, callback, *args):
+        """Run a callback on the loop thread."""
+        if self.in_loop():
+            callback(*args)
+            return
+        self.pending.put((callback, args))
+        self._wake()
+
+    def call_later(self, delay, callback, interval=None):
+        """Run a callback after delay seconds, repeating every interval if given."""
+        timer = Timer(time.monotonic() + delay, callback, interval)
+        self.call_soon(self._push_timer, timer)
+        return timer
+
+    def _push_timer(self, timer):
+        heapq.heappush(self.timers, (timer.when, next(self.timer_ids), timer))
+
+    def _wake(self):
+        try:
+            self.wakeup_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # Already has a pending wakeup
+
+    def _drain_wakeup(self, mask):
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def add_listener(self, sock, on_accept):
+        """Accept connections on a listening socket: on_accept(client_socket, address)."""
+        sock.setblocking(False)
+
+        def handle(mask):
+            try:
+                client_socket, address = sock.accept()
+            except BlockingIOError:
+                return  # The client went away before we got to it
+            except OSError as e:
+                print(f"TCP accept error: {e}")
+                self._unregister(sock)
+                return
+            on_accept(client_socket, address)
+        self.call_soon(self._register, sock, handle)
+
+    def add_connection(self, sock, on_data, on_close):
+        """Read from a connected socket: on_data(bytes) per read, on_close() at EOF or error."""
+        sock.setblocking(False)
+
+        def handle(mask):
+            if mask & selectors.EVENT_WRITE:
+                self._flush(sock)
+            if not mask & selectors.EVENT_READ:
+                return
+            try:
+                data = sock.recv(self.RECV_SIZE)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                print(f"Message handling error: {e}")
+                data = b''
+            if not data:
+                self._unregister(sock)
+                on_close()
+                return
+            on_data(data)
+
+        def register():
+            self.connections[sock] = Connection(handle, on_close)
+            self._register(sock, handle)
+        self.call_soon(register)
+
+    def send(self, sock, data):
+        """Send bytes on a connection added with add_connection, from any thread.
+
+        Never blocks: whatever the socket cannot take now is written as it
+        drains. A peer with more than MAX_OUTBOUND bytes waiting is closed.
+        """
+        self.call_soon(self._send, sock, bytes(data))
+
+    def _send(self, sock, data):
+        connection = self.connections.get(sock)
+        if connection is None:
+            return  # Closed meanwhile
+        if not connection.outbound:
+            try:
+                data = data[sock.send(data):]
+            except BlockingIOError:
+                pass
+            except OSError as e:
+                self._drop(sock, f"Message send error: {e}")
+                return
+            if not data:
+                return
+            self._watch(sock, connection, selectors.EVENT_READ | selectors.EVENT_WRITE)
+        connection.outbound += data
+        if len(connection.outbound) > self.MAX_OUTBOUND:
+            self._drop(sock, f"Peer stopped reading, {len(connection.outbound)} bytes queued")
+
+    def _flush(self, sock):
+        connection = self.connections.get(sock)
+        if connection is None:
+            return
+        try:
+            del connection.outbound[:sock.send(connection.outbound)]
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._drop(sock, f"Message send error: {e}")
+            return
+        if not connection.outbound:
+            self._watch(sock, connection, selectors.EVENT_READ)
+
+    def _watch(self, sock, connection, events):
+        try:
+            self.selector.modify(sock, events, connection.handler)
+        except (KeyError, ValueError, OSError):
+            pass  # Unregistered or closed; the reader reports it
+
+    def _drop(self, sock, reason):
+        print(reason)
+        connection = self.connections.get(sock)
+        self._unregister(sock)
+        if connection:
+            connection.on_close()
+
+    def add_discovery_handler(self, port, on_datagram, decode=None):
+        """Deliver datagrams from the shared UDP discovery socket: on_datagram(message, addr).
+
+        ``decode(data, addr)`` turns each datagram into the message handed
+        to every handler, or None to drop it; it runs once per datagram
+        however many handlers there are. The first handler's ``decode``
+        is kept. Without one, handlers get the raw bytes. Returns the
+        shared socket, which handlers may also use to send.
+        """
+        with self.lock:
+            if self.discovery_socket is None:
+                udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                # Bound to the wildcard address, so address changes need no re-bind
+                udp_socket.bind(('', port))
+                udp_socket.setblocking(False)
+                self.discovery_socket = udp_socket
+                self.discovery_decode = decode
+                self.call_soon(self._register, udp_socket, self._handle_discovery)
+            self.discovery_handlers[id(on_datagram.__self__)] = on_datagram
+        return self.discovery_socket
+
+    def remove_discovery_handler(self, owner):
+        with self.lock:
+            self.discovery_handlers.pop(id(owner), None)
+
+    def _handle_discovery(self, mask):
+        # Drain what has arrived, up to a batch, so the kernel buffer does not
+        # overflow under a flood while other sockets still get their turn
+        with self.lock:
+            handlers = list(self.discovery_handlers.values())
+            decode = self.discovery_decode
+        for _ in range(self.DISCOVERY_BATCH):
+            try:
+                data, addr = self.discovery_socket.recvfrom(4096)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                print(f"UDP socket error: {e}")
+                return
+            if decode is not None:
+                try:
+                    data = decode(data, addr)
+                except Exception as e:
+                    print(f"Discovery decode error: {e}")
+                    continue
+                if data is None:
+                    continue
+            for handler in handlers:
+                # One player's error must not keep the datagram from the others
+                try:
+                    handler(data, addr)
+                except Exception as e:
+                    print(f"Discovery handler error: {e}")
+
+    def remove(self, sock):
+        """Stop watching a socket (it is not closed)."""
+        self.call_soon(self._unregister, sock)
+
+    def _register(self, sock, handler):
+        try:
+            self.selector.register(sock, selectors.EVENT_READ, handler)
+        except (KeyError, ValueError, OSError) as e:
+            print(f"Transport register error: {e}")
+
+    def _unregister(self, sock):
+        self.connections.pop(sock, None)
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError, OSError):
+            pass  # Already removed or closed
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self.timers)
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback()
+            except Exception as e:
+                print(f"Timer callback error: {e}")
+            if timer.interval is not None and not timer.cancelled:
+                timer.when = now + timer.interval
+                self._push_timer(timer)
+
+    def run(self):
+        """Loop thread body."""
+        while self.running:
+            timeout = None
+            if self.timers:
+                timeout = max(0, self.timers[0][0] - time.monotonic())
+            for key, mask in self.selector.select(timeout):
+                try:
+                    key.data(mask)
+                except Exception as e:
+                    print(f"Transport callback error: {e}")
+            while True:
+                try:
+                    callback, args = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print(f"Transport callback error: {e}")
+            self._run_timers()
+
+
+def send_all(sock, data, timeout=5.0):
+    """sock.sendall() that also works on a non-blocking socket.
+
+    For threads that own their socket; sockets on the transport loop use
+    SelectorTransport.send, which never waits. Waits up to ``timeout``
+    seconds in total for buffer space; raises TimeoutError if the peer
+    stops reading for that long.
+    """
+    view = memoryview(data)
+    deadline = time.monotonic() + timeout
+    with selectors.DefaultSelector() as selector:  # No FD_SETSIZE limit, unlike select()
+        selector.register(sock, selectors.EVENT_WRITE)
+        while view:
+            try:
+                view = view[sock.send(view):]
+            except BlockingIOError:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Peer has not read for {timeout} s")
+                selector.select(remaining)
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> SelectorTransport:
+    """Get the process-wide transport, starting it on first use."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = SelectorTransport()
+                _transport.start()
+    return _transport